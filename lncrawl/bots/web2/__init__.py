@@ -12,7 +12,22 @@ def start():
     elif flask_api.lib.config["dev_mode"] == "false":
         from waitress import serve
 
-        serve(flask_api.flaskapp.app, host=flask_api.lib.HOST, port=flask_api.lib.PORT)
+        lib = flask_api.lib
+        if not lib.SHARED_WORKERS:
+            serve(flask_api.flaskapp.app, host=lib.HOST, port=lib.PORT, threads=lib.API_THREADS)
+            return
+
+        # Several processes on the same port, see flask_api/workers.py
+        sockets = [flask_api.workers.listen_socket(lib.HOST, lib.PORT)]
+        if lib.IS_OWNER:
+            # Requests forwarded by the other workers
+            sockets.append(
+                flask_api.workers.listen_socket("127.0.0.1", lib.OWNER_PORT, reuse_port=False)
+            )
+            flask_api.workers.spawn_workers(lib.API_WORKERS)
+        else:
+            flask_api.workers.watch_owner()
+        serve(flask_api.flaskapp.app, sockets=sockets, threads=lib.API_THREADS)
 
     else:
         raise ValueError(
@@ -1,18 +1,47 @@
 from __future__ import annotations
-from dataclasses import dataclass, field
+import sys
+from dataclasses import dataclass, field, fields
 from pathlib import Path
 from urllib.parse import quote_plus, quote
-from typing import Any, List, Optional
+from typing import Any, FrozenSet, List, Optional
 
 from . import datetools
 from . import sanatize
 from . import naming_rules
+from .ratings import Ratings
 
 
-@dataclass
+def _slotted(cls):
+    """
+    Rebuild a dataclass with __slots__, like dataclass(slots=True) which needs python 3.10.
+    The defaults are already bound in __init__, the class attributes holding them are dropped.
+    """
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(f.name for f in fields(cls))
+    cls_dict["__slots__"] = field_names
+    for name in field_names:
+        cls_dict.pop(name, None)
+    cls_dict.pop("__dict__", None)
+    cls_dict.pop("__weakref__", None)
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+# Cached attribute : fields whose assignment clears it
+_NOVEL_CACHES = {
+    "path": ("_cleaned_folder_name", "_slug"),
+    "title": ("_search_words",),
+    "author": ("_search_words",),
+    "tags": ("_sanatized_tags", "_sanatized_tag_set"),
+}
+
+
+@_slotted
+@dataclass(eq=False)
 class Novel:
     """
     Holds information about a novel.
+    Derived attributes (slug, search words...) are computed on first access and
+    cached until one of their fields is assigned again.
     """
 
     path: Path = field(repr=False)
@@ -35,46 +64,73 @@ class Novel:
     )
     clicks: dict = field(default_factory=dict)
     sources: list[NovelFromSource] = field(default_factory=list, repr=False)
-    ratings: dict[str, int] = field(default_factory=dict, repr=False)
+    ratings: Ratings = field(default_factory=Ratings, repr=False)
+    stats_seq: int = field(default=0, repr=False)  # last stats journal event in stats.json
+
+    # Cache
+    _cleaned_folder_name: Optional[str] = field(default=None, init=False, repr=False)
+    _slug: Optional[str] = field(default=None, init=False, repr=False)
+    _search_words: Optional[List[str]] = field(default=None, init=False, repr=False)
+    _sanatized_tags: Optional[List[str]] = field(default=None, init=False, repr=False)
+    _sanatized_tag_set: Optional[FrozenSet[str]] = field(default=None, init=False, repr=False)
+
+    def __setattr__(self, name: str, value: Any):
+        object.__setattr__(self, name, value)
+        for cache in _NOVEL_CACHES.get(name, ()):
+            object.__setattr__(self, cache, None)
 
     # Auto
-    current_week_clicks: int = field(
-        init=False,
-        default=property(
-            lambda self: self.clicks[datetools.current_week()]
-            if datetools.current_week() in self.clicks
-            else 0
-        ),
-    )
+    @property
+    def current_week_clicks(self) -> int:
+        return self.clicks.get(datetools.current_week(), 0)
 
-    sanatized_tags: List[str] = field(
-        init=False, default=property(lambda self: [sanatize.sanitize(t) for t in self.tags])
-    )
+    @property
+    def sanatized_tags(self) -> List[str]:
+        if self._sanatized_tags is None:
+            self._sanatized_tags = [sanatize.sanitize(t) for t in self.tags]
+        return self._sanatized_tags
 
-    search_words: List[str] = field(
-        init=False,
-        default=property(
-            lambda self: sanatize.sanitize(self.title + " " + self.author).split(" ")
-        ),
-    )
-    overall_rating: float = field(
-        init=False,
-        default=property(lambda self: sum(self.ratings.values()) / len(self.ratings)),
-    )
-    ratings_count: int = field(
-        init=False, default=property(lambda self: len(self.ratings))
-    )
-    source_count: int = field(
-        init=False, default=property(lambda self: len(self.sources))
-    )
-    str_path: str = field(init=False, default=property(lambda self: str(self.path)))
-    cleaned_folder_name: str = field(
-        init=False,
-        default=property(lambda self: naming_rules.clean_name(self.path.name)),
-    )
-    slug: str = field(
-        init=False, default=property(lambda self: quote_plus(self.cleaned_folder_name))
-    )
+    @property
+    def sanatized_tag_set(self) -> FrozenSet[str]:
+        """One set for every sort order labelling the novel with its tags"""
+        if self._sanatized_tag_set is None:
+            self._sanatized_tag_set = frozenset(self.sanatized_tags)
+        return self._sanatized_tag_set
+
+    @property
+    def search_words(self) -> List[str]:
+        if self._search_words is None:
+            self._search_words = sanatize.sanitize(self.title + " " + self.author).split(" ")
+        return self._search_words
+
+    @property
+    def overall_rating(self) -> float:
+        ratings = self.ratings
+        return ratings.total / ratings.count if ratings.count else 0
+
+    @property
+    def ratings_count(self) -> int:
+        return self.ratings.count
+
+    @property
+    def source_count(self) -> int:
+        return len(self.sources)
+
+    @property
+    def str_path(self) -> str:
+        return str(self.path)
+
+    @property
+    def cleaned_folder_name(self) -> str:
+        if self._cleaned_folder_name is None:
+            self._cleaned_folder_name = naming_rules.clean_name(self.path.name)
+        return self._cleaned_folder_name
+
+    @property
+    def slug(self) -> str:
+        if self._slug is None:
+            self._slug = quote_plus(self.cleaned_folder_name)
+        return self._slug
 
     def __eq__(self, other: Any) -> bool:
         """
@@ -128,6 +184,13 @@ class Novel:
         }
 
 
+_SOURCE_CACHES = {
+    "path": ("_slug", "_xml_url"),
+    "novel": ("_xml_url",),
+}
+
+
+@_slotted
 @dataclass
 class NovelFromSource:
     """
@@ -143,7 +206,6 @@ class NovelFromSource:
     author: str = ""
     chapter_count: int = 0
     volume_count: int = 0
-    slug: str = ""
     first: str = ""
     latest: str = ""
     summary: str = ""
@@ -153,19 +215,32 @@ class NovelFromSource:
     last_update_date: str = ""  # isoformat : ex : "2022-09-10T20:59:35.166239"
     source_rating: int = 0
 
+    # Cache
+    _slug: Optional[str] = field(default=None, init=False, repr=False)
+    _xml_url: Optional[str] = field(default=None, init=False, repr=False)
+
+    def __setattr__(self, name: str, value: Any):
+        object.__setattr__(self, name, value)
+        for cache in _SOURCE_CACHES.get(name, ()):
+            object.__setattr__(self, cache, None)
+
     # Auto
+    @property
+    def slug(self) -> str:
+        if self._slug is None:
+            # The same source folder names in every novel : one string each
+            self._slug = sys.intern(quote_plus(self.path.name))
+        return self._slug
 
-    slug: str = field(
-        init=False, default=property(lambda self: quote_plus(self.path.name))
-    )
-    str_path: str = field(init=False, default=property(lambda self: str(self.path)))
+    @property
+    def str_path(self) -> str:
+        return str(self.path)
 
-    xml_url: str = field(
-        init=False,
-        default=property(
-            lambda self: f"{quote(self.novel.path.name)}/{quote(self.path.name)}/"
-        ),
-    )
+    @property
+    def xml_url(self) -> str:
+        if self._xml_url is None:
+            self._xml_url = f"{quote(self.novel.path.name)}/{quote(self.path.name)}/"
+        return self._xml_url
 
     def asdict(self, *args, **kwargs) -> dict:
         """
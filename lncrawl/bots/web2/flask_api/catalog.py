@@ -0,0 +1,123 @@
+"""
+Persistent snapshot of the per-source metadata read from every meta.json.
+
+Decoding meta.json is by far the slowest part of loading the library, so the
+useful fields are kept in a msgpack file keyed by the source folder path and
+the mtime/size of its meta.json. On startup, only the sources whose meta.json
+changed since the snapshot was written are decoded again.
+"""
+from __future__ import annotations
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import msgspec
+
+# Bump when SourceInfo changes so old snapshots are ignored instead of misread
+CATALOG_VERSION = 1
+
+
+class SourceInfo(msgspec.Struct, array_like=True):
+    """Compact record of what the website needs from a source meta.json"""
+
+    mtime_ns: int
+    size: int
+    title: str
+    author: str
+    chapter_count: int
+    volume_count: int
+    first: str
+    latest: str
+    summary: str
+    tags: List[str]
+    language: Optional[str]
+    url: str
+    last_update_date: Optional[str] = ""
+
+
+class CatalogSnapshot(msgspec.Struct):
+    version: int
+    sources: Dict[str, SourceInfo] = {}
+
+
+class Catalog:
+    """
+    In memory view of the snapshot file.
+    lookup() returns the cached SourceInfo only if meta.json didn't change.
+    """
+
+    def __init__(self, snapshot_file: Path):
+        self.snapshot_file = snapshot_file
+        self.sources: Dict[str, SourceInfo] = {}
+        self._seen: set[str] = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if snapshot_file.exists():
+            try:
+                with open(snapshot_file, "rb") as f:
+                    snapshot = msgspec.msgpack.decode(f.read(), type=CatalogSnapshot)
+                if snapshot.version == CATALOG_VERSION:
+                    self.sources = snapshot.sources
+                else:
+                    print("Catalog snapshot is outdated, rebuilding it")
+            except (msgspec.DecodeError, msgspec.ValidationError, OSError) as e:
+                print(f"Error while reading catalog snapshot, rebuilding it: {e}")
+
+    @staticmethod
+    def key(source_folder: Path) -> str:
+        return str(source_folder.absolute())
+
+    def lookup(self, source_folder: Path) -> Optional[SourceInfo]:
+        """Return the cached info if meta.json has the same mtime and size"""
+        key = self.key(source_folder)
+        self._seen.add(key)
+        info = self.sources.get(key)
+        if info is None:
+            return None
+        try:
+            stat = (source_folder / "meta.json").stat()
+        except OSError:
+            return None
+
+        if info.mtime_ns != stat.st_mtime_ns or info.size != stat.st_size:
+            return None
+        return info
+
+    def store(self, source_folder: Path, info: SourceInfo):
+        key = self.key(source_folder)
+        with self._lock:
+            self._seen.add(key)
+            self.sources[key] = info
+            self._dirty = True
+
+    def clear(self):
+        """Forget every cached source : the next load will be a cold rebuild"""
+        with self._lock:
+            self.sources = {}
+            self._dirty = True
+
+    def prune_unseen(self):
+        """Drop the sources that were not encountered since the catalog was opened"""
+        with self._lock:
+            removed = [key for key in self.sources if key not in self._seen]
+            for key in removed:
+                del self.sources[key]
+            if removed:
+                self._dirty = True
+
+    def save(self):
+        """Atomically write the snapshot (temp file + rename) if anything changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = msgspec.msgpack.encode(
+                CatalogSnapshot(version=CATALOG_VERSION, sources=self.sources)
+            )
+            self._dirty = False
+
+        tmp_file = self.snapshot_file.with_name(self.snapshot_file.name + ".tmp")
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        os.replace(tmp_file, self.snapshot_file)
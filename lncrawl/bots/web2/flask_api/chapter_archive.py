@@ -0,0 +1,249 @@
+"""
+Random access archive of the chapters of a source (chapters.lnca), read without 7z.
+
+json.7z is a solid LZMA2 archive : reading one chapter means running 7z and
+decompressing the archive up to it. Here each chapter file is compressed alone
+(zlib, or zstd if the zstandard module is installed) and an index gives the
+offset of each frame, so a chapter is one slice of the mmap'ed file and one
+decompression.
+
+Layout (little endian) :
+    header  : magic "LNCA", version u8, codec u8, 2 bytes padding,
+              chapter count u32, index offset u64
+    frames  : compressed NNNNN.json files, one after the other
+    index   : chapter count * (chapter number u32, frame offset u64, frame size u32)
+"""
+from __future__ import annotations
+import json
+import mmap
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_NAME = "chapters.lnca"
+MAGIC = b"LNCA"
+VERSION = 1
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+_HEADER = struct.Struct("<4sBB2xIQ")
+_INDEX_ENTRY = struct.Struct("<IQI")
+
+# Opened archives, each keeps a file descriptor and a mmap
+MAX_OPEN_ARCHIVES = 128
+
+
+class ChapterArchiveError(Exception):
+    pass
+
+
+# region Write
+
+
+def _compressor(codec: int):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    return lambda data: zlib.compress(data, ZLIB_LEVEL)
+
+
+def _write_frames(archive_file: Path, codec: int, frames: Iterable[Tuple[int, bytes]]) -> int:
+    """Atomically write an archive of (chapter number, compressed frame)"""
+    index = []
+    tmp_file = archive_file.with_name(archive_file.name + ".tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, codec, 0, 0))
+        offset = _HEADER.size
+        for number, frame in frames:
+            f.write(frame)
+            index.append((number, offset, len(frame)))
+            offset += len(frame)
+
+        index.sort()
+        for entry in index:
+            f.write(_INDEX_ENTRY.pack(*entry))
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, codec, len(index), offset))
+    os.replace(tmp_file, archive_file)
+    return len(index)
+
+
+def write_archive(archive_file: Path, chapters: Iterable[Tuple[int, bytes]], codec: Optional[int] = None):
+    """Atomically write an archive of (chapter number, chapter file content)"""
+    if codec is None:
+        codec = CODEC_ZSTD if zstandard else CODEC_ZLIB
+    compress = _compressor(codec)
+    return _write_frames(archive_file, codec, ((number, compress(data)) for number, data in chapters))
+
+
+def _chapter_files(json_folder: Path) -> Iterable[Tuple[int, bytes]]:
+    for file in sorted(json_folder.glob("*.json")):
+        if file.stem.isdigit():
+            yield int(file.stem), file.read_bytes()
+
+
+def convert_json_folder(json_folder: Path, archive_file: Path) -> int:
+    return write_archive(archive_file, _chapter_files(json_folder))
+
+
+def merge_json_folder(json_folder: Path, archive_file: Path) -> int:
+    """
+    Add the chapter files of json_folder to an existing archive, replacing the
+    chapters with the same number. The frames of the other chapters are copied
+    as they are : only the new files are compressed.
+    """
+    archive = ChapterArchive(archive_file)
+    try:
+        new_files = {int(file.stem): file for file in json_folder.glob("*.json") if file.stem.isdigit()}
+        if archive.codec == CODEC_ZSTD and zstandard is None:
+            raise ChapterArchiveError(f"zstandard is needed to write {archive_file}")
+        compress = _compressor(archive.codec)
+
+        def frames():
+            for number, (offset, size) in sorted(archive.index.items()):
+                if number not in new_files:
+                    yield number, archive._mmap[offset : offset + size]
+            for number in sorted(new_files):
+                yield number, compress(new_files[number].read_bytes())
+
+        return _write_frames(archive_file, archive.codec, frames())
+    finally:
+        archive.close()
+
+
+def convert_7z(tar_file_path: Path, archive_file: Path) -> int:
+    """Extract json.7z once in a temporary folder, then write the archive"""
+    with tempfile.TemporaryDirectory(dir=archive_file.parent) as tmp:
+        result = subprocess.run(["7z", "x", tar_file_path, f"-o{tmp}", "-bso0"])
+        if result.returncode != 0:
+            raise ChapterArchiveError(f"Failed to extract {tar_file_path}")
+        return convert_json_folder(Path(tmp) / "json", archive_file)
+
+
+def convert_source(source_folder: Path) -> bool:
+    """
+    Write the archive of a source from its json folder, or from json.7z.
+    The chapters of a json folder written by an update are merged in the
+    existing archive. Used as a compression task : returns True on success.
+    """
+    archive_file = source_folder / ARCHIVE_NAME
+    json_folder = source_folder / "json"
+    tar_file_path = source_folder / "json.7z"
+    try:
+        if archive_file.exists() and json_folder.exists():
+            # Chapters downloaded since the archive was written
+            count = merge_json_folder(json_folder, archive_file)
+        elif json_folder.exists() and not tar_file_path.exists():
+            count = convert_json_folder(json_folder, archive_file)
+        elif tar_file_path.exists():
+            count = convert_7z(tar_file_path, archive_file)
+            if json_folder.exists():
+                # Chapters downloaded since json.7z was written
+                count = merge_json_folder(json_folder, archive_file)
+        else:
+            return False
+    except Exception as e:
+        print(f"Error while writing the chapter archive of {source_folder}: {e}")
+        return False
+    print(f"Chapter archive written : {archive_file} ({count} chapters)")
+    return True
+
+
+# endregion
+
+# region Read
+
+
+class ChapterArchive:
+    def __init__(self, archive_file: Path):
+        self.archive_file = archive_file
+        with open(archive_file, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, codec, count, index_offset = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ChapterArchiveError(f"Not a chapter archive : {archive_file}")
+        self.codec = codec
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise ChapterArchiveError(f"zstandard is needed to read {archive_file}")
+            self._decompress = zstandard.ZstdDecompressor().decompress
+        else:
+            self._decompress = zlib.decompress
+
+        self.index: Dict[int, Tuple[int, int]] = {
+            number: (offset, size)
+            for number, offset, size in _INDEX_ENTRY.iter_unpack(
+                self._mmap[index_offset : index_offset + count * _INDEX_ENTRY.size]
+            )
+        }
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, chapter_number: int):
+        return chapter_number in self.index
+
+    def read(self, chapter_number: int) -> Optional[bytes]:
+        """Content of the chapter file, None if the chapter is not in the archive"""
+        entry = self.index.get(chapter_number)
+        if entry is None:
+            return None
+        offset, size = entry
+        return self._decompress(self._mmap[offset : offset + size])
+
+    def close(self):
+        self._mmap.close()
+
+
+_open_archives: "OrderedDict[Path, ChapterArchive]" = OrderedDict()
+_open_lock = threading.Lock()
+
+
+def open_archive(archive_file: Path) -> Optional[ChapterArchive]:
+    """Opened archive, kept open between calls and reopened when the file changes"""
+    try:
+        stat = archive_file.stat()
+    except FileNotFoundError:
+        return None
+    stamp = (stat.st_mtime_ns, stat.st_size)
+
+    with _open_lock:
+        archive = _open_archives.get(archive_file)
+        if archive is not None and archive.stamp == stamp:
+            _open_archives.move_to_end(archive_file)
+            return archive
+
+    # The old mmap is left to the garbage collector : another thread may still read it
+    archive = ChapterArchive(archive_file)
+    with _open_lock:
+        _open_archives[archive_file] = archive
+        _open_archives.move_to_end(archive_file)
+        while len(_open_archives) > MAX_OPEN_ARCHIVES:
+            _open_archives.popitem(last=False)
+    return archive
+
+
+def read_chapter(source_folder: Path, chapter_number: int) -> Optional[dict]:
+    archive = open_archive(source_folder / ARCHIVE_NAME)
+    if archive is None:
+        return None
+    data = archive.read(chapter_number)
+    return json.loads(data) if data is not None else None
+
+
+# endregion
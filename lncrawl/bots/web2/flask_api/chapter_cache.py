@@ -0,0 +1,148 @@
+"""
+Cache of the chapters served by /api/chapter/, already serialized to json.
+
+The cache is a LRU bounded by the size of the cached json (bytes), shared by
+every request. When chapter N is served, chapter N+1 is loaded in the background
+since readers go through the chapters in order.
+"""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Set, Tuple
+
+import msgspec
+
+if TYPE_CHECKING:
+    from .Novel import NovelFromSource
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+Key = Tuple[str, int]  # str(source path), chapter number
+
+
+class ChapterCache:
+    def __init__(
+        self,
+        max_bytes: int,
+        load: Callable[[NovelFromSource, int], Optional[dict]],
+        prefetch: bool = True,
+    ):
+        self.max_bytes = max_bytes
+        self.load = load
+        self.prefetch_enabled = prefetch
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self._entries: "OrderedDict[Key, bytes]" = OrderedDict()
+        self._prefetching: Set[Key] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chapter-prefetch")
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, source: NovelFromSource, chapter_number: int) -> Optional[bytes]:
+        """The chapter as json, None if it doesn't exist"""
+        key = (str(source.path), chapter_number)
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if content is None:
+            content = self._load(source, chapter_number)
+            if content is None:
+                return None
+            self._put(key, content)
+
+        if self.prefetch_enabled and chapter_number < source.chapter_count:
+            self._prefetch(source, chapter_number + 1)
+        return content
+
+    def _load(self, source: NovelFromSource, chapter_number: int) -> Optional[bytes]:
+        chapter = self.load(source, chapter_number)
+        return msgspec.json.encode(chapter) if chapter is not None else None
+
+    def _put(self, key: Key, content: bytes):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = content
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def _prefetch(self, source: NovelFromSource, chapter_number: int):
+        key = (str(source.path), chapter_number)
+        with self._lock:
+            if key in self._entries or key in self._prefetching:
+                return
+            self._prefetching.add(key)
+        self._executor.submit(self._run_prefetch, source, chapter_number, key)
+
+    def _run_prefetch(self, source: NovelFromSource, chapter_number: int, key: Key):
+        try:
+            content = self._load(source, chapter_number)
+            if content is not None:
+                self._put(key, content)
+                with self._lock:
+                    self.prefetches += 1
+        except Exception as e:
+            print(f"Error while prefetching chapter {chapter_number} of {source.path}: {e}")
+        finally:
+            with self._lock:
+                self._prefetching.discard(key)
+
+    def invalidate(self, source_path: Path, chapter_numbers: Optional[Iterable[int]] = None):
+        """
+        Drop the chapters of a source, ex : after it was downloaded again.
+        chapter_numbers : only these chapters, ex : the chapters downloaded by an update
+        """
+        source_path = str(source_path)
+        with self._lock:
+            if chapter_numbers is not None:
+                keys = [(source_path, number) for number in chapter_numbers]
+            else:
+                keys = [k for k in self._entries if k[0] == source_path]
+            for key in keys:
+                content = self._entries.pop(key, None)
+                if content is not None:
+                    self.size -= len(content)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0,
+                "evictions": self.evictions,
+                "prefetches": self.prefetches,
+            }
+
+
+def chapter_response(content: bytes, **fields) -> bytes:
+    """{"content": <cached json>, **fields} without parsing the cached json again"""
+    if not fields:
+        return b'{"content":' + content + b"}"
+    return b'{"content":' + content + b"," + msgspec.json.encode(fields)[1:]
@@ -0,0 +1,110 @@
+"""
+Pages of the chapter list of a source (chapterlist.pages), written next to meta.json.
+
+/api/chapterlist/ only needs 100 chapters, but meta.json holds every chapter and
+the session. The pages are serialized once to json, and a request reads the
+header, one offset and one page, whatever the length of the novel.
+
+Layout (little endian) :
+    header  : magic "LNCL", version u8, 3 bytes padding,
+              page size u32, chapter count u32, page count u32
+    offsets : page count * (page offset u64, page size u32)
+    pages   : json list of the chapters of each page
+"""
+from __future__ import annotations
+import json
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Optional, Tuple
+
+import msgspec
+
+FILE_NAME = "chapterlist.pages"
+MAGIC = b"LNCL"
+VERSION = 1
+PAGE_SIZE = 100
+
+_HEADER = struct.Struct("<4sB3xIII")
+_OFFSET = struct.Struct("<QI")
+
+# Read once at import : setting the umask is not thread safe
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def write_chapter_list(source_folder: Path, page_size: int = PAGE_SIZE) -> int:
+    """Write the pages from meta.json, returns the number of chapters"""
+    with open(source_folder / "meta.json", "r", encoding="utf-8") as f:
+        data = json.load(f)
+    # For backward compatibility
+    chapters = data["novel"]["chapters"] if "novel" in data else data["chapters"]
+
+    pages = [
+        msgspec.json.encode(chapters[start : start + page_size])
+        for start in range(0, len(chapters), page_size)
+    ]
+    offset = _HEADER.size + len(pages) * _OFFSET.size
+
+    # Rebuilt on the request path : concurrent requests each write their own temporary file
+    fd, tmp_file = tempfile.mkstemp(prefix=FILE_NAME + ".", suffix=".tmp", dir=source_folder)
+    try:
+        with open(fd, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, page_size, len(chapters), len(pages)))
+            for page in pages:
+                f.write(_OFFSET.pack(offset, len(page)))
+                offset += len(page)
+            for page in pages:
+                f.write(page)
+        # mkstemp creates it readable by the owner only
+        os.chmod(tmp_file, 0o666 & ~_UMASK)
+        os.replace(tmp_file, source_folder / FILE_NAME)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except FileNotFoundError:
+            pass
+        raise
+    return len(chapters)
+
+
+def is_up_to_date(source_folder: Path) -> bool:
+    try:
+        return (source_folder / FILE_NAME).stat().st_mtime_ns >= (
+            source_folder / "meta.json"
+        ).stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def read_page(source_folder: Path, page: int) -> Tuple[bytes, int, int]:
+    """
+    (json list of the chapters of the page, chapter count, page size).
+    The pages are written first if meta.json changed since the last time.
+    """
+    if not is_up_to_date(source_folder):
+        write_chapter_list(source_folder)
+
+    result = _read_page(source_folder, page)
+    if result is None:
+        # Written by another version
+        write_chapter_list(source_folder)
+        result = _read_page(source_folder, page)
+    return result
+
+
+def _read_page(source_folder: Path, page: int) -> Optional[Tuple[bytes, int, int]]:
+    with open(source_folder / FILE_NAME, "rb") as f:
+        magic, version, page_size, chapter_count, page_count = _HEADER.unpack(
+            f.read(_HEADER.size)
+        )
+        if magic != MAGIC or version != VERSION:
+            return None
+        if not 0 <= page < page_count:
+            return b"[]", chapter_count, page_size
+
+        f.seek(_HEADER.size + page * _OFFSET.size)
+        offset, size = _OFFSET.unpack(f.read(_OFFSET.size))
+        f.seek(offset)
+        return f.read(size), chapter_count, page_size
@@ -0,0 +1,252 @@
+"""
+Storage of the comments of a page (novel page or chapter page).
+
+The comments of a page are a snapshot (00001.json, same format as before) and an
+append-only log of the events since the snapshot (00001.log, one json line per
+post or reaction). Posting or reacting appends one line : the snapshot is only
+rewritten every COMPACT_EVENTS events.
+
+Loaded pages are kept in memory as the materialized thread tree, with an
+id : comment index and the likes/dislikes as sets. Writes to a page are
+serialized by its lock. Replaying an event twice does nothing (posts are
+skipped if their id is known, reactions set the state of the user), so a crash
+between a compaction and the log truncation is harmless.
+
+With several API workers (workers.py), only the owner writes : the other workers
+read the new lines of the log, or the whole page after a compaction.
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+MAX_PAGES = 256  # pages kept in memory
+COMPACT_EVENTS = 200  # events in the log before the snapshot is rewritten
+REACTIONS = ("like", "dislike", "none")
+
+
+class CommentNotFound(Exception):
+    pass
+
+
+class CommentPage:
+    def __init__(self, path: Path, lock: threading.Lock):
+        self.path = path
+        self.log_path = path.with_suffix(".log")
+        self.lock = lock
+        self.sources: Dict[str, List[dict]] = {}  # source : top level comments
+        self.by_id: Dict[str, dict] = {}
+        self.log_events = 0
+        self._snapshot_mtime = 0
+        self._log_offset = 0  # bytes of the log applied
+        self._rendered: Optional[Dict[str, List[dict]]] = None
+
+    # region Load
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+                self._snapshot_mtime = os.fstat(f.fileno()).st_mtime_ns
+        except FileNotFoundError:
+            snapshot = {}
+            self._snapshot_mtime = 0
+        for source, comments in snapshot.items():
+            self.sources[source] = comments
+            self._index(comments)
+        self._log_offset = 0
+        self._read_log()
+
+    def _read_log(self):
+        """Apply the events written in the log since the last read"""
+        try:
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # The last line can be in the middle of being written by another worker
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                self._apply(json.loads(line))
+            except (ValueError, CommentNotFound):
+                # Line cut by a crash
+                continue
+            self.log_events += 1
+        self._log_offset += end
+
+    def refresh(self):
+        """Read the events written by another worker, the whole page if it was compacted"""
+        with self.lock:
+            try:
+                snapshot_mtime = self.path.stat().st_mtime_ns
+            except FileNotFoundError:
+                snapshot_mtime = 0
+            try:
+                log_size = self.log_path.stat().st_size
+            except FileNotFoundError:
+                log_size = 0
+            if snapshot_mtime != self._snapshot_mtime or log_size < self._log_offset:
+                self.sources = {}
+                self.by_id = {}
+                self.log_events = 0
+                self._rendered = None
+                self.load()
+            elif log_size > self._log_offset:
+                self._read_log()
+
+    def _index(self, comments: List[dict]):
+        for comment in comments:
+            comment["likes"] = set(comment["likes"])
+            comment["dislikes"] = set(comment["dislikes"])
+            self.by_id[comment["id"]] = comment
+            self._index(comment["replies"])
+
+    # endregion
+
+    # region Events
+
+    def _apply(self, event: dict):
+        if event["type"] == "post":
+            comment = event["comment"]
+            if comment["id"] in self.by_id:
+                return
+            reply_to = comment.get("reply_to")
+            if reply_to:
+                parent = self.by_id.get(reply_to)
+                if parent is None:
+                    raise CommentNotFound(reply_to)
+                siblings = parent["replies"]
+            else:
+                siblings = self.sources.setdefault(event["source"], [])
+            comment = dict(comment, likes=set(), dislikes=set(), replies=[])
+            siblings.append(comment)
+            self.by_id[comment["id"]] = comment
+
+        elif event["type"] == "reaction":
+            comment = self.by_id.get(event["id"])
+            if comment is None:
+                raise CommentNotFound(event["id"])
+            user = event["user"]
+            comment["likes"].discard(user)
+            comment["dislikes"].discard(user)
+            if event["reaction"] == "like":
+                comment["likes"].add(user)
+            elif event["reaction"] == "dislike":
+                comment["dislikes"].add(user)
+
+        self._rendered = None
+
+    def append(self, event: dict):
+        """Apply an event and add it to the log, called with the lock held"""
+        self._apply(event)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        line = (json.dumps(event) + "\n").encode("utf-8")
+        with open(self.log_path, "ab") as f:
+            f.write(line)
+        self._log_offset += len(line)
+        self.log_events += 1
+        if self.log_events >= COMPACT_EVENTS:
+            self.compact()
+
+    def compact(self):
+        """Write the snapshot, then empty the log. Called with the lock held"""
+        tmp_file = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.sources, f, default=sorted)
+        os.replace(tmp_file, self.path)
+        self.log_path.unlink(missing_ok=True)
+        self._snapshot_mtime = self.path.stat().st_mtime_ns
+        self._log_offset = 0
+        self.log_events = 0
+
+    # endregion
+
+    def render(self) -> Dict[str, List[dict]]:
+        """The comments per source as sent to the client, likes and dislikes counted"""
+        with self.lock:
+            if self._rendered is None:
+                self._rendered = {
+                    source: _render(comments) for source, comments in self.sources.items()
+                }
+            return self._rendered
+
+
+def _render(comments: List[dict]) -> List[dict]:
+    return [
+        dict(
+            comment,
+            likes=len(comment["likes"]),
+            dislikes=len(comment["dislikes"]),
+            replies=_render(comment["replies"]),
+        )
+        for comment in comments
+    ]
+
+
+class CommentStore:
+    def __init__(self, max_pages: int = MAX_PAGES, shared: bool = False):
+        self.max_pages = max_pages
+        # Pages written by another process (workers.py) : read again when their files change
+        self.shared = shared
+        self._pages: "OrderedDict[Path, CommentPage]" = OrderedDict()
+        # Kept after eviction : a page loaded again waits for the writes on the evicted one
+        self._locks: Dict[Path, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def page(self, path: Path) -> CommentPage:
+        with self._lock:
+            page = self._pages.get(path)
+            if page is not None:
+                self._pages.move_to_end(path)
+        if page is not None:
+            if self.shared:
+                page.refresh()
+            return page
+
+        with self._lock:
+            lock = self._locks.setdefault(path, threading.Lock())
+
+        page = CommentPage(path, lock)
+        with lock:
+            page.load()
+        with self._lock:
+            # Loaded by another thread meanwhile
+            page = self._pages.setdefault(path, page)
+            self._pages.move_to_end(path)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return page
+
+    def exists(self, path: Path) -> bool:
+        return path in self._pages or path.exists() or path.with_suffix(".log").exists()
+
+    @contextmanager
+    def _writing(self, path: Path) -> Iterator[CommentPage]:
+        """The page in memory, locked"""
+        while True:
+            page = self.page(path)
+            page.lock.acquire()
+            if self._pages.get(path) is page:
+                break
+            # Evicted meanwhile, the page loaded again is the one to update
+            page.lock.release()
+        try:
+            yield page
+        finally:
+            page.lock.release()
+
+    def post(self, path: Path, source: str, comment: dict):
+        """Add a comment, or a reply if comment["reply_to"] is set. Raises CommentNotFound"""
+        with self._writing(path) as page:
+            page.append({"type": "post", "source": source, "comment": comment})
+
+    def react(self, path: Path, comment_id: str, user: str, reaction: str):
+        """Set the reaction of a user to a comment : like, dislike or none. Raises CommentNotFound"""
+        with self._writing(path) as page:
+            page.append({"type": "reaction", "id": comment_id, "user": user, "reaction": reaction})
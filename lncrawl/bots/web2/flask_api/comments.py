@@ -1,16 +1,16 @@
-from typing import List
 from .Novel import Novel
 from . import flaskapp
 from flask import request
-import json
 from . import lib
 from . import utils
+from . import database
 import uuid
 from . import datetools
 from . import sanatize
 import urllib.parse
 from . import naming_rules
 from . import discord_bot
+from .comment_store import CommentNotFound, REACTIONS
 
 def get_newest_comments(url: str, count: int = 5, offset: int = 0):
     """Get the newest comments for a novel
@@ -73,35 +73,6 @@ def get_source_from_url(url: str):
         return url[2]
 
 
-def prepare_comments(comments: dict):
-    """Recursively prepare the comment data to send to the client"""
-    for comment in comments:
-        comment["likes"] = len(comment["likes"])
-        comment["dislikes"] = len(comment["dislikes"])
-
-        prepare_comments(comment["replies"])
-
-
-def _find_comment(comments: List[dict], comment_id: str):
-    """Recursively find a comment"""
-    for comment in comments:
-        if comment["id"] == comment_id:
-            return comment
-        found = _find_comment(comment["replies"], comment_id)
-        if found:
-            return found
-    return None
-
-
-def find_comment(comments: dict, comment_id: str):
-    """Find a comment in a file"""
-    for source in comments:
-        comment = _find_comment(comments[source], comment_id)
-        if comment:
-            return comment
-    return None
-
-
 @flaskapp.app.route("/api/get_comments")
 @flaskapp.app.route("/get_comments")
 def get_comments():
@@ -111,7 +82,7 @@ def get_comments():
 
     path = get_path_from_url(url)
 
-    if not path.exists():
+    if not database.comment_store.exists(path):
         return {
             "status": "success",
             "content": [],
@@ -119,17 +90,11 @@ def get_comments():
             # "not_loaded": [],
         }, 200
 
-    with open(path, "r", encoding="utf-8") as f:
-        comments = json.load(f)
+    # Cached in the page, rendered again after a post or a reaction
+    comments = dict(database.comment_store.page(path).render())
 
     source = get_source_from_url(url)
-    if not source in comments:
-        comments[source] = []
-
-    for s in comments:
-        prepare_comments(comments[s])
-
-    content = comments[source]
+    content = comments.get(source, [])
     comments[source] = []
 
     # not_loaded = get_newest_comments(url, 5, 0)
@@ -174,34 +139,18 @@ def add_comment():
 
     path = get_path_from_url(url)
 
-    if not path.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({}, f)
-    with open(path, "r", encoding="utf-8") as f:
-        comments = json.load(f)
-
     comment_id_to_reply_to = data.get("reply_to")
     if comment_id_to_reply_to:
         reply["reply_to"] = comment_id_to_reply_to
-        comment_to_reply_to = find_comment(comments, comment_id_to_reply_to)
-        if comment_to_reply_to:
-            comment_to_reply_to["replies"].append(reply)
-        else:
-            return {"status": "error", "message": "Comment not found"}, 400
 
-    else:
-        source = get_source_from_url(url)
-        if not source in comments:
-            comments[source] = []
-        comments[source].append(reply)
-
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(comments, f)
+    try:
+        database.comment_store.post(path, get_source_from_url(url), reply)
+    except CommentNotFound:
+        return {"status": "error", "message": "Comment not found"}, 400
 
     novel: Novel = utils.get_novel_with_url(url)
     if novel:
-        novel.comment_count += 1
+        database.stats_store.add_comment(novel)
 
     print(f"Comment added to {url} by {name} ({text})")
 
@@ -227,38 +176,18 @@ def rate_comment():
 
     path = get_path_from_url(url)
 
-    if not path.exists():
+    if not database.comment_store.exists(path):
         return {"status": "error", "message": "Comment not found"}, 400
 
-    with open(path, "r", encoding="utf-8") as f:
-        comments = json.load(f)
-
-    comment = find_comment(comments, comment_id)
-    if not comment:
-        return {"status": "error", "message": "Comment not found"}, 400
+    if reaction not in REACTIONS:
+        return {"status": "success"}, 200
 
     shuffled_ip = utils.shuffle_ip(
         request.environ.get("HTTP_X_REAL_IP", request.remote_addr)
     )
-    if reaction == "like":
-        if shuffled_ip in comment["dislikes"]:
-            comment["dislikes"].remove(shuffled_ip)
-        if shuffled_ip not in comment["likes"]:
-            comment["likes"].append(shuffled_ip)
-
-    elif reaction == "dislike":
-        if shuffled_ip in comment["likes"]:
-            comment["likes"].remove(shuffled_ip)
-        if shuffled_ip not in comment["dislikes"]:
-            comment["dislikes"].append(shuffled_ip)
-
-    elif reaction == "none":
-        if shuffled_ip in comment["likes"]:
-            comment["likes"].remove(shuffled_ip)
-        if shuffled_ip in comment["dislikes"]:
-            comment["dislikes"].remove(shuffled_ip)
-
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(comments, f)
+    try:
+        database.comment_store.react(path, comment_id, shuffled_ip, reaction)
+    except CommentNotFound:
+        return {"status": "error", "message": "Comment not found"}, 400
 
     return {"status": "success"}, 200
@@ -0,0 +1,334 @@
+"""
+Background compression of the library : chapter archives and json.7z.
+
+A source is compressed when a download leaves its json folder : the chapter
+archive (chapters.lnca) is written from it, then the folder is packed in
+json.7z and deleted. Sources are queued at startup and at the end of each
+download, and compressed by a few worker threads, each driving one
+single-threaded 7z process with a low CPU and IO priority.
+
+The bytes read by the workers are paced by max_bytes_per_second. Sources are
+picked largest first (most disk space saved first) or coldest first (least
+read novels first, the popular ones keep their json folder longer).
+
+Downloads register the sources they write with begin_update / end_update : a
+source being updated is never picked, and a download waits for the compression
+of its source to end before extracting json.7z. Updates only write the new
+chapters in the json folder : they are merged in the chapter archive and added
+to the existing json.7z, nothing is extracted.
+
+Progress is kept in a state file : the sources being compressed when the
+process stopped are finished first at next start, and the sources failing
+repeatedly are left alone until their json folder changes.
+"""
+from __future__ import annotations
+import heapq
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from . import chapter_archive
+from . import utils
+
+ORDERS = ("largest", "coldest")
+MAX_ATTEMPTS = 3
+WORKER_NICENESS = 10
+
+
+def _key(source_folder: Path) -> str:
+    return str(source_folder.absolute())
+
+
+def folder_size(folder: Path) -> int:
+    size = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                size += entry.stat(follow_symlinks=False).st_size
+    return size
+
+
+def needs_archive(source_folder: Path) -> bool:
+    """
+    The chapter archive is written from the json folder before it is compressed,
+    or from json.7z for sources compressed before chapter archives existed
+    """
+    archive_file = source_folder / chapter_archive.ARCHIVE_NAME
+    json_folder = source_folder / "json"
+    try:
+        archive_mtime = archive_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        return json_folder.exists() or (source_folder / "json.7z").exists()
+    try:
+        return json_folder.stat().st_mtime_ns > archive_mtime
+    except FileNotFoundError:
+        return False
+
+
+def needs_7z(source_folder: Path) -> bool:
+    """The json folder is packed in json.7z, or added to it after an update"""
+    return (source_folder / "json").exists()
+
+
+class Throttle:
+    """Paces the bytes read by all the workers, 0 : no limit"""
+
+    def __init__(self, bytes_per_second: float = 0):
+        self.bytes_per_second = bytes_per_second
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def consume(self, size: int):
+        """Wait for the turn of a task reading size bytes"""
+        if self.bytes_per_second <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + size / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+class CompressionScheduler:
+    def __init__(
+        self,
+        state_file: Path,
+        workers: int = 2,
+        max_bytes_per_second: float = 0,
+        order: str = "largest",
+        clicks: Optional[Callable[[Path], int]] = None,
+    ):
+        if order not in ORDERS:
+            raise ValueError(f"Unknown compression order : {order}, expected one of {ORDERS}")
+        self.state_file = state_file
+        self.workers = max(1, workers)
+        self.order = order
+        self.clicks = clicks  # clicks of the novel of a source, for the coldest first order
+        self.throttle = Throttle(max_bytes_per_second)
+        self.running = False
+
+        self._queue: List[Tuple[float, int, str]] = []  # (priority, seq, source folder)
+        self._queued = set()
+        self._seq = 0
+        self._compressing = set()
+        self._updating: Dict[str, int] = {}  # source folder : downloads writing it
+        self._cond = threading.Condition()
+        self._state = self._load_state()
+
+    # region State
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        state.setdefault("in_progress", [])
+        state.setdefault("failed", {})  # source folder : [attempts, json folder mtime]
+        state.setdefault("compressed", 0)
+        state.setdefault("bytes", 0)
+        return state
+
+    def _save_state(self):
+        """Called with the lock held"""
+        self._state["in_progress"] = sorted(self._compressing)
+        tmp_file = self.state_file.with_name(self.state_file.name + ".tmp")
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self._state, f, indent=4)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            print(f"Error while saving the compression state: {e}")
+
+    def _resume(self, source_folder: Path):
+        """Clean up a source whose compression was interrupted"""
+        try:
+            packed = (source_folder / "json.7z").stat().st_mtime_ns >= self._json_mtime(source_folder) > 0
+        except FileNotFoundError:
+            packed = False
+        if packed:
+            # json.7z is only renamed once complete : the folder was being deleted.
+            # An older json.7z : the folder holds chapters of an update not packed yet
+            shutil.rmtree(source_folder / "json", ignore_errors=True)
+
+    def _json_mtime(self, source_folder: Path) -> int:
+        try:
+            return (source_folder / "json").stat().st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _gave_up(self, source_folder: Path) -> bool:
+        attempts, mtime = self._state["failed"].get(_key(source_folder), (0, 0))
+        return attempts >= MAX_ATTEMPTS and mtime == self._json_mtime(source_folder)
+
+    # endregion
+
+    # region Queue
+
+    def _priority(self, source_folder: Path) -> Tuple[float, int]:
+        """(priority, bytes to read) of a source, lowest priority first"""
+        json_folder = source_folder / "json"
+        try:
+            size = folder_size(json_folder) if json_folder.exists() else (source_folder / "json.7z").stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if self.order == "coldest" and self.clicks is not None:
+            return self.clicks(source_folder), size
+        return -size, size
+
+    def _push(self, source_folder: Path, priority: float):
+        """Called with the lock held"""
+        key = _key(source_folder)
+        if key in self._queued or key in self._compressing or key in self._updating:
+            return
+        self._seq += 1
+        heapq.heappush(self._queue, (priority, self._seq, key))
+        self._queued.add(key)
+        self._cond.notify()
+
+    def submit(self, source_folder: Path):
+        """Compress a source in the background, if needed"""
+        if not self.running:
+            return
+        if not (needs_archive(source_folder) or needs_7z(source_folder)):
+            return
+        if self._gave_up(source_folder):
+            return
+        priority, _ = self._priority(source_folder)
+        with self._cond:
+            self._push(source_folder, priority)
+
+    def scan(self, source_folders: List[Path]):
+        """Queue the interrupted sources first, then every source left uncompressed"""
+        resumed = [Path(p) for p in self._state["in_progress"]]
+        for source_folder in resumed:
+            self._resume(source_folder)
+
+        planned = []
+        for i, source_folder in enumerate(resumed + source_folders):
+            if not (needs_archive(source_folder) or needs_7z(source_folder)):
+                continue
+            if self._gave_up(source_folder):
+                continue
+            priority, _ = self._priority(source_folder)
+            planned.append((source_folder, float("-inf") if i < len(resumed) else priority))
+
+        with self._cond:
+            for source_folder, priority in planned:
+                self._push(source_folder, priority)
+        print(f"Compression : {len(planned)} sources queued ({self.order} first)")
+
+    def _next(self) -> str:
+        """Wait for a source nobody is writing, and mark it as being compressed"""
+        with self._cond:
+            while True:
+                while self._queue:
+                    _, _, key = heapq.heappop(self._queue)
+                    self._queued.discard(key)
+                    if key in self._updating:
+                        # Queued again at the end of the download
+                        continue
+                    self._compressing.add(key)
+                    self._save_state()
+                    return key
+                self._cond.wait()
+
+    # endregion
+
+    # region Downloads
+
+    def begin_update(self, source_folder: Path):
+        """A download starts writing a source : wait for its compression to end"""
+        key = _key(source_folder)
+        with self._cond:
+            self._updating[key] = self._updating.get(key, 0) + 1
+            while key in self._compressing:
+                self._cond.wait()
+
+    def is_updating(self, source_folder: Path) -> bool:
+        with self._cond:
+            return _key(source_folder) in self._updating
+
+    def end_update(self, source_folder: Path):
+        """The download is done : compress the new chapters"""
+        key = _key(source_folder)
+        with self._cond:
+            count = self._updating.get(key, 0) - 1
+            if count > 0:
+                self._updating[key] = count
+                return
+            self._updating.pop(key, None)
+        self.submit(source_folder)
+
+    # endregion
+
+    # region Workers
+
+    def _compress(self, source_folder: Path) -> bool:
+        if needs_archive(source_folder) and not chapter_archive.convert_source(source_folder):
+            return False
+        if needs_7z(source_folder):
+            return utils.compress_folder_to_tar_7zip(
+                source_folder, "json", source_folder / "json.7z", low_priority=True, threads=1
+            )
+        return True
+
+    def work(self):
+        try:
+            # Linux : the niceness of a thread, for the chapter archives written in python
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WORKER_NICENESS)
+        except (AttributeError, OSError):
+            pass
+
+        while True:
+            key = self._next()
+            source_folder = Path(key)
+            _, size = self._priority(source_folder)
+            self.throttle.consume(size)
+            mtime = self._json_mtime(source_folder)
+            try:
+                success = self._compress(source_folder)
+            except Exception as e:
+                print(f"Error while compressing {source_folder}: {e}")
+                success = False
+
+            with self._cond:
+                self._compressing.discard(key)
+                if success:
+                    self._state["failed"].pop(key, None)
+                    self._state["compressed"] += 1
+                    self._state["bytes"] += size
+                else:
+                    attempts, _ = self._state["failed"].get(key, (0, 0))
+                    self._state["failed"][key] = [attempts + 1, mtime]
+                self._save_state()
+                # Downloads waiting for this source
+                self._cond.notify_all()
+
+    def start(self, source_folders: List[Path]):
+        self.running = True
+        threading.Thread(target=self.scan, args=(source_folders,), daemon=True).start()
+        for i in range(self.workers):
+            threading.Thread(target=self.work, name=f"compression-{i}", daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "running": self.running,
+                "order": self.order,
+                "workers": self.workers,
+                "max_bytes_per_second": self.throttle.bytes_per_second,
+                "queued": len(self._queue),
+                "compressing": len(self._compressing),
+                "updating": len(self._updating),
+                "compressed": self._state["compressed"],
+                "bytes": self._state["bytes"],
+                "failed": len(self._state["failed"]),
+            }
+
+    # endregion
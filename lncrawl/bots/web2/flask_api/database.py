@@ -1,79 +1,252 @@
-from typing import List, Union, Dict
+from typing import FrozenSet, List, Union, Dict, Tuple
+from pathlib import Path
 from .Novel import Novel, NovelFromSource
 import datetime
 from . import datetools
+from .search_index import SearchIndex
+from .tag_index import TagIndex
+from .sort_orders import SortedOrder
+from .stats_store import StatsStore
+from .chapter_cache import ChapterCache
+from .response_cache import ResponseCache
+from .thumbnails import ThumbnailPipeline
+from .compression import CompressionScheduler
+from .comment_store import CommentStore
+from .job_scheduler import JobScheduler
+from .job_events import JobEvents
+from .job_snapshots import JobSnapshotStore
 
 # placeholders, will be filled by lib.py
 all_tags: Dict[str,list] = {} # sanatized : [raw : count]
 all_novels: List[Novel]
 top_tags:list
 all_sources: List[NovelFromSource]
+stats_store: StatsStore
+chapter_cache: ChapterCache
+response_cache: ResponseCache
+thumbnails: ThumbnailPipeline
+compression: CompressionScheduler
+comment_store: CommentStore
+job_scheduler: JobScheduler
+job_events: JobEvents
+jobs_snapshots: JobSnapshotStore  # search results of the jobs, to retry with another source
+search_index = SearchIndex()
+novel_tag_index = TagIndex()
+source_tag_index = TagIndex()  # sources are filtered with the tags of their novel
+
+# Lookup maps, kept up to date with index_novel / unindex_novel
+novels_by_slug: Dict[str, Novel] = {}  # cleaned folder name : novel
+sources_by_slugs: Dict[Tuple[str, str], NovelFromSource] = {}  # (cleaned folder name, source slug) : source
+sources_by_path: Dict[Path, NovelFromSource] = {}
+
+def _last_update_key(source: NovelFromSource):
+    """Most recent first, sources without date are left out"""
+    if not source.last_update_date:
+        return None
+    try:
+        date = datetime.datetime.fromisoformat(source.last_update_date)
+    except ValueError:
+        return None
+    if date.tzinfo:
+        date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (-(date - datetime.datetime(1970, 1, 1)).total_seconds(),)
+
+
+def _novel_tags(novel: Novel) -> FrozenSet[str]:
+    return novel.sanatized_tag_set
+
+def _source_tags(source: NovelFromSource) -> FrozenSet[str]:
+    """Sources are filtered with the tags of their novel, like source_tag_index"""
+    return source.novel.sanatized_tag_set
+
+
+# Keys are computed once per novel and updated with add_click, rate_novel...
+# Every order keeps the items of each tag, to page /api/novels?tags= with the tag index
+weekly_views_week = datetools.current_week()
+novel_orders: Dict[str, SortedOrder[Novel]] = {
+    "title": SortedOrder(lambda x: (x.title,), _novel_tags),
+    "author": SortedOrder(lambda x: (x.author,), _novel_tags),
+    "rating": SortedOrder(lambda x: (-x.ratings.average, -x.ratings.count), _novel_tags),
+    "views": SortedOrder(lambda x: (-sum(x.clicks.values()),), _novel_tags),
+    "weekly_views": SortedOrder(lambda x: (-x.clicks.get(weekly_views_week, 0),), _novel_tags),
+}
+# Ranks are set by set_ranks, and by set_rank for an added novel. The views break the ties set_rank can leave
+rank_order: SortedOrder[Novel] = SortedOrder(
+    lambda x: (x.rank, -sum(x.clicks.values())) if x.rank is not None else None,
+    _novel_tags,
+)
+source_orders: Dict[str, SortedOrder[NovelFromSource]] = {
+    "last_updated": SortedOrder(_last_update_key, _source_tags),
+}
+
+
+def _weekly_views_order() -> SortedOrder[Novel]:
+    """The weekly keys all change with the week : rebuild the order once a week"""
+    global weekly_views_week
+    week = datetools.current_week()
+    if week != weekly_views_week:
+        weekly_views_week = week
+        novel_orders["weekly_views"].rebuild(rank_order.iterate())
+    return novel_orders["weekly_views"]
+
 
 sorted_all_novels = {
-    "title": lambda: sorted(all_novels, key=lambda x: x.title),
-    "author": lambda: sorted(all_novels, key=lambda x: x.author),
-    "rating": lambda: sorted(all_novels, key=lambda x: (x.overall_rating, x.ratings_count), reverse=True),
-    "views": lambda: sorted(
-        all_novels, key=lambda x: sum(x.clicks.values()), reverse=True
-    ),
-    "weekly_views": lambda: sorted(
-        all_novels,
-        key=lambda x: x.clicks[datetools.current_week()]
-        if datetools.current_week() in x.clicks
-        else 0,
-        reverse=True,
-    ),
-    "rank": lambda: all_novels,  # Default sort
-    "title-reverse": lambda: sorted_all_novels["title"]()[::-1],
-    "author-reverse": lambda: sorted_all_novels["author"]()[::-1],
-    "rating-reverse": lambda: sorted_all_novels["rating"]()[::-1],
-    "views-reverse": lambda: sorted_all_novels["views"]()[::-1],
-    "weekly_views-reverse": lambda: sorted_all_novels["weekly_views"]()[::-1],
-    "rank-reverse": lambda: sorted_all_novels["rank"]()[::-1],
+    "title": lambda: novel_orders["title"].view(),
+    "author": lambda: novel_orders["author"].view(),
+    "rating": lambda: novel_orders["rating"].view(),
+    "views": lambda: novel_orders["views"].view(),
+    "weekly_views": lambda: _weekly_views_order().view(),
+    "rank": lambda: rank_order.view(),  # Default sort
+    "title-reverse": lambda: novel_orders["title"].view(reverse=True),
+    "author-reverse": lambda: novel_orders["author"].view(reverse=True),
+    "rating-reverse": lambda: novel_orders["rating"].view(reverse=True),
+    "views-reverse": lambda: novel_orders["views"].view(reverse=True),
+    "weekly_views-reverse": lambda: _weekly_views_order().view(reverse=True),
+    "rank-reverse": lambda: rank_order.view(reverse=True),
 }
 
 sorted_all_sources = {
-    "last_updated": lambda: sorted(
-            [
-                source
-                for source in all_sources
-                if source.last_update_date
-            ],
-            key=lambda x: datetime.datetime.fromisoformat(x.last_update_date),
-            reverse=True,
-        ),
-    "last_updated-reverse": lambda: sorted_all_sources["last_updated"]()[::-1],
+    "last_updated": lambda: source_orders["last_updated"].view(),
+    "last_updated-reverse": lambda: source_orders["last_updated"].view(reverse=True),
 }
 
-from functools import lru_cache
-#Use the lru_cache decorator to memoize the lambdas
-for key, value in sorted_all_novels.items():
-    sorted_all_novels[key] = lru_cache()(value)
 
-for key, value in sorted_all_sources.items():
-    sorted_all_sources[key] = lru_cache()(value)
+def in_source_orders(source: NovelFromSource) -> bool:
+    """Sources without date are left out of the source orders, and of source_tag_index to count the same pages"""
+    return _last_update_key(source) is not None
+
 
-# Register a callback that need to be called when the all_novels list is modified
 def refresh_sorted_all():
-    """Clear the cache of the lambdas : refresh the sorted lists"""
-    for key, value in sorted_all_novels.items():
-        value.cache_clear()
-    for key, value in sorted_all_sources.items():
-        value.cache_clear()
+    """Rebuild every order from all_novels and all_sources"""
+    for order in novel_orders.values():
+        order.rebuild(all_novels)
+    rank_order.rebuild(all_novels)
+    for order in source_orders.values():
+        order.rebuild(all_sources)
+
+
+def add_to_sorted(novel: Novel):
+    """Insert or move the novel and its sources in every order, O(log n) each"""
+    for order in novel_orders.values():
+        order.add(novel)
+    for source in novel.sources:
+        for order in source_orders.values():
+            order.add(source)
+
+
+def remove_from_sorted(novel: Novel):
+    for order in novel_orders.values():
+        order.remove(novel)
+    rank_order.remove(novel)
+    for source in novel.sources:
+        for order in source_orders.values():
+            order.remove(source)
+
 
 def set_ranks():
-    all_novels.sort(key=lambda x: sum(x.clicks.values()), reverse=True)
-    for i, n in enumerate(all_novels, start=1):
+    """Rank the novels by views, read from the views order : no sort needed"""
+    views = list(novel_orders["views"].iterate())
+    for i, n in enumerate(views, start=1):
         n.rank = i
+    rank_order.rebuild(views)
 
-def set_prefered_sources():
-    """Set the prefered source for each novel
-    Prefered source is the source with the highest rating
+
+def set_rank(novel: Novel):
     """
+    Rank an added novel after the novel above it in the views order, O(log n).
+    The novels below keep their rank until the next set_ranks.
+    """
+    views = novel_orders["views"]
+    position = views.index(novel)
+    above = views.slice(position - 1, position) if position else []
+    novel.rank = above[0].rank + 1 if above and above[0].rank is not None else 1
+    rank_order.add(novel)
+
+
+def add_click(novel: Novel):
+    stats_store.click(novel)
+    novel_orders["views"].update(novel)
+    if datetools.current_week() == weekly_views_week:
+        novel_orders["weekly_views"].update(novel)
+
+
+def update_sorted_stats(novel: Novel):
+    """Move the novel in the orders depending on its stats, ex : after the events of another worker"""
+    novel_orders["views"].update(novel)
+    novel_orders["weekly_views"].update(novel)
+    novel_orders["rating"].update(novel)
+
+
+def rate_novel(novel: Novel, user: str, rating: int):
+    stats_store.rate(novel, user, rating)
+    response_cache.bump()
+    novel_orders["rating"].update(novel)
+
+
+def index_novel(novel: Novel):
+    """Add the novel and its sources to the lookup maps"""
+    novel_slug = novel.cleaned_folder_name
+    novels_by_slug[novel_slug] = novel
+    for source in novel.sources:
+        sources_by_slugs[(novel_slug, source.slug)] = source
+        sources_by_path[source.path] = source
+
+def unindex_novel(novel: Novel):
+    """Remove the novel and its sources from the lookup maps, if they still point to them"""
+    novel_slug = novel.cleaned_folder_name
+    if novels_by_slug.get(novel_slug) is novel:
+        del novels_by_slug[novel_slug]
+    for source in novel.sources:
+        if sources_by_slugs.get((novel_slug, source.slug)) is source:
+            del sources_by_slugs[(novel_slug, source.slug)]
+        if sources_by_path.get(source.path) is source:
+            del sources_by_path[source.path]
+
+def set_prefered_source(novel: Novel):
+    """Prefered source is the source with the highest rating"""
+    if novel.sources:
+        novel.prefered_source = max(novel.sources, key=lambda x: x.source_rating)
+
+def set_prefered_sources():
+    """Set the prefered source for each novel"""
     for novel in all_novels:
-        novel:Novel
-        if novel.sources:
-            novel.prefered_source = max(novel.sources, key=lambda x: x.source_rating)    
+        set_prefered_source(novel)
+
+# Position of each novel and source in all_novels and all_sources, by id : their __eq__ only compare slugs
+novel_positions: Dict[int, int] = {}
+source_positions: Dict[int, int] = {}
+
+def index_positions():
+    """Rebuild the positions after all_novels and all_sources were replaced"""
+    novel_positions.clear()
+    novel_positions.update((id(novel), i) for i, novel in enumerate(all_novels))
+    source_positions.clear()
+    source_positions.update((id(source), i) for i, source in enumerate(all_sources))
+
+def _list_add(items: list, positions: Dict[int, int], item):
+    positions[id(item)] = len(items)
+    items.append(item)
+
+def _list_remove(items: list, positions: Dict[int, int], item):
+    """Swap the item with the last one and pop it, O(1) : the order of the lists does not matter"""
+    index = positions.pop(id(item), None)
+    if index is None:
+        return
+    last = items.pop()
+    if last is not item:
+        items[index] = last
+        positions[id(last)] = index
+
+def add_to_lists(novel: Novel):
+    """Append the novel to all_novels and its sources to all_sources"""
+    _list_add(all_novels, novel_positions, novel)
+    for source in novel.sources:
+        _list_add(all_sources, source_positions, source)
+
+def remove_from_lists(novel: Novel):
+    _list_remove(all_novels, novel_positions, novel)
+    for source in novel.sources:
+        _list_remove(all_sources, source_positions, source)
 
 from typing import TYPE_CHECKING
 
@@ -81,7 +254,10 @@ if TYPE_CHECKING:
     from .downloader.Job import JobHandler, FinishedJob
 
     jobs: dict[str, Union[FinishedJob, JobHandler]]
-    jobs_snapshots: dict[str, JobHandler]
+    jobs_by_url: dict[str, JobHandler]
+    jobs_by_source: dict[tuple[str, str], JobHandler]
 
 jobs = {}
-jobs_snapshots = {}
+# Running jobs by normalized novel url and by (novel slug, source slug), see Job.get_or_create_job
+jobs_by_url = {}
+jobs_by_source = {}
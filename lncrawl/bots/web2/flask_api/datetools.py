@@ -1,13 +1,27 @@
 import datetime
+import time
+
+# Current week, computed again when the week is over
+_week = ""
+_week_start = 0.0
+_week_end = 0.0
 
 
 def current_week() -> str:
     """Return the current week number since 2000-01-01"""
-    date = datetime.datetime.now()
-    year, week_num, _ = date.isocalendar()
-    week = (year - 2000) * 52 + week_num
-    return str(week)
+    global _week, _week_start, _week_end
+    now = time.time()
+    if not _week_start <= now < _week_end:
+        date = datetime.datetime.fromtimestamp(now)
+        year, week_num, weekday = date.isocalendar()
+        monday = (date - datetime.timedelta(days=weekday - 1)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        _week = str((year - 2000) * 52 + week_num)
+        _week_start = monday.timestamp()
+        _week_end = (monday + datetime.timedelta(days=7)).timestamp()
+    return _week
 
 def utc_str_date() -> str:
     """Return the current date in UTC as a string"""
-    return datetime.datetime.utcnow().isoformat()
\ No newline at end of file
+    return datetime.datetime.utcnow().isoformat()
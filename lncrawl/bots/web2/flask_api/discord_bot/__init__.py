@@ -1,9 +1,11 @@
 from . import config
 from . import bot
+from .. import workers
 import asyncio
 import threading
 
-if config.DISCORD_BOT_ENABLE:
+# A single bot, in the owner when there are several API workers
+if config.DISCORD_BOT_ENABLE and workers.IS_OWNER:
 
     # bot.client.run(config.DISCORD_BOT_TOKEN)
     # We need to run the bot in a separate thread
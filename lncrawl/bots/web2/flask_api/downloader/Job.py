@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 from lncrawl.bots.web2.flask_api import datetools
 from lncrawl.core.app import App
 from lncrawl.core.crawler import Crawler
@@ -10,41 +9,170 @@ from urllib.parse import urlparse, quote_plus
 from slugify import slugify
 from pathlib import Path
 import json
-from lncrawl.core.sources import prepare_crawler
 import threading
-import gc
+from lncrawl.core.sources import prepare_crawler
+from lncrawl.models import CombinedSearchResult, SearchResult
 
 logger = logging.getLogger(__name__)
 from .. import lib
 from .. import database
 from .. import read_novel_info
 from .. import utils
+from .. import chapter_list
 from .. import discord_bot
+from ..job_scheduler import PRIORITY_DOWNLOAD, PRIORITY_SEARCH, QueueFull
+from ..job_snapshots import JobSnapshot
+
+JOB_LIFETIME = 3600  # seconds, then the job is destroyed
+
+# Guards database.jobs_by_url and database.jobs_by_source
+_coalesce_lock = threading.Lock()
+
+
+def normalize_url(url: str) -> str:
+    """Same key for the same novel page : scheme, www, case of the host, trailing slash and fragment ignored"""
+    parsed = urlparse(url.strip())
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[len("www."):]
+    path = parsed.path.rstrip("/")
+    return f"{host}{path}?{parsed.query}" if parsed.query else f"{host}{path}"
+
+
+def _queue_changed(positions: Dict[str, Optional[int]]):
+    """Places of the tasks waiting in the job scheduler changed, None : task started"""
+    for job_id, position in positions.items():
+        job = database.jobs.get(job_id)
+        if isinstance(job, JobHandler) and job.job_id == job_id:
+            job.set_position(position)
+
+
+database.job_scheduler.on_queue_change = _queue_changed
+
+
+class JobApp(App):
+    """App telling its job when the progress of the download changes"""
+
+    def __init__(self, job: "JobHandler"):
+        self._job = None
+        super().__init__()
+        self._job = job
+
+    @property
+    def progress(self):
+        return self._progress
+
+    @progress.setter
+    def progress(self, value):
+        self._progress = value
+        if self._job is not None:
+            self._job._progress_changed(reset=not value)
+
+    @property
+    def downloading_images(self):
+        return self._downloading_images
+
+    @downloading_images.setter
+    def downloading_images(self, value: bool):
+        self._downloading_images = value
+        if self._job is not None and value:
+            self._job._images_started()
+
+
+def get_or_create_job(job_id: str, url: str) -> Tuple["JobHandler", bool]:
+    """
+    The running job of the novel url with job_id attached to it, or a new job.
+    Returns (job, created)
+    """
+    key = normalize_url(url)
+    with _coalesce_lock:
+        leader = database.jobs_by_url.get(key)
+        if leader is not None and not leader.destroyed:
+            leader.attach(job_id, url)
+            return leader, False
+        job = JobHandler(job_id)
+        job.original_query = url
+        database.jobs_by_url[key] = job
+        database.jobs[job_id] = job
+        return job, True
 
 
 class JobHandler:
     original_query: str = ""
     selected_novel = None
-    is_busy = False
+    _is_busy = False
     search_results: Optional[dict[str, Union[int, str, List]]] = None
     crashed: bool = False
     last_action: str = "Created job"
     metadata_downloaded = False
     destroyed = False
     novel_info: Optional[read_novel_info.Novel] = None
+    updating_path: Optional[Path] = None  # source folder written by the job
+    download_started = False
+    changed_chapters: Optional[List[int]] = None  # ids downloaded by an incremental update
 
     def __init__(self, job_id: str):
-        # Before we start, first collect garbage to free up memory of previous jobs 
-        #   because I couldn't find a way to trigger the collector automatically when a job is destroyed
-        gc.collect() 
-        self.app = App()
-        self.app.output_formats = {"json": True, "epub":True}
         self.job_id = job_id
+        # Other requesters of the same novel : their query, they get the progress and result of this job
+        self.attached: dict[str, str] = {}
+        self.position: Optional[int] = None  # place in the queue of the job scheduler
+        self.status_message = self.last_action
+        self.app = JobApp(self)
+        self.app.output_formats = {"json": True, "epub":True}
         self.last_activity = datetime.now()
-        self.executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix=job_id)
 
         # Self destruct after 1 hour 
-        threading.Timer(3600, self.destroy).start()
+        database.job_scheduler.timers.call_later(JOB_LIFETIME, self.destroy)
+
+    def _submit(self, function, *args, priority: int = PRIORITY_DOWNLOAD):
+        """Run function in the shared job threads, QueueFull if too many tasks are waiting"""
+        host = None
+        if priority != PRIORITY_SEARCH and self.app.crawler:
+            host = urlparse(self.app.crawler.home_url).netloc
+        try:
+            database.job_scheduler.submit(self.job_id, function, *args, priority=priority, host=host)
+        except QueueFull:
+            self.is_busy = False
+            raise
+
+    def attach(self, job_id: str, query: str):
+        """Another requester of the same novel follows this job"""
+        if job_id != self.job_id:
+            self.attached[job_id] = query
+        database.jobs[job_id] = self
+        database.job_events.publish([job_id], self.status_snapshot())
+
+    def _claim_url(self, url: str):
+        """Later requests of the url follow this job, unless another job already has it"""
+        key = normalize_url(url)
+        with _coalesce_lock:
+            leader = database.jobs_by_url.get(key)
+            if leader is None or leader.destroyed:
+                database.jobs_by_url[key] = self
+
+    def _claim_source(self) -> Optional["JobHandler"]:
+        """
+        Register the job as the writer of its source folder.
+        Returns the running job already writing it, the requesters of this job are attached to it.
+        """
+        key = (self.novel_slug, self.source_slug)
+        with _coalesce_lock:
+            leader = database.jobs_by_source.get(key)
+            if leader is None or leader is self or leader.destroyed:
+                database.jobs_by_source[key] = self
+                return None
+            leader.attach(self.job_id, self.original_query)
+            for job_id, query in self.attached.items():
+                leader.attach(job_id, query)
+            self.attached.clear()
+            return leader
+
+    def _release(self):
+        """Later requests of the novel start a new job"""
+        with _coalesce_lock:
+            for registry in (database.jobs_by_url, database.jobs_by_source):
+                for key in [key for key, job in registry.items() if job is self]:
+                    del registry[key]
 
 
     # -----------------------------------------------------------------------------
@@ -58,11 +186,12 @@ class JobHandler:
     def destroy(self):
         if not self.destroyed:
             self.destroyed = True
-            self.executor.submit(self.destroy_sync)
+            self.destroy_sync()
         # Else it's already destroyed, do nothing  
 
     def destroy_sync(self):
         try:
+            self._release()
             success = not self.crashed
             finished_job = FinishedJob(
                 success,
@@ -71,7 +200,19 @@ class JobHandler:
                 self.original_query,
                 self.job_id,
             )
-            database.jobs[self.job_id] = finished_job
+            with _coalesce_lock:
+                finished_job.attached = {
+                    job_id: query
+                    for job_id, query in self.attached.items()
+                    if database.jobs.get(job_id) is self
+                }
+                finished_ids = [
+                    job_id
+                    for job_id in [self.job_id, *finished_job.attached]
+                    if database.jobs.get(job_id) is self
+                ]
+                for job_id in finished_ids:
+                    database.jobs[job_id] = finished_job
             # url will be used to redirect
             try:
                 if self.app.good_file_name and self.app.crawler.home_url:
@@ -84,14 +225,18 @@ class JobHandler:
                     )
             except Exception as e:
                 logger.error(e)
+            database.job_events.publish(finished_ids, finished_job.status_snapshot())
 
             self.app.destroy()
-            self.executor.shutdown(wait=False)
+            database.job_scheduler.job_destroyed()
             if success:
                 self._delete_snapshot()
         except Exception as e:
             logger.exception(f"While destroying JobHandler : {e}")
         finally:
+            if self.updating_path is not None:
+                database.compression.end_update(self.updating_path)
+                self.updating_path = None
             logger.info("Session destroyed: %s", self.job_id)
 
     # -----------------------------------------------------------------------------
@@ -100,47 +245,82 @@ class JobHandler:
         logger.debug("starting action : ", action)
         self.last_action = action
         self.last_activity = datetime.now()
+        if action == "Searching":
+            self.sources_to_search = len(self.app.crawler_links)
+        elif action == "Downloading":
+            # Until the chapters already downloaded are restored
+            self.chapters_to_download = len([c for c in self.app.chapters if not c.success])
+        self._status_changed()
 
     sources_to_search = 0
     chapters_to_download = 0
     images_to_download = 0
 
-    def get_status(self):
-        if not self.is_busy:
-            return "No current task"
+    # region Status
+    # The status is computed when it changes, the polling routes and the progress streams read it
 
-        elif self.last_action == "Downloading":
-            if self.app.downloading_images:
-                if not self.images_to_download:
-                    self.images_to_download = (
-                        sum(
-                            [
-                                len(chapter.get("images", {}))
-                                for chapter in self.app.chapters
-                            ]
-                        )
-                        + 2
-                    )  # +1 for the cover and +1 idk why
-                return f"Downloading images ({self.app.progress}/{self.images_to_download})"
+    @property
+    def is_busy(self) -> bool:
+        return self._is_busy
+
+    @is_busy.setter
+    def is_busy(self, value: bool):
+        self._is_busy = value
+        self._status_changed()
+
+    def set_position(self, position: Optional[int]):
+        self.position = position
+        self._status_changed()
 
-            else:
-                if not self.chapters_to_download:
-                    self.chapters_to_download = len([c for c in self.app.chapters if not c.success])
-                return f"Downloading chapters ({self.app.progress}/{self.chapters_to_download})"
+    def _progress_changed(self, reset: bool):
+        if reset and self.last_action == "Downloading" and not self.app.downloading_images:
+            # Set to 0 once the chapters already downloaded are restored
+            self.chapters_to_download = len([c for c in self.app.chapters if not c.success])
+        self._status_changed()
 
+    def _images_started(self):
+        self.images_to_download = (
+            sum(len(chapter.get("images", {})) for chapter in self.app.chapters) + 2
+        )  # +1 for the cover and +1 idk why
+
+    def _status_message(self) -> str:
+        if self.last_action == "Downloading":
+            if self.app.downloading_images:
+                return f"Downloading images ({self.app.progress}/{self.images_to_download})"
+            return f"Downloading chapters ({self.app.progress}/{self.chapters_to_download})"
         elif self.last_action == "Searching":
-            if not self.sources_to_search:
-                self.sources_to_search = len(self.app.crawler_links)
             return f"Searching ({self.app.progress}/{self.sources_to_search})"
+        return self.last_action
 
-        else:
-            return self.last_action
+    def _status_changed(self):
+        if "app" not in self.__dict__ or self.destroyed:
+            # Still in __init__, or replaced by its FinishedJob
+            return
+        self.status_message = self._status_message()
+        # Unless the id follows another job now
+        job_ids = [job_id for job_id in [self.job_id, *list(self.attached)] if database.jobs.get(job_id) is self]
+        database.job_events.publish(job_ids, self.status_snapshot())
+
+    def get_status(self):
+        if not self.is_busy:
+            return "No current task"
+        if self.position is not None:
+            return f"Waiting for a free slot ({self.position} in the queue)"
+        return self.status_message
+
+    def status_snapshot(self) -> dict:
+        """Status sent to the requesters, pending while the job is busy, ready when it waits for their next request"""
+        if self.is_busy:
+            return {"status": "pending", "message": self.get_status(), "position": self.position}
+        return {"status": "ready", "message": self.last_action}
+
+    # endregion
 
     # -----------------------------------------------------------------------------
     def get_list_of_novel(self, query: str) -> None:
         self.original_query = query
         self.is_busy = True
-        self.executor.submit(self._get_list_of_novel, query)
+        self._submit(self._get_list_of_novel, query, priority=PRIORITY_SEARCH)
 
     def _get_list_of_novel(self, query: str):
         if len(query) < 4:
@@ -203,13 +383,15 @@ class JobHandler:
         assert self.selected_novel, "No novel selected"
 
         self.set_last_action(f"Selected {self.selected_novel['novels'][source_id]}")
+        url = self.selected_novel["novels"][source_id]["url"]
         try:
-            self.app.crawler = prepare_crawler(self.selected_novel["novels"][source_id]["url"])
+            self.app.crawler = prepare_crawler(url)
         except Exception as e:
             return self.crash(f"Fail to init crawler : {e}")
+        self._claim_url(url)
 
         self.set_last_action("Getting information about your novel...")
-        self.executor.submit(self.download_novel_info)
+        self._submit(self.download_novel_info)
 
     # -----------------------------------------------------------------------------
 
@@ -220,14 +402,25 @@ class JobHandler:
             self.app.crawler = prepare_crawler(url)
         except Exception as e:
             return self.crash(f"Fail to init crawler : {e}")
-        self.executor.submit(self.download_novel_info)
+        self._submit(self.download_novel_info)
+
+    def prepare_update(self):
+        """Get the novel info in the current thread, for the update task"""
+        self.is_busy = True
+        try:
+            self.app.crawler = prepare_crawler(self.original_query)
+        except Exception as e:
+            return self.crash(f"Fail to init crawler : {e}")
+        # The new chapters are added to json.7z by the compression, it is not extracted
+        self.download_novel_info(extract_json=False, keep_busy=True)
 
     # -----------------------------------------------------------------------------
     def _select_range(self, start=0, stop=None):
         self.set_last_action("Set download range")
         self.app.chapters = self.app.crawler.chapters[start:stop]  # type: ignore
 
-    def download_novel_info(self):
+    def download_novel_info(self, extract_json=True, keep_busy=False):
+        """keep_busy : the task goes on with the download, the requesters keep waiting"""
         self.is_busy = True
         self.set_last_action("Getting novel information...")
 
@@ -238,12 +431,25 @@ class JobHandler:
 
         self.source_slug = slugify(urlparse(self.app.crawler.home_url).netloc)  # type: ignore
         self.novel_slug = self.app.good_file_name
+        leader = self._claim_source()
+        if leader is not None:
+            # Another job is downloading this source : follow it instead of writing the same folder
+            logger.info(f"Job {self.job_id} attached to job {leader.job_id}")
+            self.is_busy = False
+            self.destroyed = True
+            self._release()
+            self.app.destroy()
+            return
         output_path = lib.LIGHTNOVEL_FOLDER / self.novel_slug / self.source_slug
         self.app.output_path = str(output_path)
+        # The source is not compressed while the job writes it, until the job is destroyed
+        if self.updating_path is None:
+            database.compression.begin_update(output_path)
+            self.updating_path = output_path
         if not output_path.exists():
             output_path.mkdir(parents=True)
 
-        if lib.COMPRESSION_ENABLED:
+        if lib.COMPRESSION_ENABLED and extract_json:
             # If the novel is already downloaded, we will still download it again, but first we need to 
             # extract the compressed json files and delete the compressed file
             # else it would download everything again and we would have the files twice
@@ -252,14 +458,33 @@ class JobHandler:
                 if result == False:
                     return self.crash(f"Failed to extract compressed json files")
                 
-        self.is_busy = False
+        self.is_busy = keep_busy
         self.metadata_downloaded = True
 
 
-    def start_download(self, update_website=True, destroy_after=True):
+    def _begin_download(self, chapters=None) -> bool:
+        """False if a requester of the same novel already started the download"""
+        with _coalesce_lock:
+            if self.download_started:
+                return False
+            self.download_started = True
         self.is_busy = True
-        self._select_range()
-        self.executor.submit(self._start_download, update_website, destroy_after)
+        if chapters is None:
+            self._select_range()
+        else:
+            self.set_last_action("Set download range")
+            self.app.chapters = chapters
+            self.changed_chapters = [chapter.id for chapter in chapters]
+        return True
+
+    def start_download(self, update_website=True, destroy_after=True):
+        if self._begin_download():
+            self._submit(self._start_download, update_website, destroy_after)
+
+    def start_download_sync(self, chapters=None):
+        """Download in the current thread, for the update task. chapters : only these chapters"""
+        if self._begin_download(chapters):
+            self._start_download()
 
     def _start_download(self, update_website=True, destroy_after=True):
         self.is_busy = True
@@ -297,7 +522,7 @@ class JobHandler:
         try:
             self.set_last_action("reading metadata")
             self.novel_info = read_novel_info.get_novel_info(
-                Path(self.app.output_path).parent
+                Path(self.app.output_path).parent, lib.catalog
             )
             # If the source is already in the database, update the last_update_date
             for source in self.novel_info.sources:
@@ -313,8 +538,16 @@ class JobHandler:
                     with open(str(meta_path), "w", encoding="utf-8") as f:
                         json.dump(metadata, f, indent=4)
 
+                    chapter_list.write_chapter_list(source.path)
+                    if self.changed_chapters is not None:
+                        # The other chapters did not change, they stay in the cache
+                        database.chapter_cache.invalidate(source.path, self.changed_chapters)
+
             self.set_last_action("Adding novel to database")
-            utils.add_novel_to_database(self.novel_info)
+            utils.add_novel_to_database(self.novel_info, invalidate_chapters=self.changed_chapters is None)
+            if lib.SHARED_WORKERS:
+                database.stats_store.publish_novel(Path(self.app.output_path).parent)
+            lib.sitemap_writer.schedule()
         except Exception as ex:
             return self.crash(f"Failed to update website : {ex}")
 
@@ -336,25 +569,40 @@ class JobHandler:
     # -----------------------------------------------------------------------------
     def _create_snapshot(self):
         """
-        Create a JobSnapshot with its search result in jobs_snapshots to be able to restore it if the download fail to quickly
+        Keep the search results in jobs_snapshots to be able to restore them if the download fail to quickly
         allow a retry with another source without having to search the same query again
         """
         try:
-            database.jobs_snapshots[self.job_id] = job = JobHandler(self.job_id)
-            job.search_results = self.search_results
-            job.original_query = self.original_query
-            job.app.search_results = self.app.search_results
-            job.last_action = self.last_action
+            database.jobs_snapshots.put(
+                self.job_id,
+                self.original_query,
+                self.search_results,
+                [
+                    {**item, "novels": [dict(novel) for novel in item["novels"]]}
+                    for item in self.app.search_results
+                ],
+            )
         except Exception as e:
             logger.warning("Failed to create snapshot : ", e)
 
+    @classmethod
+    def from_snapshot(cls, snapshot: JobSnapshot) -> "JobHandler":
+        """Job waiting for the visitor to choose a novel among the search results of the snapshot"""
+        job = cls(snapshot.job_id)
+        job.original_query = snapshot.query
+        job.search_results = snapshot.search_results
+        job.app.search_results = [
+            CombinedSearchResult(**{**item, "novels": [SearchResult(**novel) for novel in item["novels"]]})
+            for item in snapshot.novels
+        ]
+        job.last_action = "Search results restored"
+        return job
 
     def _delete_snapshot(self):
         """
         Delete the snapshot
         """
-        if self.job_id in database.jobs_snapshots:
-            del database.jobs_snapshots[self.job_id]
+        database.jobs_snapshots.pop(self.job_id)
 
 
 class FinishedJob:
@@ -380,34 +628,39 @@ class FinishedJob:
         self.message = message
         self.end_date = end_date
         self.job_id = job_id
+        self.attached: dict[str, str] = {}  # see JobHandler.attach
 
-        threading.Timer(3600, self.destroy).start()
+        database.job_scheduler.timers.call_later(JOB_LIFETIME, self.destroy)
 
     def get_status(self):
         return self.message
 
+    def status_snapshot(self) -> dict:
+        if self.success:
+            return {"status": "success", "message": self.message, "url": self.url}
+        return {"status": "error", "message": self.message}
+
+    def query_of(self, job_id: str) -> str:
+        """Url or search of the requester job_id"""
+        return self.attached.get(job_id, self.original_query)
+
     def destroy(self):
         """
         Delete the job from the database
         """
-        if self.job_id in database.jobs:
-            del database.jobs[self.job_id]
-
-    def restore_snapshot(self):
-        """
-        Restore the job from the snapshot
-        """
-        if self.snapshot_exists():
-            snapshot = database.jobs_snapshots[self.job_id]
-
-            database.jobs[self.job_id] = snapshot
-            snapshot._delete_snapshot()
-            snapshot._create_snapshot()
-
-            return database.jobs_snapshots[self.job_id]
-
-        else:
-            return None
-
-    def snapshot_exists(self):
-        return self.job_id in database.jobs_snapshots
+        for job_id in [self.job_id, *self.attached]:
+            # Unless the id was reused for a new job
+            if database.jobs.get(job_id) is self:
+                del database.jobs[job_id]
+                database.job_events.forget([job_id])
+
+
+def restore_snapshot(job_id: str) -> Optional[JobHandler]:
+    """Replace the job of job_id by a new job with the search results of its snapshot, None if there is none"""
+    snapshot = database.jobs_snapshots.get(job_id)
+    if snapshot is None:
+        return None
+    job = JobHandler.from_snapshot(snapshot)
+    database.jobs[job_id] = job
+    database.job_events.publish([job_id], job.status_snapshot())
+    return job
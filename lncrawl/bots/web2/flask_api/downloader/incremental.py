@@ -0,0 +1,61 @@
+"""
+Incremental update of a source : only the chapters that are new or changed since
+the last download are fetched.
+
+The chapters crawled again are compared with the chapters of meta.json by id and
+url. The chapters already downloaded are kept as they are stored (title, images),
+the others are downloaded in the json folder. At the end of the job the
+compression merges them into the chapter archive and json.7z : the archives are
+never extracted and the stored chapter files are not read.
+"""
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from lncrawl.models.chapter import Chapter
+
+
+def read_stored_chapters(source_folder: Path) -> Optional[Dict[int, dict]]:
+    """Chapters of meta.json by id, None if the source was never downloaded"""
+    try:
+        with open(source_folder / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    # For backward compatibility
+    chapters = meta["novel"]["chapters"] if "novel" in meta else meta["chapters"]
+    return {chapter["id"]: chapter for chapter in chapters}
+
+
+def is_downloaded(stored: Optional[dict], chapter: Chapter) -> bool:
+    # Old metadata without success : the chapter was downloaded
+    return stored is not None and stored.get("url") == chapter.url and stored.get("success", True)
+
+
+def diff_chapters(stored: Dict[int, dict], crawled: List[Chapter]) -> List[Chapter]:
+    """
+    The crawled chapters to download : new, moved to another url, or failed last time.
+    The other chapters of crawled are replaced by the stored ones, for meta.json.
+    """
+    to_download = []
+    for i, chapter in enumerate(crawled):
+        old = stored.get(chapter.id)
+        if is_downloaded(old, chapter):
+            crawled[i] = Chapter(**old)
+        else:
+            to_download.append(chapter)
+    return to_download
+
+
+def remove_stale_files(source_folder: Path, stored: Dict[int, dict], chapters: List[Chapter]):
+    """
+    Delete the json files of the changed chapters still in the json folder :
+    the download would restore them instead of fetching the new content.
+    """
+    json_folder = source_folder / "json"
+    if not json_folder.exists():
+        return
+    for chapter in chapters:
+        if chapter.id in stored:
+            (json_folder / f"{chapter.id:05}.json").unlink(missing_ok=True)
@@ -1,12 +1,59 @@
 from ..flaskapp import app
-from flask import request
+from flask import Response, request
 from .. import database
 from .. import lib
-from .Job import JobHandler, FinishedJob
+from .Job import JobHandler, FinishedJob, get_or_create_job, normalize_url, restore_snapshot
+from ..job_scheduler import PRIORITY_REFRESH, PRIORITY_UPDATE, QueueFull
+from ..job_events import TooManyStreams
+from urllib.parse import urlparse
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+@app.errorhandler(QueueFull)
+def queue_full(error):
+    return {"status": "error", "message": f"Too many novels are being downloaded : {error}"}, 503
+
+
+def pending(job: JobHandler):
+    """Job still running, position : place in the queue of the jobs waiting for a thread"""
+    status = job.status_snapshot()
+    if status["status"] != "pending":
+        # Started by this request and already answered, the visitor polls again
+        status = {"status": "pending", "message": status["message"], "position": None}
+    return status, 202
+
+
+# ----------------------------------------------- Progress stream ----------------------------------------------- #
+
+
+@app.route("/api/addnovel/events")
+@app.route("/addnovel/events")
+def addnovel_events():
+    """Status of the job as Server-Sent Events, until it is no longer pending"""
+    job_id = request.args.get("job_id")
+    if not job_id in database.jobs:
+        return {"status": "error", "message": "Job do not exist"}, 412
+
+    if database.job_events.get(job_id) is None:
+        database.job_events.publish([job_id], database.jobs[job_id].status_snapshot())
+    try:
+        last_id = int(request.headers.get("Last-Event-ID", 0))
+    except ValueError:
+        last_id = 0
+    try:
+        stream = database.job_events.open_stream(job_id, last_id)
+    except TooManyStreams as e:
+        return {"status": "error", "message": f"{e}, poll the job instead"}, 503
+
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 # ----------------------------------------------- Search Novel ----------------------------------------------- #
 
 
@@ -52,7 +99,7 @@ def get_novels_founds():
         }, 409
 
     if job.is_busy:
-        return {"status": "pending", "message": job.get_status()}, 202
+        return pending(job)
 
     if not job.search_results:
         return {"status": "error", "message": "No search results"}, 404
@@ -75,7 +122,7 @@ def get_sources_founds():
 
     job = database.jobs[job_id]
     if job.is_busy:
-        return {"status": "pending", "message": job.get_status()}, 202
+        return pending(job)
 
     if isinstance(job, FinishedJob):
         return {
@@ -104,7 +151,7 @@ def addnovel_download():
 
     job = database.jobs[job_id]
     if job.is_busy:
-        return {"status": "pending", "message": job.get_status()}, 202
+        return pending(job)
 
     if isinstance(job, FinishedJob):
         url = ""
@@ -125,11 +172,11 @@ def addnovel_download():
     if not job.metadata_downloaded:
         job.select_novel(novel_id)
         job.select_source(source_id)
-        return {"status": "pending", "message": job.get_status()}, 202
+        return pending(job)
 
     job.start_download()
 
-    return {"status": "pending", "message": job.get_status()}, 202
+    return pending(job)
 
     # Busy : Downloading metadata or downloading novel
     #    --> send status
@@ -160,16 +207,17 @@ def direct_download():
 
     if not job_id in database.jobs or (
         isinstance(database.jobs[job_id], FinishedJob)
-        and database.jobs[job_id].original_query != novel_url
+        and normalize_url(database.jobs[job_id].query_of(job_id)) != normalize_url(novel_url)
     ):
         # If the job is finished and the query doesn't match, overwrite the old job
-        database.jobs[job_id] = job = JobHandler(job_id)
+        # If another visitor is downloading the same novel, follow their job
+        job, _ = get_or_create_job(job_id, novel_url)
     else:
         # If they match it means it is the current job, continue with it
         job = database.jobs[job_id]
 
     if job.is_busy:  # Job is busy
-        return {"status": "pending", "message": job.get_status()}, 202
+        return pending(job)
 
     elif isinstance(job, FinishedJob):  # job finished
         url = ""
@@ -186,18 +234,16 @@ def direct_download():
 
     elif not job.metadata_downloaded:  # job hasn't downloaded metadata yet
         job.prepare_direct_download(novel_url)
-        return {"status": "pending", "message": job.get_status()}, 202
+        return pending(job)
 
     else:  # job has downloaded metadata, isn't busy and isn't finished : start download
         job.start_download()
-        return {"status": "pending", "html": job.get_status()}, 202
+        return pending(job)
 
 
 # ----------------------------------------------- Update ----------------------------------------------- #
-import time
-from threading import Thread
 import datetime
-from .. import utils
+from . import incremental
 
 
 @app.route("/api/addnovel/update")
@@ -211,7 +257,7 @@ def update():
         if isinstance(job, FinishedJob):
             return {"status": "success", "message": job.get_status(), "url": job.url}, 200
         else:
-            return {"status": "pending", "message": job.get_status()}, 202
+            return pending(job)
     else:
         # We check if it has aldreay been updated in the last hour
         job = [job for job in database.jobs.values() if job.original_query == url]
@@ -224,48 +270,44 @@ def update():
                         "message": "Novel recently updated, please wait a bit before retrying",
                     }, 409
 
-        Thread(target=_update, args=(url, job_id)).start()
-        return {"status": "pending", "message": "Creating session"}, 202
-
+        job, created = get_or_create_job(job_id, url)
+        if not created:
+            # Already downloading or updating for another visitor
+            if job.metadata_downloaded and not job.is_busy:
+                job.start_download()
+            return pending(job)
 
-import json
-
-def _update(url: str, job_id: str):
-    job = database.jobs[job_id] = JobHandler(job_id)
-    job.original_query = url
-    job.prepare_direct_download(url)
-    while job.is_busy:
-        time.sleep(0.1)
+        job.is_busy = True
+        try:
+            # Queued as a whole : the update does not hold a thread while waiting for the novel info
+            database.job_scheduler.submit(
+                job_id, _update, job, priority=PRIORITY_UPDATE, host=urlparse(url).netloc
+            )
+        except QueueFull:
+            job._release()
+            database.jobs.pop(job_id, None)
+            raise
+        return pending(job)
+
+
+def _update(job: JobHandler):
+    job.prepare_update()
+    if job.destroyed:
+        # Crashed, or attached to the job already downloading the source
+        return
 
     source_folder_path = lib.LIGHTNOVEL_FOLDER / job.novel_slug / job.source_slug
-    if lib.COMPRESSION_ENABLED:
-        # Before we can start checking we need to extract the json files
-        if (source_folder_path / "json.7z").exists():
-            result = utils.extract_tar_7zip_folder(source_folder_path / "json.7z", source_folder_path)
-            if not result:
-                job.set_last_action("Failed to extract json files")
-                job.destroy()
-                return
-
-    json_folder_path = source_folder_path / "json"
-
-    # region missing chapters
-
-    missing_chapters = False
-    for chapter in job.app.crawler.chapters:
-        chapter_path = json_folder_path / f"{str(chapter['id']).zfill(5)}.json"
-
-        if chapter_path.exists():
-            # We assume that if the body lenght is < 100 it was not downloaded correctly
-            with open(str(chapter_path), "r", encoding="utf-8") as f:
-                json_data = json.load(f)
-            if len(json_data["body"]) < 100 or "Failed to download chapter body" in json_data["body"]:
-                # we simply delete the file for it to be re downloaded
-                chapter_path.unlink()
-                missing_chapters = True
+    stored = incremental.read_stored_chapters(source_folder_path)
+    if stored is None:
+        # Missing meta : the whole source is downloaded again
+        job.start_download_sync()
+        return
 
-        else:
-            missing_chapters = True
+    # region new and changed chapters
+
+    # Compared with meta.json : the chapter files are not read, json.7z is not extracted
+    chapters = incremental.diff_chapters(stored, job.app.crawler.chapters)
+    incremental.remove_stale_files(source_folder_path, stored, chapters)
 
     # endregion
 
@@ -280,34 +322,7 @@ def _update(url: str, job_id: str):
     missing_cover = not image_path.exists()
 
     # endregion
-
-    # region missing images
-    meta_folder = lib.LIGHTNOVEL_FOLDER / job.novel_slug / job.source_slug / "meta.json"
-    missing_meta = False
-    if meta_folder.exists():
-        with open(str(meta_folder), "r", encoding="utf-8") as f:
-            meta = json.load(f)
-
-        image_folder = lib.LIGHTNOVEL_FOLDER / job.novel_slug / job.source_slug / "images"
-
-        missing_images = False
-        for chapter in (meta["novel"]["chapters"]) if ("novel" in meta) else meta["chapters"]:
-            # {"3e14b82305271562c7e800d612cff023.jpg": "https://cdn1.mangaclash.com/temp/manga_62d6697ba3072/80980f031c78a3c45513ddabf083b99a/1.jpg"}
-            if "images" in chapter:
-                for image_id in chapter["images"]:
-                    image_path = image_folder / image_id
-
-                    if not image_path.exists():
-                        missing_images = True
-                        break
-
-            if missing_images:
-                break
-    else:
-        missing_meta = True
-
-    # endregion
-    if missing_chapters or missing_cover or missing_images or missing_meta:
+    if chapters or missing_cover:
         # Ebook are disabled for now
         # We delete the ebook folders to force the creation of a new one
         # ebook_folders_path = [source_folder_path / "epub"]
@@ -315,7 +330,8 @@ def _update(url: str, job_id: str):
         #     if ebook_folder_path.exists():
         #         shutil.rmtree(str(ebook_folder_path))
 
-        job.start_download()
+        # Already in a job thread
+        job.start_download_sync(chapters)
 
     else:
         job.set_last_action("Nothing new")
@@ -323,25 +339,52 @@ def _update(url: str, job_id: str):
         return
 
 
+def scheduled_update(url: str, on_done) -> bool:
+    """
+    Update started by the refresh scheduler, False if it could not be queued.
+    on_done(number of chapters downloaded) is called at the end, on_done(None) if it failed.
+    """
+    job_id = "refresh-" + normalize_url(url)
+    job, created = get_or_create_job(job_id, url)
+    if not created:
+        # Already downloading or updating for a visitor
+        return False
+
+    job.is_busy = True
+    try:
+        database.job_scheduler.submit(
+            job_id, _scheduled_update, job, on_done, priority=PRIORITY_REFRESH, host=urlparse(url).netloc
+        )
+    except QueueFull:
+        job._release()
+        database.jobs.pop(job_id, None)
+        return False
+    return True
+
+
+def _scheduled_update(job: JobHandler, on_done):
+    new_chapters = None
+    try:
+        _update(job)
+        if not job.crashed:
+            new_chapters = len(job.changed_chapters or [])
+    finally:
+        on_done(new_chapters)
+
+
 # ----------------------------------------------- Load snapshot ----------------------------------------------- #
 @app.route("/api/addnovel/load_snapshot")
 @app.route("/addnovel/load_snapshot")
 def load_snapshot():
     job_id = request.args.get("job_id")
-    if job_id in database.jobs:
-        job = database.jobs[job_id]
-    else:
-        logger.info("Job not found")
-        return {"status": "error", "message": "Invalid job_id"}, 400
-
-    if not isinstance(job, FinishedJob):
+    job = database.jobs.get(job_id)
+    # A missing job can still have a snapshot : finished an hour ago, or before a restart
+    if job is not None and not isinstance(job, FinishedJob):
         logger.info("Job not finished")
         return {"status": "error", "message": "Job is not finished"}, 400
 
-    if not job.snapshot_exists():
+    if restore_snapshot(job_id) is None:
         logger.info("Snapshot not found")
         return {"status": "error", "message": "No snapshot for this job"}, 400
 
-    job.restore_snapshot()
-
     return {"status": "success", "message": "Snapshot loaded"}, 200
@@ -2,6 +2,7 @@ from flask import Flask, request
 from flask_cors import CORS, cross_origin
 from flask_compress import Compress
 from . import lib
+from . import workers
 
 origins = [
     lib.WEBSITE_URL,
@@ -13,6 +14,15 @@ app = Flask(__name__)
 CORS(app, origins=origins)
 Compress(app)
 
+if lib.SHARED_WORKERS and not lib.IS_OWNER:
+
+    @app.before_request
+    def forward_to_owner():
+        # Jobs and comments only live in the owner
+        if workers.is_owner_request(request.path):
+            return workers.forward_to_owner(lib.OWNER_URL)
+
+
 @app.route("/")
 @cross_origin()
 def hello_world():
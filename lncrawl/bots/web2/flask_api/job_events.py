@@ -0,0 +1,152 @@
+"""
+Status of the add-novel jobs, pushed to the visitors with Server-Sent Events.
+
+The jobs publish their status when it changes (phase, progress, place in the
+queue, end) : the latest status of each requester is kept here, so the polling
+routes return it without computing anything, and /addnovel/events streams it.
+
+A stream holds a thread of the server while it is open : at most max_streams
+are open at the same time (the others get a 503 and poll), and each stream is
+closed after `duration` seconds, the browser opens it again by itself.
+"""
+from __future__ import annotations
+import json
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+KEEPALIVE_INTERVAL = 15  # seconds, comment line sent when nothing changed
+MIN_EVENT_INTERVAL = 0.5  # seconds, the progress of a fast download is sent at this pace
+RECONNECT_DELAY = 3000  # ms, retry field of the stream
+
+
+class TooManyStreams(Exception):
+    pass
+
+
+class JobEvents:
+    def __init__(self, max_streams: int = 16, duration: float = 60):
+        self.max_streams = max_streams
+        self.duration = duration
+        self._lock = threading.Lock()
+        # requester job_id : (event id, status)
+        self._status: Dict[str, Tuple[int, dict]] = {}
+        # requester job_id : (condition of its open streams, number of streams waiting)
+        self._waiting: Dict[str, Tuple[threading.Condition, int]] = {}
+        self._streams = 0
+        self._event_id = 0
+        self.published = 0
+        self.streams_opened = 0
+        self.streams_refused = 0
+
+    def publish(self, job_ids, status: dict):
+        """New status of the requesters job_ids, their streams are woken up"""
+        with self._lock:
+            self.published += 1
+            for job_id in job_ids:
+                entry = self._status.get(job_id)
+                if entry is not None and entry[1] == status:
+                    continue
+                self._event_id += 1
+                self._status[job_id] = (self._event_id, status)
+                if job_id in self._waiting:
+                    self._waiting[job_id][0].notify_all()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        entry = self._status.get(job_id)
+        return entry[1] if entry is not None else None
+
+    def forget(self, job_ids):
+        """Job destroyed, the open streams send nothing more"""
+        with self._lock:
+            for job_id in job_ids:
+                self._status.pop(job_id, None)
+
+    def _wait(self, job_id: str, last_id: int, timeout: float) -> Optional[Tuple[int, dict]]:
+        """Next status of job_id after the event last_id, None on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition, streams = self._waiting.get(job_id, (None, 0))
+            if condition is None:
+                condition = threading.Condition(self._lock)
+            self._waiting[job_id] = (condition, streams + 1)
+            try:
+                while True:
+                    entry = self._status.get(job_id)
+                    if entry is not None and entry[0] > last_id:
+                        return entry
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    condition.wait(remaining)
+            finally:
+                condition, streams = self._waiting[job_id]
+                if streams > 1:
+                    self._waiting[job_id] = (condition, streams - 1)
+                else:
+                    del self._waiting[job_id]
+
+    def open_stream(self, job_id: str, last_id: int = 0) -> Iterator[str]:
+        """
+        The statuses of job_id as Server-Sent Events, until the job ends or `duration` seconds.
+        TooManyStreams if max_streams are already open.
+        """
+        with self._lock:
+            if self._streams >= self.max_streams:
+                self.streams_refused += 1
+                raise TooManyStreams(f"{self._streams} progress streams are open")
+            self._streams += 1
+            self.streams_opened += 1
+        return _Stream(self, self._stream(job_id, last_id))
+
+    def _stream_closed(self):
+        with self._lock:
+            self._streams -= 1
+
+    def _stream(self, job_id: str, last_id: int) -> Iterator[str]:
+        yield f"retry: {RECONNECT_DELAY}\n\n"
+        end = time.monotonic() + self.duration
+        while True:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            entry = self._wait(job_id, last_id, min(KEEPALIVE_INTERVAL, remaining))
+            if entry is None:
+                yield ": keepalive\n\n"
+                continue
+            last_id, status = entry
+            yield f"id: {last_id}\ndata: {json.dumps(status)}\n\n"
+            if status["status"] != "pending":
+                # Finished, or waiting for the next request of the visitor
+                return
+            # The statuses published meanwhile are merged in the next one
+            time.sleep(MIN_EVENT_INTERVAL)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "jobs": len(self._status),
+                "open_streams": self._streams,
+                "max_streams": self.max_streams,
+                "streams_opened": self.streams_opened,
+                "streams_refused": self.streams_refused,
+                "published": self.published,
+            }
+
+
+class _Stream:
+    """Response body of a stream : the server calls close when the connection ends, even before the first event"""
+
+    def __init__(self, events: JobEvents, events_iterator: Iterator[str]):
+        self._events = events
+        self._iterator = events_iterator
+        self._closed = False
+
+    def __iter__(self):
+        return self._iterator
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._iterator.close()
+            self._events._stream_closed()
@@ -0,0 +1,252 @@
+"""
+Runs the tasks of the add-novel jobs (searches, novel info, downloads, updates)
+on a fixed pool of threads shared by every job.
+
+- At most `workers` tasks run at the same time, and at most `per_host` on the
+  same source website : the next task of another website goes first.
+- Waiting tasks are ordered by priority, then by arrival. Searches go first (the
+  visitor is waiting for the results), then new downloads, then updates, then
+  the updates of the refresh scheduler.
+- Admission control : when `queue_limit` tasks are waiting, submit raises
+  QueueFull and the visitor is asked to retry later.
+- on_queue_change({job_id: position}) is called when the places of the waiting
+  tasks change (1 : next, None : the task started), the jobs publish them.
+- The jobs are destroyed one hour after their creation by a single timer wheel
+  instead of a thread each.
+"""
+from __future__ import annotations
+import gc
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from sortedcontainers import SortedList
+
+PRIORITY_SEARCH = 0
+PRIORITY_DOWNLOAD = 1
+PRIORITY_UPDATE = 2
+PRIORITY_REFRESH = 3
+
+GC_INTERVAL = 600  # seconds, garbage collection after jobs were destroyed
+
+
+class QueueFull(Exception):
+    pass
+
+
+# region Timer wheel
+
+
+class TimerWheel:
+    """
+    Calls callbacks after a delay, with a precision of `tick` seconds.
+    The callbacks run in the thread of the wheel : they must be short.
+    """
+
+    def __init__(self, tick: float = 1, slots: int = 512):
+        self.tick = tick
+        self._slots: List[List[list]] = [[] for _ in range(slots)]
+        self._position = 0
+        self._lock = threading.Lock()
+        self._started = False
+
+    def call_later(self, delay: float, callback: Callable[[], Any]) -> list:
+        """The returned timer can be passed to cancel"""
+        ticks = max(1, round(delay / self.tick))
+        with self._lock:
+            # Due at the rounds-th visit of the slot after offset ticks
+            rounds, offset = divmod(ticks - 1, len(self._slots))
+            offset += 1
+            timer = [rounds, callback]
+            self._slots[(self._position + offset) % len(self._slots)].append(timer)
+        return timer
+
+    @staticmethod
+    def cancel(timer: list):
+        timer[1] = None
+
+    def _advance(self) -> List[Callable[[], Any]]:
+        with self._lock:
+            self._position = (self._position + 1) % len(self._slots)
+            slot = self._slots[self._position]
+            due = [timer[1] for timer in slot if timer[0] == 0 and timer[1] is not None]
+            kept = []
+            for timer in slot:
+                if timer[0] > 0 and timer[1] is not None:
+                    timer[0] -= 1
+                    kept.append(timer)
+            self._slots[self._position] = kept
+        return due
+
+    def run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            time.sleep(max(0, next_tick - time.monotonic()))
+            for callback in self._advance():
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"Error in a timer callback: {e}")
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            threading.Thread(target=self.run, daemon=True).start()
+
+
+# endregion
+
+
+class Task:
+    __slots__ = ("priority", "seq", "job_id", "host", "function", "args")
+
+    def __init__(self, priority: int, seq: int, job_id: str, host: Optional[str], function, args):
+        self.priority = priority
+        self.seq = seq
+        self.job_id = job_id
+        self.host = host
+        self.function = function
+        self.args = args
+
+
+class JobScheduler:
+    def __init__(self, workers: int = 4, per_host: int = 2, queue_limit: int = 100):
+        self.workers = max(1, workers)
+        self.per_host = max(1, per_host)
+        self.queue_limit = queue_limit
+        self.timers = TimerWheel()
+
+        self._queue = SortedList(key=lambda task: (task.priority, task.seq))
+        self._seq = itertools.count()
+        self._running: Dict[str, int] = {}  # host : running tasks
+        self._active = 0
+        self._cond = threading.Condition()
+        self._started = False
+        self._destroyed_jobs = 0
+        self._positions: Dict[str, int] = {}  # job_id : place of its waiting task, last reported
+        self.on_queue_change: Callable[[Dict[str, Optional[int]]], Any] = lambda positions: None
+        self.completed = 0
+        self.rejected = 0
+
+    # region Queue
+
+    def submit(
+        self,
+        job_id: str,
+        function: Callable,
+        *args,
+        priority: int = PRIORITY_DOWNLOAD,
+        host: Optional[str] = None,
+    ):
+        """Queue function(*args), host : website the task crawls, None for searches"""
+        with self._cond:
+            if len(self._queue) >= self.queue_limit:
+                self.rejected += 1
+                raise QueueFull(f"{len(self._queue)} tasks are waiting, please retry in a few minutes")
+            self._queue.add(Task(priority, next(self._seq), job_id, host, function, args))
+            self._cond.notify()
+            changes = self._positions_changed()
+        self._report(changes)
+
+    def position(self, job_id: str) -> Optional[int]:
+        """Place of the waiting task of the job in the queue (1 : next), None if not waiting"""
+        return self._positions.get(job_id)
+
+    def _positions_changed(self) -> Dict[str, Optional[int]]:
+        """Places that changed since the last call, called with the lock held"""
+        positions = {}
+        for i, task in enumerate(self._queue, start=1):
+            positions.setdefault(task.job_id, i)
+        changes = {job_id: None for job_id in self._positions if job_id not in positions}
+        for job_id, position in positions.items():
+            if self._positions.get(job_id) != position:
+                changes[job_id] = position
+        self._positions = positions
+        return changes
+
+    def _report(self, changes: Dict[str, Optional[int]]):
+        if not changes:
+            return
+        try:
+            self.on_queue_change(changes)
+        except Exception as e:
+            print(f"Error while reporting the queue positions: {e}")
+
+    def _next(self) -> Task:
+        """First waiting task whose host is below its limit, called with the lock held"""
+        while True:
+            if self._active < self.workers:
+                for task in self._queue:
+                    if task.host is None or self._running.get(task.host, 0) < self.per_host:
+                        self._queue.remove(task)
+                        self._active += 1
+                        if task.host is not None:
+                            self._running[task.host] = self._running.get(task.host, 0) + 1
+                        return task
+            self._cond.wait()
+
+    def _done(self, task: Task):
+        with self._cond:
+            self._active -= 1
+            self.completed += 1
+            if task.host is not None:
+                count = self._running.pop(task.host) - 1
+                if count:
+                    self._running[task.host] = count
+            # A task of the same host may be allowed now
+            self._cond.notify_all()
+
+    def work(self):
+        while True:
+            with self._cond:
+                task = self._next()
+                changes = self._positions_changed()
+            self._report(changes)
+            try:
+                task.function(*task.args)
+            except Exception as e:
+                print(f"Error in job {task.job_id}: {e}")
+            finally:
+                self._done(task)
+
+    # endregion
+
+    # region Cleanup
+
+    def job_destroyed(self):
+        """Count the destroyed jobs, their memory is collected periodically"""
+        with self._cond:
+            self._destroyed_jobs += 1
+
+    def _collect_garbage(self):
+        with self._cond:
+            destroyed, self._destroyed_jobs = self._destroyed_jobs, 0
+        if destroyed:
+            # Apps and crawlers of the destroyed jobs have reference cycles
+            threading.Thread(target=gc.collect, daemon=True).start()
+        self.timers.call_later(GC_INTERVAL, self._collect_garbage)
+
+    # endregion
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self.work, name=f"job-worker-{i}", daemon=True).start()
+        self.timers.start()
+        self.timers.call_later(GC_INTERVAL, self._collect_garbage)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "per_host": self.per_host,
+                "running": self._active,
+                "waiting": len(self._queue),
+                "hosts": dict(self._running),
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
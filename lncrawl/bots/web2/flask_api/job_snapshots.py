@@ -0,0 +1,159 @@
+"""
+Search results of the add-novel jobs, kept to retry with another source.
+
+When a download fails, the visitor can go back to the novels found by their
+search without searching again : the results are kept as a plain record
+(query, results, dates) instead of a whole JobHandler. The JobHandler is only
+built again from the record when the visitor retries.
+
+- At most max_entries records, the least recently used are dropped first.
+- A record is dropped ttl seconds after its last use.
+- With a state file, the records are saved a few seconds after a change and
+  loaded at the next start, a retry still works after a restart.
+"""
+from __future__ import annotations
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+import msgspec
+
+SAVE_DELAY = 5  # seconds, changes made meanwhile are saved together
+
+
+class JobSnapshot(msgspec.Struct):
+    job_id: str
+    query: str
+    search_results: dict  # response of /addnovel/get_novels_founds
+    novels: List[dict]  # App.search_results : title and sources of each novel found
+    created: float
+    used: float
+
+
+class JobSnapshotStore:
+    def __init__(self, max_entries: int = 1000, ttl: float = 7200, state_file: Optional[Path] = None, timers=None):
+        """timers : TimerWheel delaying the saves, required with a state file"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.state_file = state_file
+        self.timers = timers
+        self._entries: "OrderedDict[str, JobSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_pending = False
+        self.restored = 0
+        self.expired = 0
+        self.evicted = 0
+        if state_file is not None:
+            self._load()
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job_id: str):
+        return self.get(job_id, touch=False) is not None
+
+    def put(self, job_id: str, query: str, search_results: dict, novels: List[dict]):
+        now = time.time()
+        snapshot = JobSnapshot(job_id, query, search_results, novels, now, now)
+        with self._lock:
+            self._entries.pop(job_id, None)
+            self._entries[job_id] = snapshot
+            self._evict(now)
+        self._changed()
+
+    def get(self, job_id: str, touch: bool = True) -> Optional[JobSnapshot]:
+        """The snapshot of job_id, None if missing or expired. touch : it is used, its ttl starts again"""
+        now = time.time()
+        with self._lock:
+            snapshot = self._entries.get(job_id)
+            if snapshot is None:
+                return None
+            if snapshot.used + self.ttl < now:
+                del self._entries[job_id]
+                self.expired += 1
+                return None
+            if touch:
+                snapshot.used = now
+                self._entries.move_to_end(job_id)
+                self.restored += 1
+        if touch:
+            self._changed()
+        return snapshot
+
+    def pop(self, job_id: str):
+        with self._lock:
+            removed = self._entries.pop(job_id, None)
+        if removed is not None:
+            self._changed()
+
+    def _evict(self, now: float):
+        """Expired and least recently used snapshots, called with the lock held"""
+        while self._entries:
+            job_id, oldest = next(iter(self._entries.items()))
+            if oldest.used + self.ttl < now:
+                self.expired += 1
+            elif len(self._entries) > self.max_entries:
+                self.evicted += 1
+            else:
+                break
+            del self._entries[job_id]
+
+    # region Persistence
+
+    def _load(self):
+        try:
+            with open(self.state_file, "rb") as f:
+                snapshots = msgspec.json.decode(f.read(), type=List[JobSnapshot])
+        except FileNotFoundError:
+            return
+        except (OSError, msgspec.DecodeError) as e:
+            print(f"Error while loading the job snapshots: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for snapshot in sorted(snapshots, key=lambda snapshot: snapshot.used):
+                self._entries[snapshot.job_id] = snapshot
+            self._evict(now)
+
+    def _changed(self):
+        if self.state_file is None or self.timers is None:
+            return
+        with self._lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+        self.timers.call_later(SAVE_DELAY, self.save)
+
+    def save(self):
+        if self.state_file is None:
+            return
+        with self._lock:
+            self._save_pending = False
+            self._evict(time.time())
+            data = msgspec.json.encode(list(self._entries.values()))
+        tmp_file = self.state_file.with_name(self.state_file.name + ".tmp")
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(data)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            print(f"Error while saving the job snapshots: {e}")
+
+    # endregion
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "snapshots": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "persistent": self.state_file is not None,
+                "restored": self.restored,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
@@ -1,17 +1,38 @@
 from __future__ import annotations
-from typing import List
 from pathlib import Path
 import json
 
 # from .... import constants
-from .Novel import Novel
 from . import database
 from . import read_novel_info
 from . import utils
+from . import loader
+from .catalog import Catalog
+from .stats_store import StatsStore
+from .shared_stats import SharedStatsStore
+from .chapter_cache import ChapterCache, DEFAULT_MAX_BYTES as DEFAULT_CHAPTER_CACHE_SIZE
+from .response_cache import ResponseCache, DEFAULT_MAX_BYTES as DEFAULT_RESPONSE_CACHE_SIZE
+from .thumbnails import ThumbnailPipeline
+from .compression import CompressionScheduler
+from .comment_store import CommentStore
+from .job_scheduler import JobScheduler
+from .job_events import JobEvents
+from .job_snapshots import JobSnapshotStore
+from .library_watcher import LibraryWatcher
+from .refresh_scheduler import RefreshScheduler
+from . import workers
 from .... import constants
+from ....core.arguments import get_args
+from ....core import novel_search
 
 LIGHTNOVEL_FOLDER = Path(constants.DEFAULT_OUTPUT_PATH)
 COMMENT_FOLDER = LIGHTNOVEL_FOLDER.parent / "Comments"
+CATALOG_FILE = LIGHTNOVEL_FOLDER.parent / "catalog.msgpack"
+STATS_JOURNAL_FILE = LIGHTNOVEL_FOLDER.parent / "stats-journal.log"
+SHARED_STATS_FILE = LIGHTNOVEL_FOLDER.parent / "shared-stats.sqlite"
+COMPRESSION_STATE_FILE = LIGHTNOVEL_FOLDER.parent / "compression-state.json"
+REFRESH_STATE_FILE = LIGHTNOVEL_FOLDER.parent / "refresh-schedule.json"
+JOB_SNAPSHOTS_FILE = LIGHTNOVEL_FOLDER.parent / "job-snapshots.json"
 
 if not LIGHTNOVEL_FOLDER.exists():
     LIGHTNOVEL_FOLDER.mkdir()
@@ -33,6 +54,31 @@ if not config_file.exists():
                 "api_host": "localhost",
                 "api_port": 5000,
                 "compression_enabled": "true",
+                "chapter_cache_size": 64 * 1024 * 1024,
+                "response_cache_size": 32 * 1024 * 1024,
+                "thumbnail_processes": 2,
+                "compression_workers": 2,
+                "compression_max_mb_per_second": 0,
+                "compression_order": "largest",
+                "api_workers": 1,
+                "library_watcher": "true",
+                "library_poll_interval": 30,
+                "job_workers": 4,
+                "job_workers_per_host": 2,
+                "job_queue_limit": 100,
+                "refresh_scheduler": "false",
+                "refresh_budget_per_hour": 30,
+                "refresh_host_delay": 600,
+                "api_threads": 32,
+                "event_streams_max": 16,
+                "event_stream_duration": 60,
+                "job_snapshots_max": 1000,
+                "job_snapshot_ttl": 7200,
+                "job_snapshots_persist": "false",
+                "search_cache_ttl": 3600,
+                "search_cache_stale_ttl": 86400,
+                "search_cache_size": 10000,
+                "diagnostics": "false",
             },
             f,
             indent=4,
@@ -53,46 +99,127 @@ PORT = int(config["api_port"])
 MAX_EBOOK_SIZE = int(config["max_ebook_size"])
 
 COMPRESSION_ENABLED = config["compression_enabled"] == "true"
+# Sources compressed at the same time, one single-threaded 7z each
+COMPRESSION_WORKERS = int(config.get("compression_workers", 2))
+# Bytes read by the compression per second, 0 : no limit
+COMPRESSION_MAX_MB_PER_SECOND = float(config.get("compression_max_mb_per_second", 0))
+# largest or coldest (least clicked novels) first
+COMPRESSION_ORDER = config.get("compression_order", "largest")
+
+# Bytes of serialized chapters kept in memory
+CHAPTER_CACHE_SIZE = int(config.get("chapter_cache_size", DEFAULT_CHAPTER_CACHE_SIZE))
+# Bytes of encoded and compressed catalog responses kept in memory
+RESPONSE_CACHE_SIZE = int(config.get("response_cache_size", DEFAULT_RESPONSE_CACHE_SIZE))
+THUMBNAIL_PROCESSES = int(config.get("thumbnail_processes", 2))
+
+# API processes sharing the port, see workers.py (waitress only, not in dev mode)
+API_WORKERS = int(config.get("api_workers", 1)) if config["dev_mode"] == "false" else 1
+SHARED_WORKERS = API_WORKERS > 1
+IS_OWNER = workers.IS_OWNER
+# Local port of the owner, the other workers forward it the jobs and comments
+OWNER_PORT = int(config.get("api_owner_port", PORT + 1))
+OWNER_URL = f"http://127.0.0.1:{OWNER_PORT}"
+
+# Novels added, changed or deleted on disk are reloaded without a restart
+LIBRARY_WATCHER = config.get("library_watcher", "true") == "true"
+# Seconds between two scans of the library when inotify is unavailable
+LIBRARY_POLL_INTERVAL = float(config.get("library_poll_interval", 30))
+
+# Add-novel tasks (searches, downloads, updates) running at the same time, in total and per website
+JOB_WORKERS = int(config.get("job_workers", 4))
+JOB_WORKERS_PER_HOST = int(config.get("job_workers_per_host", 2))
+# Tasks waiting for a thread before new jobs are refused
+JOB_QUEUE_LIMIT = int(config.get("job_queue_limit", 100))
+
+# Background updates of the library : "true", "false" or "dry_run" (print the planned updates only)
+REFRESH_SCHEDULER = config.get("refresh_scheduler", "false")
+# Updates started per hour by the refresh scheduler, all websites together
+REFRESH_BUDGET_PER_HOUR = float(config.get("refresh_budget_per_hour", 30))
+# Seconds between two updates of the same website
+REFRESH_HOST_DELAY = float(config.get("refresh_host_delay", 600))
+
+# Threads of waitress, each open progress stream holds one
+API_THREADS = int(config.get("api_threads", 32))
+# Progress streams open at the same time, the other visitors poll
+EVENT_STREAMS_MAX = int(config.get("event_streams_max", 16))
+# Seconds before a progress stream is closed, the browser opens it again
+EVENT_STREAM_DURATION = float(config.get("event_stream_duration", 60))
+
+# Search results kept to retry a failed download with another source, and seconds after their last use
+JOB_SNAPSHOTS_MAX = int(config.get("job_snapshots_max", 1000))
+JOB_SNAPSHOT_TTL = float(config.get("job_snapshot_ttl", 7200))
+# Saved in job-snapshots.json, a retry still works after a restart
+JOB_SNAPSHOTS_PERSIST = config.get("job_snapshots_persist", "false") == "true"
+
+# Internal counters of the caches, jobs and schedulers under /api/*_cache/, /api/jobs/... (404 when disabled)
+DIAGNOSTICS = config.get("diagnostics", "false") == "true"
+
+# Search results of each source shared by the searches : seconds they are used as they are,
+# seconds they are used while the source is searched again, source and query pairs kept
+novel_search.search_cache.ttl = float(config.get("search_cache_ttl", 3600))
+novel_search.search_cache.stale_ttl = float(config.get("search_cache_stale_ttl", 86400))
+novel_search.search_cache.max_entries = int(config.get("search_cache_size", 10000))
 
 from . import naming_rules
 
-naming_rules.fix_existing()
+if IS_OWNER:
+    naming_rules.fix_existing()
 
-database.all_novels: List[Novel] = []  # type: ignore
-number_of_novel = len(list(LIGHTNOVEL_FOLDER.iterdir()))
-print("Loading novels")
-novel_folder = None
-for i, novel_folder in enumerate(LIGHTNOVEL_FOLDER.iterdir()):
-    try:
-        if novel_folder.is_dir():
-            novel = read_novel_info.get_novel_info(novel_folder)
-            database.all_novels.append(novel)
-            for tag in novel.tags:
-                utils.add_tag(tag)
-
-            print(f"Loaded {i+1}/{number_of_novel} : {novel_folder.name}")
-            print(f"\033[F\033[K", end="")
-
-    except Exception as e:
-        print(f"Error while reading novel info from {novel_folder.name}: {e}")
-        # Uncomment this to debug
-        # import traceback
-
-        # traceback.print_exc()
-
-        # import sys
-        # sys.exit(1)
-if novel_folder:  # When the novel folder is empty, novel_folder is null
-    print(f"Loaded {number_of_novel}/{number_of_novel} : {novel_folder.name}")
-
-database.set_ranks()
+# Snapshot of every source meta.json, only the modified ones are read again
+catalog = Catalog(CATALOG_FILE)
+REBUILD_CATALOG = get_args().rebuild_catalog
+if REBUILD_CATALOG:
+    catalog.clear()
 
+if SHARED_WORKERS:
+    # Created before loading : the novels downloaded meanwhile are read again
+    database.stats_store = SharedStatsStore(
+        STATS_JOURNAL_FILE, SHARED_STATS_FILE, workers.WORKER_ID, API_WORKERS
+    )
+else:
+    database.stats_store = StatsStore(STATS_JOURNAL_FILE)
 
-database.all_sources = [
-    source for novel in database.all_novels for source in novel.sources
-]
+print("Loading novels")
+loader.fill_database(loader.load_novels(LIGHTNOVEL_FOLDER, catalog))
+
+if IS_OWNER:
+    # The other workers load the snapshot written by the owner
+    catalog.prune_unseen()
+    catalog.save()
+
+if REBUILD_CATALOG:
+    print(f"Catalog rebuilt : {CATALOG_FILE}")
+    import sys
+
+    sys.exit(0)
+
+replayed = database.stats_store.replay(
+    database.all_novels, lambda slug: database.novels_by_slug.get(slug)
+)
+
+# Started first : the workers are forked before the other threads exist (job scheduler, timers...)
+database.thumbnails = ThumbnailPipeline(LIGHTNOVEL_FOLDER, THUMBNAIL_PROCESSES if IS_OWNER else 0)
+database.thumbnails.start([source.path for source in database.all_sources])
+
+database.comment_store = CommentStore(shared=not IS_OWNER)
+# The other workers forward the add-novel requests to the owner
+database.job_scheduler = JobScheduler(JOB_WORKERS, JOB_WORKERS_PER_HOST, JOB_QUEUE_LIMIT)
+if IS_OWNER:
+    database.job_scheduler.start()
+database.job_events = JobEvents(EVENT_STREAMS_MAX, EVENT_STREAM_DURATION)
+database.jobs_snapshots = JobSnapshotStore(
+    JOB_SNAPSHOTS_MAX,
+    JOB_SNAPSHOT_TTL,
+    JOB_SNAPSHOTS_FILE if JOB_SNAPSHOTS_PERSIST and IS_OWNER else None,
+    database.job_scheduler.timers,
+)
+database.chapter_cache = ChapterCache(CHAPTER_CACHE_SIZE, utils.get_chapter)
+database.response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
 
 database.refresh_sorted_all()
+if replayed:
+    # Replayed clicks can change the ranks set while loading
+    database.set_ranks()
 
 # all_tags: Dict[str,list] = {} # sanatized : [raw : count]
 database.top_tags = [
@@ -106,102 +233,115 @@ database.top_tags = [
 
 from . import sitemap
 
-sitemap_file = Path("lncrawl/bots/web2/sitemap.xml")
-sitemap.generate_sitemap(sitemap_file)
+# Written in the background, /sitemap.xml serves the index
+sitemap_writer = sitemap.SitemapWriter(Path("lncrawl/bots/web2/sitemaps"), WEBSITE_URL, API_URL)
+if IS_OWNER:
+    sitemap_writer.start()
 
-import threading
+def _novel_clicks(source_folder: Path) -> int:
+    source = database.sources_by_path.get(source_folder)
+    return sum(source.novel.clicks.values()) if source else 0
 
-if COMPRESSION_ENABLED:
-    # Create a new thread that will compress all json folder to 7z in the background
 
-    tasks = []
-    for novel in database.all_novels:
-        for source in novel.sources:
-            if (source.path / "json").exists() and not (
-                source.path / "json.7z"
-            ).exists():
-                tasks.append(
-                    (
-                        utils.compress_folder_to_tar_7zip,
-                        (source.path, "json", source.path / "json.7z"),
-                    )
-                )
-                # tasks.append(
-                #     (
-                #         utils.extract_tar_7zip_folder,
-                #         (source.path / "json.7z", source.path),
-                #     )
-                # )
-
-    # Start the thread
-    threading.Thread(
-        target=utils.run_tasks,
-        args=(tasks,),
-        daemon=True,
-    ).start()
-
-
-import time
-import shutil
-
-
-def _update_novel_stats(novel: Novel):
-    """
-    function to update a novel stats
-    args: novel: Novel
-    """
-    stat_path = novel.path / "stats.json"
-
-    if not stat_path.exists():
-        shutil.copyfile("bots/web2/flask_api/_stats.json", stat_path)
-
-    with open(stat_path, "w", encoding="utf-8") as f:
-
-        novel_stats = {
-            "clicks": novel.clicks,
-            "ratings": novel.ratings,
-            "comment_count": novel.comment_count,
-            "source_ratings": {
-                source.slug: source.source_rating for source in novel.sources
-            },
-        }
+# Downloads wait for the compression of their source, even when compression is disabled
+database.compression = CompressionScheduler(
+    COMPRESSION_STATE_FILE,
+    COMPRESSION_WORKERS,
+    COMPRESSION_MAX_MB_PER_SECOND * 1024 * 1024,
+    COMPRESSION_ORDER,
+    clicks=_novel_clicks,
+)
+if COMPRESSION_ENABLED and IS_OWNER:
+    # Chapter archives and json.7z of the sources left uncompressed, in the background
+    database.compression.start([source.path for source in database.all_sources])
 
-        json.dump(novel_stats, f, indent=4)
 
+import atexit
 
-def update_novels_stats():
-    """function to update each novels stats"""
+# Save novel stats on exit
+atexit.register(database.stats_store.close)
+if IS_OWNER:
+    # Save sources added while running
+    atexit.register(catalog.save)
+
+# Cached responses show the clicks as of the last flush
+database.stats_store.on_flush = database.response_cache.bump
+if SHARED_WORKERS:
+    database.stats_store.on_event = database.update_sorted_stats
+
+    def _reload_novel(novel_folder: Path):
+        """Novel downloaded by the owner, or changed on disk"""
+        if novel_folder.is_dir() and any((folder / "meta.json").exists() for folder in novel_folder.iterdir()):
+            utils.add_novel_to_database(read_novel_info.get_novel_info(novel_folder, catalog))
+        else:
+            _remove_novel(novel_folder)
+
+    database.stats_store.on_novel = _reload_novel
+# Dirty novels stats are written in the background, the journal keeps the rest in case of crash
+database.stats_store.start()
+
+
+def _remove_novel(novel_folder: Path):
+    novel = database.novels_by_slug.get(naming_rules.clean_name(novel_folder.name))
+    if novel is not None and novel.path == novel_folder.absolute():
+        utils.remove_novel_from_database(novel)
+
+
+def _novel_changed(novel_folder: Path):
+    """Novel added or changed on disk, outside of the website"""
+    novel = read_novel_info.get_novel_info(novel_folder, catalog)
+    utils.add_novel_to_database(novel)
+    if SHARED_WORKERS:
+        database.stats_store.publish_novel(novel_folder)
+    if COMPRESSION_ENABLED:
+        for source in novel.sources:
+            database.compression.submit(source.path)
+    sitemap_writer.schedule()
+    print(f"Reloaded {novel_folder.name}")
 
-    for novel in database.all_novels:
-        if not novel.path:
-            break
 
-        try:
-            _update_novel_stats(novel)
-        except Exception as e:
-            print(f"Error while updating novel stats for {novel}: {e}")
-            try:
-                print(novel.name)
-            except AttributeError:
-                print("name unavailable")
-            continue
+def _novel_removed(novel_folder: Path):
+    """Novel folder deleted, or without any source left"""
+    _remove_novel(novel_folder)
+    if SHARED_WORKERS:
+        database.stats_store.publish_novel(novel_folder)
+    sitemap_writer.schedule()
+    print(f"Removed {novel_folder.name}")
 
-    print("Updated novels stats")
 
+def _novel_busy(novel_folder: Path) -> bool:
+    """A download is writing one of the sources, it adds the novel when done"""
+    return novel_folder.is_dir() and any(
+        database.compression.is_updating(source_folder) for source_folder in novel_folder.iterdir()
+    )
 
-import atexit
 
-# Save novel stats on exit
-atexit.register(update_novels_stats)
+library_watcher = LibraryWatcher(
+    LIGHTNOVEL_FOLDER,
+    on_change=_novel_changed,
+    on_remove=_novel_removed,
+    is_busy=_novel_busy,
+    is_own_write=database.stats_store.wrote,
+    poll_interval=LIBRARY_POLL_INTERVAL,
+)
+if LIBRARY_WATCHER and IS_OWNER:
+    library_watcher.start()
+
 
+def _refresh_source(url: str, on_done) -> bool:
+    # Imported here : the downloader routes import lib
+    from .downloader.routes import scheduled_update
 
-def periodic_update_novels_stats():
-    """function to update each novels stats every hour"""
-    while True:
-        time.sleep(3600)
-        update_novels_stats()
+    return scheduled_update(url, on_done)
 
 
-# In case of an internal error, we want to save the stats every hour as well as on exit
-# This thread will be terminated at the same time as the main thread
-threading.Thread(target=periodic_update_novels_stats, daemon=True).start()
+refresh_scheduler = RefreshScheduler(
+    REFRESH_STATE_FILE,
+    sources=lambda: list(database.all_sources),
+    update=_refresh_source,
+    budget_per_hour=REFRESH_BUDGET_PER_HOUR,
+    host_delay=REFRESH_HOST_DELAY,
+    dry_run=REFRESH_SCHEDULER == "dry_run",
+)
+if REFRESH_SCHEDULER in ("true", "dry_run") and IS_OWNER:
+    refresh_scheduler.start()
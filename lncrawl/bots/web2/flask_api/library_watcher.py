@@ -0,0 +1,313 @@
+"""
+Live reload of the novels changed on disk outside of the website (CLI crawls,
+website_scripts, rsync...), without a restart.
+
+The library is watched with inotify : the library folder, each novel folder
+(sources added or removed, stats.json) and each source folder (meta.json).
+Without inotify (not Linux, watch limit reached), the library is polled every
+POLL_INTERVAL seconds by comparing the mtime and size of the stats.json and
+meta.json files.
+
+A changed novel is only read again once no change happened to it for DEBOUNCE
+seconds : a crawl writing meta.json several times is read once. Only the
+changed meta.json are decoded, the others come from the catalog. The stats.json
+written by the stats store and the sources being written by a download are
+left alone : the download adds the novel itself when it is done.
+"""
+from __future__ import annotations
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+DEBOUNCE = 2  # seconds without change before a novel is read again
+POLL_INTERVAL = 30  # seconds, without inotify
+
+# region inotify
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+FOLDER_EVENTS = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+FILE_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, length of the name
+
+
+class Inotify:
+    """Minimal inotify binding (Linux), OSError if unavailable"""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, "libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(path))
+        return wd
+
+    def read(self, timeout: Optional[float]) -> Iterator[Tuple[int, int, str]]:
+        """(wd, mask, name) of the events, waits at most timeout seconds for the first one"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            yield wd, mask, name
+
+    def close(self):
+        os.close(self.fd)
+
+
+# endregion
+
+
+class LibraryWatcher:
+    def __init__(
+        self,
+        library_folder: Path,
+        on_change: Callable[[Path], None],
+        on_remove: Callable[[Path], None],
+        is_busy: Callable[[Path], bool] = lambda novel_folder: False,
+        is_own_write: Callable[[Path], bool] = lambda file: False,
+        debounce: float = DEBOUNCE,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        """
+        on_change(novel_folder) : the novel was added or changed
+        on_remove(novel_folder) : the novel folder was removed or has no source left
+        is_busy(novel_folder) : a download is writing the novel, it is not read
+        is_own_write(stats_file) : the stats.json was written by this process
+        """
+        self.library_folder = library_folder.absolute()  # as the paths of the novels
+        self.on_change = on_change
+        self.on_remove = on_remove
+        self.is_busy = is_busy
+        self.is_own_write = is_own_write
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.mode = None  # inotify or polling
+        self.reloaded = 0
+        self.removed = 0
+
+        self._pending: Dict[Path, float] = {}  # novel folder : last change
+        # novel folder : (stats.json, {source : meta.json}) mtime and size
+        self._signatures: Dict[Path, tuple] = {}
+        self._watches: Dict[int, Tuple[str, Path]] = {}  # wd : (library, novel or source, folder)
+        self._inotify: Optional[Inotify] = None
+
+    # region Signatures
+
+    @staticmethod
+    def _file_signature(file: Path) -> Optional[Tuple[int, int]]:
+        try:
+            stat = file.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _signature(self, novel_folder: Path) -> tuple:
+        sources = {}
+        try:
+            for source_folder in novel_folder.iterdir():
+                meta = self._file_signature(source_folder / "meta.json")
+                if meta is not None:
+                    sources[source_folder.name] = meta
+        except OSError:
+            pass
+        return self._file_signature(novel_folder / "stats.json"), sources
+
+    def _novel_folders(self) -> List[Path]:
+        return [folder for folder in self.library_folder.iterdir() if folder.is_dir()]
+
+    def _diff(self):
+        """Mark the novels whose files changed since the last scan"""
+        folders = set(self._novel_folders())
+        for novel_folder in folders | set(self._signatures):
+            signature = self._signature(novel_folder) if novel_folder in folders else None
+            old = self._signatures.get(novel_folder)
+            if signature == old:
+                continue
+            if signature is None:
+                del self._signatures[novel_folder]
+            else:
+                self._signatures[novel_folder] = signature
+            if (
+                old is not None
+                and signature is not None
+                and old[1] == signature[1]
+                and self.is_own_write(novel_folder / "stats.json")
+            ):
+                # Only the stats.json flushed by this process
+                continue
+            self._mark(novel_folder)
+
+    # endregion
+
+    # region Watches
+
+    def _watch(self, kind: str, folder: Path):
+        mask = FILE_EVENTS if kind == "source" else FOLDER_EVENTS | FILE_EVENTS
+        wd = self._inotify.add_watch(folder, mask)
+        self._watches[wd] = (kind, folder)
+
+    def _watch_novel(self, novel_folder: Path):
+        try:
+            self._watch("novel", novel_folder)
+            for source_folder in novel_folder.iterdir():
+                if source_folder.is_dir():
+                    self._watch("source", source_folder)
+        except (FileNotFoundError, NotADirectoryError):
+            # Removed meanwhile, its deletion is an event too
+            pass
+
+    def _rescan(self):
+        """Events were lost : watch the folders created meanwhile and compare every novel"""
+        for novel_folder in self._novel_folders():
+            # A folder already watched keeps the same watch descriptor
+            self._watch_novel(novel_folder)
+        self._diff()
+
+    def _start_inotify(self) -> bool:
+        try:
+            self._inotify = Inotify()
+            self._watch("library", self.library_folder)
+            for novel_folder in self._novel_folders():
+                self._watch_novel(novel_folder)
+        except OSError as e:
+            # ex : not Linux, or fs.inotify.max_user_watches reached
+            print(f"Library watcher : inotify unavailable ({e}), polling every {self.poll_interval}s")
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            self._watches.clear()
+            return False
+        return True
+
+    def _handle(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self._rescan()
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        if wd not in self._watches:
+            return
+        kind, folder = self._watches[wd]
+        path = folder / name
+
+        if kind == "library":
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_novel(path)
+            self._mark(path)
+        elif kind == "novel":
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self._watch("source", path)
+                    except (FileNotFoundError, NotADirectoryError):
+                        pass
+                self._mark(folder)
+            elif name == "stats.json" and not self.is_own_write(path):
+                self._mark(folder)
+        elif name == "meta.json":
+            self._mark(folder.parent)
+
+    # endregion
+
+    # region Reload
+
+    def _mark(self, novel_folder: Path):
+        self._pending[novel_folder] = time.monotonic()
+
+    def _reload_pending(self):
+        """Read again the novels without change for debounce seconds"""
+        now = time.monotonic()
+        ready = [folder for folder, changed in self._pending.items() if now - changed >= self.debounce]
+        for novel_folder in ready:
+            del self._pending[novel_folder]
+            try:
+                if self.is_busy(novel_folder):
+                    continue
+                # Before reading it : a change made during the reload is seen by the next scan
+                self._signatures[novel_folder] = self._signature(novel_folder)
+                has_sources = novel_folder.is_dir() and any(
+                    (source_folder / "meta.json").exists() for source_folder in novel_folder.iterdir()
+                )
+                if has_sources:
+                    self.on_change(novel_folder)
+                    self.reloaded += 1
+                else:
+                    self._signatures.pop(novel_folder, None)
+                    self.on_remove(novel_folder)
+                    self.removed += 1
+            except Exception as e:
+                print(f"Error while reloading {novel_folder.name}: {e}")
+
+    def run(self):
+        self.mode = "inotify" if self._start_inotify() else "polling"
+        # Compared by the polling, and by the rescan after lost inotify events
+        for novel_folder in self._novel_folders():
+            self._signatures[novel_folder] = self._signature(novel_folder)
+        print(f"Library watcher : {self.mode}")
+
+        last_poll = time.monotonic()
+        while True:
+            timeout = self.debounce if self._pending else None
+            try:
+                if self.mode == "inotify":
+                    for wd, mask, name in self._inotify.read(timeout):
+                        try:
+                            self._handle(wd, mask, name)
+                        except Exception as e:
+                            # The other events of the batch are still handled
+                            print(f"Error in the library watcher: {e}")
+                else:
+                    time.sleep(min(timeout or self.poll_interval, self.poll_interval))
+                    if time.monotonic() - last_poll >= self.poll_interval:
+                        last_poll = time.monotonic()
+                        self._diff()
+                self._reload_pending()
+            except Exception as e:
+                print(f"Error in the library watcher: {e}")
+                time.sleep(1)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "watches": len(self._watches),
+            "pending": len(self._pending),
+            "reloaded": self.reloaded,
+            "removed": self.removed,
+        }
+
+    # endregion
@@ -0,0 +1,156 @@
+"""
+Load the whole library from disk.
+
+Decoding meta.json is CPU bound, so the sources missing from the catalog
+snapshot are decoded by a pool of processes that send back compact SourceInfo
+structs. The parent then builds the Novel objects from the (now complete)
+catalog and fills the database in a single pass.
+"""
+from __future__ import annotations
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .Novel import Novel
+from .catalog import Catalog, SourceInfo
+from . import database
+from . import read_novel_info
+from . import utils
+
+# Under this number of sources to decode, starting the workers costs more than it saves
+MIN_PARALLEL_SOURCES = 64
+
+
+class Progress:
+    """Progress printed every interval seconds, with throughput and ETA"""
+
+    def __init__(self, label: str, total: int, interval: float = 5):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.started = time.time()
+        self._last_print = 0.0
+
+    def update(self, done: int):
+        now = time.time()
+        if now - self._last_print < self.interval:
+            return
+        self._last_print = now
+
+        elapsed = now - self.started
+        rate = done / elapsed if elapsed else 0
+        eta = (self.total - done) / rate if rate else 0
+        print(f"{self.label} {done}/{self.total} ({rate:.0f}/s, ETA {eta:.0f}s)")
+
+    def finish(self):
+        elapsed = time.time() - self.started
+        rate = self.total / elapsed if elapsed else 0
+        print(f"{self.label} {self.total}/{self.total} in {elapsed:.1f}s ({rate:.0f}/s)")
+
+
+def _decode_source(source_folder: str) -> Tuple[str, Optional[SourceInfo]]:
+    """Worker : decode one meta.json. Errors are reported later by the parent."""
+    try:
+        return source_folder, read_novel_info.read_source_info(Path(source_folder))
+    except Exception:
+        return source_folder, None
+
+
+def get_pool_context():
+    """
+    Workers must be forked : with spawn, each worker would import the flask_api
+    package again, and with it the whole startup in lib.py.
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def decode_sources(source_folders: List[Path], catalog: Catalog, processes: Optional[int] = None):
+    """Decode the meta.json of the given sources and store them in the catalog"""
+    if not source_folders:
+        return
+
+    progress = Progress("Decoded", len(source_folders))
+    context = get_pool_context()
+    processes = processes or os.cpu_count() or 1
+
+    if context is None or processes < 2 or len(source_folders) < MIN_PARALLEL_SOURCES:
+        results = map(_decode_source, map(str, source_folders))
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+        chunksize = max(1, min(64, len(source_folders) // (processes * 8)))
+        results = executor.map(_decode_source, map(str, source_folders), chunksize=chunksize)
+
+    try:
+        for done, (source_folder, info) in enumerate(results, start=1):
+            if info:
+                catalog.store(Path(source_folder), info)
+            progress.update(done)
+    finally:
+        if executor:
+            executor.shutdown()
+    progress.finish()
+
+
+def load_novels(library_folder: Path, catalog: Catalog, processes: Optional[int] = None) -> List[Novel]:
+    """
+    Read every novel of the library.
+    Only the sources that changed since the last snapshot are decoded.
+    """
+    novel_folders = [folder for folder in library_folder.iterdir() if folder.is_dir()]
+
+    to_decode = []
+    from_snapshot = 0
+    for novel_folder in novel_folders:
+        for source_folder in novel_folder.iterdir():
+            if not source_folder.is_dir() or not (source_folder / "meta.json").exists():
+                continue
+            if catalog.lookup(source_folder):
+                from_snapshot += 1
+            else:
+                to_decode.append(source_folder)
+
+    print(f"Catalog : {from_snapshot} sources from snapshot, {len(to_decode)} to read from meta.json")
+    decode_sources(to_decode, catalog, processes)
+
+    novels = []
+    progress = Progress("Loaded", len(novel_folders))
+    for i, novel_folder in enumerate(novel_folders, start=1):
+        try:
+            novels.append(read_novel_info.get_novel_info(novel_folder, catalog))
+        except Exception as e:
+            print(f"Error while reading novel info from {novel_folder.name}: {e}")
+        progress.update(i)
+    progress.finish()
+
+    return novels
+
+
+def fill_database(novels: List[Novel]):
+    """Replace the database content, ranks, tags, sources and lookup maps are rebuilt in one pass"""
+    novels.sort(key=lambda x: sum(x.clicks.values()), reverse=True)
+    database.all_novels = novels
+    database.all_sources = []
+    database.all_tags.clear()
+    database.novels_by_slug.clear()
+    database.sources_by_slugs.clear()
+    database.sources_by_path.clear()
+
+    for rank, novel in enumerate(novels, start=1):
+        novel.rank = rank
+        database.index_novel(novel)
+        for tag in novel.tags:
+            utils.add_tag(tag)
+        database.all_sources.extend(novel.sources)
+    database.index_positions()
+
+    database.search_index.rebuild(novels)
+    database.novel_tag_index.rebuild((novel, novel.tags) for novel in novels)
+    database.source_tag_index.rebuild(
+        (source, source.novel.tags) for source in database.all_sources if database.in_source_orders(source)
+    )
@@ -0,0 +1,111 @@
+"""
+Ratings of a novel : count and sum for the average, plus the rating of each user.
+
+Users are the sha256 hex digests of utils.shuffle_ip. Instead of a dict of
+64-character strings, their ratings are packed in a single bytearray of sorted
+33-byte records (32-byte digest + rating) : no Python object per user, found by
+binary search. Other keys (ex : imported ratings) are kept in a small dict.
+"""
+from __future__ import annotations
+from typing import Dict, Iterator, Optional, Tuple
+
+KEY_SIZE = 32
+RECORD_SIZE = KEY_SIZE + 1
+
+
+def _digest(user: str) -> Optional[bytes]:
+    """32 bytes of a lowercase sha256 hex digest, None for other keys"""
+    if len(user) != KEY_SIZE * 2:
+        return None
+    try:
+        digest = bytes.fromhex(user)
+    except ValueError:
+        return None
+    # Written back with .hex() : only lowercase keys round-trip
+    return digest if digest.hex() == user else None
+
+
+class Ratings:
+    __slots__ = ("count", "total", "_packed", "_other")
+
+    def __init__(self, ratings: Optional[Dict[str, int]] = None):
+        self.count = 0
+        self.total = 0
+        self._packed: Optional[bytearray] = None
+        self._other: Optional[Dict[str, int]] = None
+        for user, rating in (ratings or {}).items():
+            self.set(user, rating)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __repr__(self) -> str:
+        return f"Ratings(count={self.count}, average={self.average:.2f})"
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0
+
+    def _find(self, digest: bytes) -> Tuple[int, bool]:
+        """Index of the record of digest, or where to insert it"""
+        packed = self._packed
+        low, high = 0, len(packed) // RECORD_SIZE
+        while low < high:
+            middle = (low + high) // 2
+            start = middle * RECORD_SIZE
+            key = packed[start : start + KEY_SIZE]
+            if key < digest:
+                low = middle + 1
+            elif key > digest:
+                high = middle
+            else:
+                return middle, True
+        return low, False
+
+    def get(self, user: Optional[str]) -> Optional[int]:
+        if not user:
+            return None
+        digest = _digest(user)
+        if digest is None:
+            return self._other.get(user) if self._other else None
+        if not self._packed:
+            return None
+        index, found = self._find(digest)
+        return self._packed[index * RECORD_SIZE + KEY_SIZE] if found else None
+
+    def set(self, user: str, rating: int):
+        """Add or replace the rating of user, from 0 to 255"""
+        old = None
+        digest = _digest(user)
+        if digest is None:
+            if self._other is None:
+                self._other = {}
+            old = self._other.get(user)
+            self._other[user] = rating
+        else:
+            if self._packed is None:
+                self._packed = bytearray()
+            index, found = self._find(digest)
+            position = index * RECORD_SIZE + KEY_SIZE
+            if found:
+                old = self._packed[position]
+                self._packed[position] = rating
+            else:
+                self._packed[index * RECORD_SIZE : index * RECORD_SIZE] = digest + bytes((rating,))
+        if old is None:
+            self.count += 1
+        else:
+            self.total -= old
+        self.total += rating
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        if self._packed:
+            view = memoryview(self._packed)
+            for start in range(0, len(view), RECORD_SIZE):
+                yield view[start : start + KEY_SIZE].hex(), view[start + KEY_SIZE]
+        if self._other:
+            yield from self._other.items()
+
+    def to_dict(self) -> Dict[str, int]:
+        """As stored in stats.json"""
+        return dict(self.items())
@@ -1,10 +1,14 @@
 import json
+import sys
 from .Novel import Novel, NovelFromSource
+from .ratings import Ratings
 from pathlib import Path
 import shutil
 from . import meta_structure
 from msgspec.json import decode
 from msgspec import ValidationError
+from typing import Optional
+from .catalog import Catalog, SourceInfo
 
 code_to_lang = {
     "ar": "Arabic",
@@ -20,12 +24,13 @@ code_to_lang = {
 }
 
 
-def get_novel_info(novel_folder: Path) -> Novel:
+def get_novel_info(novel_folder: Path, catalog: Optional[Catalog] = None) -> Novel:
     """
     Collects information about a novel locally.
     source isn't specified, so we need to find a source that has sufficient
         metadata for the novel and set it to prefered_source.
     Metadata are randomly picked from the sources.
+    If a catalog is given, unchanged sources are read from the snapshot instead of meta.json.
     """
 
     # region Get Novel Stats
@@ -43,6 +48,7 @@ def get_novel_info(novel_folder: Path) -> Novel:
                 ratings = novel_stats["ratings"] if "ratings" in novel_stats else {}
                 comment_count = novel_stats["comment_count"] 
                 source_ratings = novel_stats["source_ratings"]
+                stats_seq = novel_stats.get("journal_seq", 0)
 
         except Exception as e:
             print(f"Resetting novel stats for {novel_folder.name}: {e}")
@@ -65,7 +71,7 @@ def get_novel_info(novel_folder: Path) -> Novel:
         if not source_folder.is_dir():
             continue
 
-        source = _get_source_info(source_folder)
+        source = _get_source_info(source_folder, catalog)
         if not source:
             continue
 
@@ -84,7 +90,7 @@ def get_novel_info(novel_folder: Path) -> Novel:
 
         sources.append(source)
 
-    language:str = ", ".join(language)
+    language:str = sys.intern(", ".join(sorted(language)))
 
     # endregion
 
@@ -146,8 +152,9 @@ def get_novel_info(novel_folder: Path) -> Novel:
         rank=None,
         prefered_source=prefered_source,
         sources=sources,
-        ratings=ratings,
+        ratings=Ratings(ratings),
         comment_count=comment_count,
+        stats_seq=stats_seq,
     )
 
     # endregion
@@ -158,10 +165,11 @@ def get_novel_info(novel_folder: Path) -> Novel:
     return novel
 
 
-def _get_source_info(source_folder: Path) -> NovelFromSource:
+def _get_source_info(source_folder: Path, catalog: Optional[Catalog] = None) -> NovelFromSource:
     """
     Collects information about a novel for a source.
     Source is specified, so we can just read the meta.json file...
+    If a catalog is given, meta.json is only read when it changed since the last snapshot.
     """
     path = source_folder.absolute()
 
@@ -170,56 +178,91 @@ def _get_source_info(source_folder: Path) -> NovelFromSource:
         if (source_folder / "cover.jpg").exists()
         else None
     )
-    if not (source_folder / "meta.json").exists():
+
+    info = catalog.lookup(source_folder) if catalog else None
+    if not info:
+        info = read_source_info(source_folder)
+        if not info:
+            return None
+        if catalog:
+            catalog.store(source_folder, info)
+
+    return NovelFromSource(
+        path=path,
+        title=info.title,
+        cover=cover,
+        author=info.author,
+        chapter_count=info.chapter_count,
+        volume_count=info.volume_count,
+        first=info.first,
+        latest=info.latest,
+        summary=info.summary,
+        # Shared by many novels : one string each
+        tags=[sys.intern(tag) for tag in info.tags],
+        # Old meta.json can have no language, kept as None like before
+        language=sys.intern(info.language) if info.language is not None else None,
+        url=info.url,
+        last_update_date=info.last_update_date,
+    )
+
+
+def read_source_info(source_folder: Path) -> Optional[SourceInfo]:
+    """
+    Decode the meta.json of a source into a compact SourceInfo.
+    Returns None if the source has no meta.json
+    """
+    meta_file = source_folder / "meta.json"
+    try:
+        stat = meta_file.stat()
+    except FileNotFoundError:
         return None
 
+    with open(meta_file, "rb") as f:
+        raw = f.read()
+
     try:
-        with open(source_folder / "meta.json", "rb") as f:
-
-            data = decode(f.read(), type=meta_structure.Meta)
-            novel_metadata = data.novel
-
-            tags = novel_metadata.novel_tags or novel_metadata.tags or []
-            if novel_metadata.language in code_to_lang:
-                tags.append(code_to_lang[novel_metadata.language])
-
-            source = NovelFromSource(
-                path=path,
-                title=novel_metadata.title,
-                cover=cover,
-                author=", ".join(novel_metadata.authors),
-                chapter_count=len(novel_metadata.chapters),
-                volume_count=len(novel_metadata.volumes),
-                first=(
-                    novel_metadata.chapters[0].title if novel_metadata.chapters else ""
-                ),
-                latest=(
-                    novel_metadata.chapters[-1].title if novel_metadata.chapters else ""
-                ),
-                summary=novel_metadata.synopsis or novel_metadata.summary or "",
-                tags=tags,
-                language=novel_metadata.language,
-                url=novel_metadata.url,
-                last_update_date=data.last_update_date,
-            )
+        data = decode(raw, type=meta_structure.Meta)
+        novel_metadata = data.novel
+
+        tags = novel_metadata.novel_tags or novel_metadata.tags or []
+        if novel_metadata.language in code_to_lang:
+            tags.append(code_to_lang[novel_metadata.language])
+
+        return SourceInfo(
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            title=novel_metadata.title,
+            author=", ".join(novel_metadata.authors),
+            chapter_count=len(novel_metadata.chapters),
+            volume_count=len(novel_metadata.volumes),
+            first=(
+                novel_metadata.chapters[0].title if novel_metadata.chapters else ""
+            ),
+            latest=(
+                novel_metadata.chapters[-1].title if novel_metadata.chapters else ""
+            ),
+            summary=novel_metadata.synopsis or novel_metadata.summary or "",
+            tags=tags,
+            language=novel_metadata.language,
+            url=novel_metadata.url,
+            last_update_date=data.last_update_date,
+        )
 
     except ValidationError:
-        with open(source_folder / "meta.json", "rb") as f:
-            data = decode(f.read(), type=meta_structure.MetaOld)
-
-            source = NovelFromSource(
-                path=path,
-                title=data.title,
-                cover=cover,
-                author=data.author,
-                chapter_count=len(data.chapters),
-                volume_count=len(data.volumes),
-                first=(data.chapters[0].title if data.chapters else ""),
-                latest=(data.chapters[-1].title if data.chapters else ""),
-                summary=data.summary or "",
-                tags=[code_to_lang[data.language]] if data.language in code_to_lang else [],
-                language=data.language,
-                url=data.url,
-                last_update_date=data.last_update_date,
-            )
-    return source
+        data = decode(raw, type=meta_structure.MetaOld)
+
+        return SourceInfo(
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            title=data.title,
+            author=data.author,
+            chapter_count=len(data.chapters),
+            volume_count=len(data.volumes),
+            first=(data.chapters[0].title if data.chapters else ""),
+            latest=(data.chapters[-1].title if data.chapters else ""),
+            summary=data.summary or "",
+            tags=[code_to_lang[data.language]] if data.language in code_to_lang else [],
+            language=data.language,
+            url=data.url,
+            last_update_date=data.last_update_date,
+        )
@@ -0,0 +1,312 @@
+"""
+Scheduled refresh of the library : the sources are updated in the background,
+the most overdue first, instead of calling /addnovel/update from a cron.
+
+- A source is due `interval` seconds after its last check. The first check is
+  ordered by last_update_date (the stalest sources first), then the interval
+  follows the observed cadence of the source : it moves toward the time between
+  two updates that found new chapters, and grows when nothing new was found.
+- Round robin across the websites : each update is taken from the next website
+  having a due source, and a website is not updated again before host_delay
+  seconds, so no website gets a burst of requests.
+- Global budget : at most budget_per_hour updates per hour, evenly spaced.
+- The schedule is kept in a state file and resumed at the next start.
+- Dry run : the planned updates are printed and nothing is crawled.
+"""
+from __future__ import annotations
+import datetime
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+MIN_INTERVAL = 6 * 3600
+MAX_INTERVAL = 30 * 24 * 3600
+FIRST_INTERVAL = 24 * 3600  # after last_update_date, before any cadence was observed
+BACKOFF = 1.5  # interval multiplier when an update found nothing new
+SMOOTHING = 0.5  # weight of the last observed cadence
+SYNC_INTERVAL = 600  # seconds between two reads of the sources of the database
+PLAN_SIZE = 50  # updates printed in dry run
+STATS_PLAN_SIZE = 20  # updates shown by stats
+STATS_PLAN_TTL = 60  # seconds a plan is shown again by stats, each one scans the schedule count times
+
+
+def _key(source_folder: Path) -> str:
+    return str(source_folder.absolute())
+
+
+def _timestamp(isodate: str) -> float:
+    """last_update_date (utc isoformat) as a timestamp, 0 if unknown"""
+    try:
+        date = datetime.datetime.fromisoformat(isodate)
+    except (TypeError, ValueError):
+        return 0
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+def _clamp(interval: float) -> float:
+    return min(MAX_INTERVAL, max(MIN_INTERVAL, interval))
+
+
+class RefreshScheduler:
+    def __init__(
+        self,
+        state_file: Path,
+        sources: Callable[[], Iterable],
+        update: Callable[[str, Callable[[Optional[int]], None]], bool],
+        budget_per_hour: float = 30,
+        host_delay: float = 600,
+        dry_run: bool = False,
+    ):
+        """
+        sources : the sources of the library (NovelFromSource)
+        update : update(url, on_done) starts the update of a source, False if it could not start.
+            on_done(number of chapters downloaded) is called when it ends, on_done(None) if it failed.
+        """
+        self.state_file = state_file
+        self.sources = sources
+        self.update = update
+        self.budget_per_hour = max(1e-3, budget_per_hour)
+        self.host_delay = host_delay
+        self.dry_run = dry_run
+
+        # source folder : {url, host, checked, changed, interval}
+        self._entries: Dict[str, dict] = self._load_state()
+        self._host_last: Dict[str, float] = {}  # host : time of its last update
+        self._hosts = deque()  # round robin order
+        self._next_slot = 0.0
+        self._last_sync = 0.0
+        self._lock = threading.Lock()
+        self._started = False
+        self._stats_plan: Tuple[float, List[Tuple[float, str, str]]] = (float("-inf"), [])  # (computed at, plan)
+        self.started_updates = 0
+        self.found_new = 0
+        self.failed = 0
+        self.skipped = 0
+
+    # region State
+
+    def _load_state(self) -> Dict[str, dict]:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                return json.load(f).get("sources", {})
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self):
+        """Called with the lock held"""
+        if self.dry_run:
+            return
+        tmp_file = self.state_file.with_name(self.state_file.name + ".tmp")
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"sources": self._entries}, f)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            print(f"Error while saving the refresh schedule: {e}")
+
+    def sync(self):
+        """Add the new sources of the library to the schedule, forget the deleted ones"""
+        seen = {}
+        for source in self.sources():
+            if not source.url:
+                continue
+            seen[_key(source.path)] = source
+        with self._lock:
+            for key in [key for key in self._entries if key not in seen]:
+                del self._entries[key]
+            for key, source in seen.items():
+                entry = self._entries.get(key)
+                host = urlparse(source.url).netloc
+                if entry is None:
+                    checked = _timestamp(source.last_update_date)
+                    self._entries[key] = {
+                        "url": source.url,
+                        "host": host,
+                        "checked": checked,
+                        "changed": checked,
+                        "interval": FIRST_INTERVAL,
+                    }
+                else:
+                    entry["url"] = source.url
+                    entry["host"] = host
+            hosts = {entry["host"] for entry in self._entries.values()}
+            self._hosts = deque([host for host in self._hosts if host in hosts] + sorted(hosts - set(self._hosts)))
+            self._save_state()
+        self._last_sync = time.time()
+
+    # endregion
+
+    # region Plan
+
+    def _pick(self, now: float, host_last: Dict[str, float], hosts: deque, exclude=()) -> Optional[str]:
+        """
+        Most overdue source of the next website in the round robin having one, None if nothing is due.
+        Called with the lock held.
+        """
+        overdue: Dict[str, Tuple[float, str]] = {}
+        for key, entry in self._entries.items():
+            due = entry["checked"] + entry["interval"]
+            if due > now or key in exclude:
+                continue
+            host = entry["host"]
+            if now - host_last.get(host, float("-inf")) < self.host_delay:
+                continue
+            if host not in overdue or due < overdue[host][0]:
+                overdue[host] = (due, key)
+
+        for host in overdue:
+            if host not in hosts:
+                hosts.append(host)
+        for _ in range(len(hosts)):
+            host = hosts[0]
+            hosts.rotate(-1)
+            if host in overdue:
+                return overdue[host][1]
+        return None
+
+    def _next_due(self, now: float, host_last: Dict[str, float], exclude=()) -> Optional[float]:
+        """When the next source can be picked, called with the lock held"""
+        times = [
+            max(entry["checked"] + entry["interval"], host_last.get(entry["host"], float("-inf")) + self.host_delay)
+            for key, entry in self._entries.items()
+            if key not in exclude
+        ]
+        return max(now, min(times)) if times else None
+
+    def plan(self, count: int = PLAN_SIZE) -> List[Tuple[float, str, str]]:
+        """The next count updates : (time, host, url), assuming nothing changes meanwhile"""
+        with self._lock:
+            host_last = dict(self._host_last)
+            hosts = deque(self._hosts)
+            slot = max(time.time(), self._next_slot)
+            planned = []
+            picked = set()
+            while len(planned) < count:
+                key = self._pick(slot, host_last, hosts, picked)
+                if key is None:
+                    next_due = self._next_due(slot, host_last, picked)
+                    if next_due is None:
+                        break
+                    slot = max(slot + 1, next_due)
+                    continue
+                entry = self._entries[key]
+                planned.append((slot, entry["host"], entry["url"]))
+                picked.add(key)
+                host_last[entry["host"]] = slot
+                slot += 3600 / self.budget_per_hour
+        return planned
+
+    def print_plan(self, count: int = PLAN_SIZE):
+        planned = self.plan(count)
+        print(f"Refresh schedule : {len(self._entries)} sources, next {len(planned)} updates")
+        for at, host, url in planned:
+            print(f"    {datetime.datetime.fromtimestamp(at):%Y-%m-%d %H:%M}  {host:<30} {url}")
+
+    # endregion
+
+    # region Updates
+
+    def _done(self, key: str, started: float, new_chapters: Optional[int]):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if new_chapters is None:
+                self.failed += 1
+            elif new_chapters > 0:
+                self.found_new += 1
+                if entry["changed"]:
+                    observed = started - entry["changed"]
+                    entry["interval"] = _clamp(SMOOTHING * observed + (1 - SMOOTHING) * entry["interval"])
+                entry["changed"] = started
+            else:
+                entry["interval"] = _clamp(entry["interval"] * BACKOFF)
+            self._save_state()
+
+    def _step(self) -> float:
+        """Start the next update if one is due, returns the seconds to wait before the next step"""
+        now = time.time()
+        if now - self._last_sync > SYNC_INTERVAL:
+            self.sync()
+        if now < self._next_slot:
+            return self._next_slot - now
+
+        with self._lock:
+            key = self._pick(now, self._host_last, self._hosts)
+            if key is None:
+                next_due = self._next_due(now, self._host_last)
+                return min(SYNC_INTERVAL, max(1, next_due - now) if next_due is not None else SYNC_INTERVAL)
+            entry = self._entries[key]
+            url = entry["url"]
+            previous = entry["checked"]
+            entry["checked"] = now
+            self._host_last[entry["host"]] = now
+            self._next_slot = now + 3600 / self.budget_per_hour
+            self._save_state()
+
+        if self.dry_run:
+            print(f"Refresh (dry run) : {url}")
+            return 0
+        if self.update(url, lambda new_chapters: self._done(key, now, new_chapters)):
+            self.started_updates += 1
+        else:
+            # Queue full or already being downloaded : due again, after the next slot
+            self.skipped += 1
+            with self._lock:
+                entry["checked"] = previous
+        return 0
+
+    def run(self):
+        self.sync()
+        if self.dry_run:
+            self.print_plan()
+        while True:
+            try:
+                delay = self._step()
+            except Exception as e:
+                print(f"Error in the refresh scheduler: {e}")
+                delay = 60
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            threading.Thread(target=self.run, name="refresh-scheduler", daemon=True).start()
+
+    # endregion
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.time()
+            due = sum(1 for entry in self._entries.values() if entry["checked"] + entry["interval"] <= now)
+            sources = len(self._entries)
+        return {
+            "sources": sources,
+            "due": due,
+            "hosts": len(self._hosts),
+            "budget_per_hour": self.budget_per_hour,
+            "dry_run": self.dry_run,
+            "started_updates": self.started_updates,
+            "found_new": self.found_new,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "next": [
+                {"date": datetime.datetime.fromtimestamp(at).isoformat(), "host": host, "url": url}
+                for at, host, url in self._cached_plan()
+            ],
+        }
+
+    def _cached_plan(self) -> List[Tuple[float, str, str]]:
+        computed_at, planned = self._stats_plan
+        if time.monotonic() - computed_at >= STATS_PLAN_TTL:
+            planned = self.plan(STATS_PLAN_SIZE)
+            self._stats_plan = (time.monotonic(), planned)
+        return planned
@@ -0,0 +1,132 @@
+"""
+Cache of the responses of the catalog endpoints (/api/novels, /api/sources, /api/novel...).
+
+A response is built once per (endpoint, parameters, catalog version), encoded to
+json and compressed with gzip and brotli ahead of time. Cached responses get a
+strong ETag, a request sending it back in If-None-Match gets a 304.
+
+The catalog version is bumped when the catalog changes (a novel added or
+updated, a rating, a stats flush) : every cached response is dropped.
+Between two flushes, cached responses can show clicks a few seconds old.
+"""
+from __future__ import annotations
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+import msgspec
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "encoded", "size")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.encoded = {"gzip": gzip.compress(body, GZIP_LEVEL)}
+        if brotli is not None:
+            self.encoded["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+        self.size = len(body) + sum(len(data) for data in self.encoded.values())
+
+    def to_response(self) -> Response:
+        accepted = request.accept_encodings
+        encoding = next(
+            (e for e in ("br", "gzip") if e in self.encoded and accepted[e]), None
+        )
+        etag = f"{self.etag}:{encoding}" if encoding else self.etag
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(
+                self.encoded[encoding] if encoding else self.body,
+                mimetype="application/json",
+            )
+            if encoding:
+                # Flask-Compress leaves responses with a Content-Encoding alone
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.version = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def bump(self):
+        """The catalog changed : drop every cached response"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self.size = 0
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get((self.version, key))
+            if entry is not None:
+                self._entries.move_to_end((self.version, key))
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def put(self, key: Hashable, entry: CachedResponse, version: int):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if version != self.version:
+                # Built from the catalog before the bump
+                return
+            old = self._entries.pop((version, key), None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[(version, key)] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def respond(self, key: Hashable, build: Callable[[], dict]) -> Response:
+        """
+        Cached response for key, build() gives the content on a miss.
+        The key must hold everything the content depends on (endpoint, parameters, user...)
+        """
+        entry = self.get(key)
+        if entry is None:
+            version = self.version
+            entry = CachedResponse(msgspec.json.encode(build()))
+            self.put(key, entry, version)
+        return entry.to_response()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "size": self.size,
+                "max_size": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -4,18 +4,29 @@ from . import flaskapp
 from . import database
 from . import utils
 import math
+import functools
 from urllib.parse import unquote_plus
-import json
-from typing import List
 from .Novel import Novel
-import difflib
 from . import sanatize
 import os
+from pathlib import Path
 from . import naming_rules
+from . import tag_index
+from . import chapter_cache
+from . import chapter_list
+from ....core import novel_search
 
 @flaskapp.app.route("/api/image/<path:file>")
 @flaskapp.app.route("/image/<path:file>")
 def image(file: str):
+    # Thumbnails : best format accepted by the client, from the variant map
+    accepted = [mimetype for mimetype, quality in request.accept_mimetypes if quality]
+    variant = database.thumbnails.choose(file, accepted)
+    if variant:
+        response = send_from_directory(lib.LIGHTNOVEL_FOLDER, variant[0], mimetype=variant[1])
+        response.vary.add("Accept")
+        return response, 200
+
     path = os.path.join(lib.LIGHTNOVEL_FOLDER, file)
 
     if not os.path.realpath(path).startswith(os.path.realpath(lib.LIGHTNOVEL_FOLDER)):
@@ -26,30 +37,27 @@ def image(file: str):
     else :
         temp = file.split("/") 
         alt_file = naming_rules.clean_name(temp[0]) + "/" + "/".join(temp[1:])
+        variant = database.thumbnails.choose(alt_file, accepted)
+        if variant:
+            response = send_from_directory(lib.LIGHTNOVEL_FOLDER, variant[0], mimetype=variant[1])
+            response.vary.add("Accept")
+            return response, 200
+
         alt_path = os.path.join(
             lib.LIGHTNOVEL_FOLDER, 
             alt_file
         )
         if os.path.exists(alt_path):
             return send_from_directory(lib.LIGHTNOVEL_FOLDER, alt_file), 200
-        
-        else :
-            if (
-                file.endswith("/cover.min.jpg") and 
-                os.path.exists(path.replace("/cover.min.jpg", "/cover.jpg"))
-            ):
-                utils.create_miniature(path.replace("/cover.min.jpg", "/cover.jpg"), path, 200)
-            
-            elif (
-                file.endswith("/cover.sm.jpg") and 
-                os.path.exists(path.replace("/cover.sm.jpg", "/cover.jpg"))
-            ):
-                utils.create_miniature(path.replace("/cover.sm.jpg", "/cover.jpg"), path, 500)
-            
-            else :
-                return send_from_directory("static/assets",  "404.svg"), 200
-    
-        return send_from_directory(lib.LIGHTNOVEL_FOLDER, file), 200
+
+        # Thumbnail not made yet : the full cover is sent meanwhile
+        for thumbnail in ("/cover.min.jpg", "/cover.sm.jpg"):
+            cover = path.replace(thumbnail, "/cover.jpg")
+            if file.endswith(thumbnail) and os.path.exists(cover):
+                database.thumbnails.submit(Path(cover))
+                return send_from_directory(lib.LIGHTNOVEL_FOLDER, file.replace(thumbnail, "/cover.jpg")), 200
+
+        return send_from_directory("static/assets",  "404.svg"), 200
 
     
 
@@ -86,7 +94,7 @@ def get_novels():
     
     tags = request.args.get("tags")
     if tags:
-        tags = [("-" if t.startswith("-") else "") + sanatize.sanitize(t) for t in tags.split(",")]
+        tags = tag_index.parse_tags(tags)
 
     page = int(page)
     number = int(number)
@@ -94,34 +102,33 @@ def get_novels():
     start = page * number
     stop = (page + 1) * number
 
-    novels = []
-    total_pages = 0
+    if sort not in database.sorted_all_novels:
+        return "Invalid sort", 400
 
-    try :
+    def build():
         if not tags:
-            novels = database.sorted_all_novels[sort]()[start:stop]
-            total_pages = math.ceil(len(database.all_novels) / number)
+            order = database.sorted_all_novels[sort]()
+            novels = order[start:stop]
+            total_pages = math.ceil(len(order) / number)
 
         else:
-            filtered_novels:List[Novel] = [novel for novel in database.sorted_all_novels[sort]() if utils.has_tags(novel, tags)]
-            novels = filtered_novels[start:stop]
-            total_pages = math.ceil(len(filtered_novels) / number) 
-
-    except KeyError:
-        return "Invalid sort", 400
-
-    
-
-    return {
-        "content": {
-                (page * number + 1 + i): e.asdict()
-                for i, e in enumerate(novels)
-        },
-        "metadata": {
-            "total_pages": total_pages,
-            "current_page": page,
-        },
-    }, 200
+            novels, total = database.novel_tag_index.page(tags, database.sorted_all_novels[sort](), start, stop)
+            total_pages = math.ceil(total / number)
+
+        return {
+            "content": {
+                    (page * number + 1 + i): e.asdict()
+                    for i, e in enumerate(novels)
+            },
+            "metadata": {
+                "total_pages": total_pages,
+                "current_page": page,
+            },
+        }
+
+    return database.response_cache.respond(
+        ("novels", page, number, sort, tuple(tags) if tags else None), build
+    )
 
 
 
@@ -149,7 +156,7 @@ def get_sources():
     
     tags = request.args.get("tags")
     if tags:
-        tags = [sanatize.sanitize(t) for t in tags.split(",")]
+        tags = tag_index.parse_tags(tags)
 
     page = int(page)
     number = int(number)
@@ -157,36 +164,33 @@ def get_sources():
     start = page * number
     stop = (page + 1) * number
 
-    sources = []
-    total_pages = 0
+    if sort not in database.sorted_all_sources:
+        return "Invalid sort", 400
 
-    try :
+    def build():
         if not tags:
-            sources = database.sorted_all_sources[sort]()[start:stop]
-            total_pages = math.ceil(len(database.all_sources) / number)
+            order = database.sorted_all_sources[sort]()
+            sources = order[start:stop]
+            total_pages = math.ceil(len(order) / number)
 
         else:
-            filtered_sources = [source for source in database.all_sources if utils.has_tags(source.novel, tags)]
-            sources = filtered_sources[start:stop]
-            total_pages = math.ceil(len(filtered_sources) / number) 
-
-    except KeyError:
-        return "Invalid sort", 400
-
-    
-
-    return {
-        "content": {
-                (page * number + 1 + i): e.asdict()
-                for i, e in enumerate(sources)
-        },
-        "metadata": {
-            "total_pages": total_pages,
-            "current_page": page,
-        },
-    }, 200
-
-from . import datetools
+            sources, total = database.source_tag_index.page(tags, database.sorted_all_sources[sort](), start, stop)
+            total_pages = math.ceil(total / number)
+
+        return {
+            "content": {
+                    (page * number + 1 + i): e.asdict()
+                    for i, e in enumerate(sources)
+            },
+            "metadata": {
+                "total_pages": total_pages,
+                "current_page": page,
+            },
+        }
+
+    return database.response_cache.respond(
+        ("sources", page, number, sort, tuple(tags) if tags else None), build
+    )
 
 @flaskapp.app.route("/api/novel")
 @flaskapp.app.route("/novel")
@@ -203,13 +207,24 @@ def get_novel():
     if not source:
         return "", 404
 
-    current_week = datetools.current_week()
-    if current_week not in source.novel.clicks:
-        source.novel.clicks[current_week] = 0
+    database.add_click(source.novel)
 
-    source.novel.clicks[current_week] += 1
+    # Shared by every visitor : their own rating is given by /api/user_rating
+    return database.response_cache.respond(("novel", str(source.path)), source.asdict)
 
-    return source.asdict(user=utils.shuffle_ip(request.environ.get('HTTP_X_REAL_IP', request.remote_addr))), 200
+@flaskapp.app.route("/api/user_rating")
+@flaskapp.app.route("/user_rating")
+def get_user_rating():
+    """Rating given to the novel by the visitor, not cached"""
+    novel_slug = request.args.get("novel")
+    if not novel_slug:
+        return {"status": "error", "message": "Missing parameter"}, 400
+    novel = utils.get_novel_with_slug(novel_slug)
+    if not novel:
+        return {"status": "error", "message": "Unknown novel"}, 404
+
+    user = utils.shuffle_ip(request.environ.get('HTTP_X_REAL_IP', request.remote_addr))
+    return {"user_rating": novel.ratings.get(user)}, 200
 
 @flaskapp.app.route("/api/chapter/")
 @flaskapp.app.route("/chapter/")
@@ -225,25 +240,87 @@ def get_chapter():
     if not source:
         return "Unknown or unauthorized file", 404
 
-    chapter = utils.get_chapter(source, chapter_id)
+    # Serialized chapter, from the cache or loaded with utils.get_chapter
+    chapter = database.chapter_cache.get(source, chapter_id)
     if not chapter:
         return "Unknown or unauthorized file", 404
 
     is_next = source.chapter_count > chapter_id
     is_prev = chapter_id > 1
 
-    current_week = datetools.current_week()
-    if current_week not in source.novel.clicks:
-        source.novel.clicks[current_week] = 0
-
-    source.novel.clicks[current_week] += 1
-
-    return {
-        "content": chapter,
-        "is_next": is_next,
-        "is_prev": is_prev,
-        "source": source.asdict(),
-    }, 200
+    database.add_click(source.novel)
+
+    return flaskapp.app.response_class(
+        chapter_cache.chapter_response(
+            chapter,
+            is_next=is_next,
+            is_prev=is_prev,
+            source=source.asdict(),
+        ),
+        mimetype="application/json",
+    ), 200
+
+def diagnostics(route):
+    """Internal counters : only served with "diagnostics": "true" in config.json"""
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        if not lib.DIAGNOSTICS:
+            return "", 404
+        return route(*args, **kwargs)
+    return wrapper
+
+@flaskapp.app.route("/api/chapter_cache/")
+@diagnostics
+def get_chapter_cache_stats():
+    """Hits, misses and evictions of the chapter cache, to size it"""
+    return database.chapter_cache.stats(), 200
+
+@flaskapp.app.route("/api/response_cache/")
+@diagnostics
+def get_response_cache_stats():
+    return database.response_cache.stats(), 200
+
+@flaskapp.app.route("/api/compression/")
+@diagnostics
+def get_compression_stats():
+    """Progress of the background compression"""
+    return database.compression.stats(), 200
+
+@flaskapp.app.route("/api/jobs/")
+@diagnostics
+def get_job_scheduler_stats():
+    """Add-novel tasks running and waiting"""
+    return database.job_scheduler.stats(), 200
+
+@flaskapp.app.route("/api/job_events/")
+@diagnostics
+def get_job_events_stats():
+    """Progress streams open and statuses published"""
+    return database.job_events.stats(), 200
+
+@flaskapp.app.route("/api/job_snapshots/")
+@diagnostics
+def get_job_snapshots_stats():
+    """Search results kept to retry a failed download"""
+    return database.jobs_snapshots.stats(), 200
+
+@flaskapp.app.route("/api/search_cache/")
+@diagnostics
+def get_search_cache_stats():
+    """Search results kept per source and query"""
+    return novel_search.search_cache.stats(), 200
+
+@flaskapp.app.route("/api/library_watcher/")
+@diagnostics
+def get_library_watcher_stats():
+    """Novels reloaded from disk since the start"""
+    return lib.library_watcher.stats(), 200
+
+@flaskapp.app.route("/api/refresh_schedule/")
+@diagnostics
+def get_refresh_schedule():
+    """Sources due for an update and the next planned updates"""
+    return lib.refresh_scheduler.stats(), 200
 
 @flaskapp.app.route("/api/chapterlist/")
 @flaskapp.app.route("/chapterlist/")
@@ -265,34 +342,25 @@ def get_chapter_list():
     if not os.path.exists(meta_file) or not os.path.realpath(meta_file).startswith(os.path.realpath(lib.LIGHTNOVEL_FOLDER)):
         return "Unknown or unauthorized file", 404
 
-    current_week = datetools.current_week()
-    if current_week not in source.novel.clicks:
-        source.novel.clicks[current_week] = 0
-
-    source.novel.clicks[current_week] += 1
-
-    with open(meta_file, "r", encoding='utf-8') as f:
-        data = json.load(f)
-        # For backward compatibility
-        if "novel" in data:
-            chapter_list = data["novel"]["chapters"]
-        else:
-            chapter_list = data["chapters"]
+    database.add_click(source.novel)
 
-    start = page * 100
-    stop = min((page + 1) * 100, len(chapter_list) + 1)
+    # Only the requested page is read, from the pages written next to meta.json
+    content, chapter_count, page_size = chapter_list.read_page(source.path, page)
 
-    is_next = (page + 1) * 100 < len(chapter_list)
+    is_next = (page + 1) * page_size < chapter_count
     is_prev = page > 0
-    total_pages = math.ceil(len(chapter_list) / 100)
-
-    return {
-        "content": chapter_list[start:stop],
-        "source": source.asdict(),
-        "is_next": is_next,
-        "is_prev": is_prev,
-        "total_pages": total_pages,
-    }, 200
+    total_pages = math.ceil(chapter_count / page_size)
+
+    return flaskapp.app.response_class(
+        chapter_cache.chapter_response(
+            content,
+            source=source.asdict(),
+            is_next=is_next,
+            is_prev=is_prev,
+            total_pages=total_pages,
+        ),
+        mimetype="application/json",
+    ), 200
 
 @flaskapp.app.route("/api/search/")
 @flaskapp.app.route("/search/")
@@ -305,42 +373,10 @@ def search():
     if not query or len(query) < 3:
         return "Invalid query", 400
 
-    query = sanatize.sanitize(query).split(" ")
-    ratio: List[tuple[Novel, int]] = []
-
-    for novel in database.all_novels:
-        count = 0
-        for query_search_word in query:
-            similarity_found = False
-            # We check if each query word is in the novel keywords or similar to one of them
-            for downloaded_search_word in novel.search_words:
-                if difflib.SequenceMatcher(None, query_search_word, downloaded_search_word).ratio() > 0.75:
-                    # test similarity : slime and lime are similar
-                    similarity_found = True
-                    break
-                elif query_search_word in downloaded_search_word:
-                    # But if a word is long : awak and awakening are not similar
-                    # but awakening should be counted for awak so we check if the word is in the downloaded word
-                    similarity_found = True
-                    break
-
-                # Sadly long words not written completly with a small mistakae will not be counted
-                # like : aawaken and awakening
-            
-            # A word similar to a novel keyword is worth less than a word not in the novel
-            if similarity_found:
-                count += 1
-            else :
-                count -= 2
-        if count > 0:
-            ratio.append((novel, count))
-
-    ratio.sort(key=lambda x: x[1], reverse=True)
-
     number_of_results = min(20, len(database.all_novels))
 
     search_results = [
-        novel.asdict() for novel, ratio in ratio[:number_of_results] if ratio != 0
+        novel.asdict() for novel, _ in database.search_index.search(query, number_of_results)
     ]
 
     return {
@@ -366,7 +402,7 @@ def rate():
     novel = utils.get_novel_with_slug(novel_slug)
 
     ip = request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
-    novel.ratings[utils.shuffle_ip(ip)] = rating
+    database.rate_novel(novel, utils.shuffle_ip(ip), rating)
 
     print(f"Rating added for {novel_slug} : {rating} (from {ip})")
 
@@ -392,7 +428,8 @@ def rate_source():
     if not source:
         return {"status": "error", "message": "Unknown source"}, 404
 
-    source.source_rating += int(rating)
+    database.stats_store.rate_source(source, int(rating))
+    database.response_cache.bump()
 
     ip = request.environ.get('HTTP_X_REAL_IP', request.remote_addr)
     print(f"source {source_slug} rating added for {novel_slug} : {rating} (from {ip})")
@@ -402,7 +439,7 @@ def rate_source():
 @flaskapp.app.route("/api/toptags")
 @flaskapp.app.route("/toptags")
 def toptags():
-    return {"content": database.top_tags}, 200
+    return database.response_cache.respond(("toptags",), lambda: {"content": database.top_tags})
 
 @flaskapp.app.route("/api/searchtags")
 @flaskapp.app.route("/searchtags")
@@ -425,11 +462,20 @@ def searchtags():
 @flaskapp.app.route("/api/sitemap.xml")
 @flaskapp.app.route("/sitemap.xml")
 def sitemap():
-    response = make_response(send_file(lib.sitemap_file.absolute()), 200)
+    if not lib.sitemap_writer.index_file.exists():
+        return "Sitemap not generated yet", 503
+    response = make_response(send_file(lib.sitemap_writer.index_file.absolute()), 200)
     response.headers["Content-Type"] = "application/xml"
     response.charset = "utf-8"
     return response
 
+@flaskapp.app.route("/api/<string:file>.xml.gz")
+@flaskapp.app.route("/<string:file>.xml.gz")
+def sitemap_shard(file: str):
+    if not file.startswith("sitemap-"):
+        return "", 404
+    return send_from_directory(lib.sitemap_writer.folder.absolute(), file + ".xml.gz", mimetype="application/gzip")
+
 
 @flaskapp.app.route("/api/ebook")
 @flaskapp.app.route("/ebook")
@@ -511,5 +557,7 @@ import random
 def featured():
     """Return the featured source"""
     featured_novel : Novel = database.sorted_all_novels["rank"]()[random.randint(0, 2)] 
-    return featured_novel.prefered_source.asdict(), 200
+    return database.response_cache.respond(
+        ("featured", str(featured_novel.path)), featured_novel.prefered_source.asdict
+    )
     
\ No newline at end of file
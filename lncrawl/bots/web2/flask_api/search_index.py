@@ -0,0 +1,160 @@
+"""
+In memory index used by /api/search.
+
+The scoring is the same as the old loop over every novel :
+    for each query word, +1 if a word of the novel (title + author) is similar
+    (difflib ratio > 0.75) or contains the query word, -2 otherwise.
+
+But instead of comparing the query with the words of every novel, the query
+words are only compared with the vocabulary (each distinct word once),
+and only with the words sharing at least one bigram with it.
+Bigrams are padded with ^ and $ : two words with a ratio > 0.75 always share
+one of them, which is not the case of trigrams ("abcde" / "abxde").
+"""
+from __future__ import annotations
+import difflib
+import math
+import threading
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple
+
+from . import sanatize
+
+if TYPE_CHECKING:
+    from .Novel import Novel
+
+SIMILARITY_THRESHOLD = 0.75
+MAX_CACHED_QUERY_WORDS = 10000
+
+
+def _padded_bigrams(word: str) -> Set[str]:
+    padded = "^" + word + "$"
+    return {padded[i : i + 2] for i in range(len(padded) - 1)}
+
+
+def is_similar(query_word: str, word: str) -> bool:
+    """Same test as the old search : similar words, or query word contained in the word"""
+    if query_word in word:
+        return True
+    matcher = difflib.SequenceMatcher(None, query_word, word)
+    return (
+        matcher.real_quick_ratio() > SIMILARITY_THRESHOLD
+        and matcher.quick_ratio() > SIMILARITY_THRESHOLD
+        and matcher.ratio() > SIMILARITY_THRESHOLD
+    )
+
+
+def search_words(novel: Novel) -> List[str]:
+    return sanatize.sanitize(novel.title + " " + novel.author).split(" ")
+
+
+class SearchIndex:
+    def __init__(self):
+        self.novels: Dict[str, Novel] = {}  # str path : novel
+        self.novel_words: Dict[str, Set[str]] = {}  # str path : words
+        self.postings: Dict[str, Set[str]] = {}  # word : str paths
+        self.bigrams: Dict[str, Set[str]] = {}  # bigram : words
+        self._matches_cache: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.novels)
+
+    # region Update
+
+    def add(self, novel: Novel):
+        """Add or replace a novel"""
+        key = str(novel.path)
+        words = set(search_words(novel))
+        with self._lock:
+            self.remove(novel)
+            self.novels[key] = novel
+            self.novel_words[key] = words
+            for word in words:
+                if word not in self.postings:
+                    self.postings[word] = set()
+                    for bigram in _padded_bigrams(word):
+                        self.bigrams.setdefault(bigram, set()).add(word)
+                    # A new word can match the query words already in cache
+                    self._matches_cache.clear()
+                self.postings[word].add(key)
+
+    def remove(self, novel: Novel):
+        key = str(novel.path)
+        with self._lock:
+            if key not in self.novels:
+                return
+            del self.novels[key]
+            for word in self.novel_words.pop(key):
+                postings = self.postings[word]
+                postings.discard(key)
+                if not postings:
+                    del self.postings[word]
+                    for bigram in _padded_bigrams(word):
+                        self.bigrams[bigram].discard(word)
+                    self._matches_cache.clear()
+
+    def rebuild(self, novels: List[Novel]):
+        with self._lock:
+            self.novels.clear()
+            self.novel_words.clear()
+            self.postings.clear()
+            self.bigrams.clear()
+            self._matches_cache.clear()
+            for novel in novels:
+                self.add(novel)
+
+    # endregion
+
+    # region Search
+
+    def _matching_words(self, query_word: str) -> Set[str]:
+        """Words of the vocabulary similar to the query word"""
+        if query_word in self._matches_cache:
+            return self._matches_cache[query_word]
+
+        if len(query_word) < 2:
+            # Too short for a bigram, but can still be contained in a word
+            candidates = self.postings.keys()
+        else:
+            candidates = set()
+            for bigram in _padded_bigrams(query_word):
+                candidates.update(self.bigrams.get(bigram, ()))
+
+        matches = {word for word in candidates if is_similar(query_word, word)}
+
+        if len(self._matches_cache) >= MAX_CACHED_QUERY_WORDS:
+            self._matches_cache.clear()
+        self._matches_cache[query_word] = matches
+        return matches
+
+    def search(self, query: str, limit: int = 20) -> List[Tuple[Novel, int]]:
+        """
+        Return up to `limit` (novel, score) with a positive score, best first.
+        Ties are ordered by rank, like the old loop over database.all_novels.
+        """
+        query_words = Counter(sanatize.sanitize(query).split(" "))
+        misses_penalty = -2 * sum(query_words.values())
+
+        with self._lock:
+            # Score starts as if no word matched, each matched word gives back 1 + 2
+            found: Dict[str, int] = {}
+            for query_word, count in query_words.items():
+                matched_novels = set()
+                for word in self._matching_words(query_word):
+                    matched_novels.update(self.postings[word])
+                for key in matched_novels:
+                    found[key] = found.get(key, 0) + 3 * count
+
+            results = [
+                (self.novels[key], misses_penalty + score)
+                for key, score in found.items()
+                if misses_penalty + score > 0
+            ]
+
+        results.sort(
+            key=lambda x: (-x[1], x[0].rank if x[0].rank is not None else math.inf)
+        )
+        return results[:limit]
+
+    # endregion
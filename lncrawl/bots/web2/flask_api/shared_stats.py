@@ -0,0 +1,233 @@
+"""
+Stats shared by the API workers (see workers.py), in a SQLite database in WAL mode.
+
+The events (clicks, ratings, comments, source ratings) of every worker are
+inserted in the events table instead of the journal file : the rowid is the
+sequence number, the same for every worker. Each worker polls the events of the
+others every POLL_INTERVAL seconds and applies them to its novels.
+
+Only the owner writes the stats.json files. Events are deleted once they are in
+the stats.json files and every worker has applied them.
+
+The owner also publishes the source folders written by its downloads in the
+novels table : the other workers read them again.
+"""
+from __future__ import annotations
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Iterable, List, Optional
+
+from .stats_store import JournalEntry, StatsStore
+
+if TYPE_CHECKING:
+    from .Novel import Novel
+
+POLL_INTERVAL = 1  # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    worker INTEGER NOT NULL,
+    novel TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cursors (
+    worker INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS novels (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    folder TEXT NOT NULL
+);
+"""
+
+
+class SharedStatsStore(StatsStore):
+    def __init__(
+        self,
+        journal_file: Path,
+        db_file: Path,
+        worker_id: int,
+        workers: int,
+        **kwargs,
+    ):
+        super().__init__(journal_file, **kwargs)
+        self.worker_id = worker_id
+        self.is_owner = worker_id == 0
+        self._db = sqlite3.connect(db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._get_novel: Optional[Callable[[str], Optional[Novel]]] = None
+        self._changed = False  # events since the last flush
+        # Called with the novels changed by the events of the other workers
+        self.on_event: Optional[Callable[[Novel], None]] = None
+        # Called with the folder of the sources downloaded by the owner
+        self.on_novel: Optional[Callable[[Path], None]] = None
+
+        if self.is_owner:
+            # The workers start after the owner : all of them apply every event left
+            with self._db:
+                self._db.execute("DELETE FROM cursors")
+                self._db.executemany(
+                    "INSERT INTO cursors (worker, seq) VALUES (?, 0)",
+                    [(worker,) for worker in range(1, workers)],
+                )
+                self._db.execute("DELETE FROM novels")
+        self._novels_seen = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM novels").fetchone()[0]
+
+    # region Journal
+
+    def _append(self, novel: Novel, kind: str, key: str = "", value: int = 0):
+        self._db.execute(
+            "INSERT INTO events (worker, novel, kind, key, value) VALUES (?, ?, ?, ?, ?)",
+            (self.worker_id, novel.cleaned_folder_name, kind, key, value),
+        )
+        self._changed = True
+        if self.is_owner:
+            self._mark_dirty(novel)
+
+    def mark_dirty(self, novel: Novel):
+        if self.is_owner:
+            super().mark_dirty(novel)
+
+    def _events(self, after: int) -> List[JournalEntry]:
+        return [
+            JournalEntry(*row)
+            for row in self._db.execute(
+                "SELECT seq, novel, kind, key, value FROM events WHERE seq > ? ORDER BY seq",
+                (after,),
+            )
+        ]
+
+    def replay(self, novels: Iterable[Novel], get_novel: Callable[[str], Optional[Novel]]) -> int:
+        novels = list(novels)
+        # Events journaled in the file when running with a single worker
+        applied = super().replay(novels, get_novel) if self.is_owner else 0
+
+        with self._lock:
+            if self.is_owner:
+                self._reserve(max((novel.stats_seq for novel in novels), default=0))
+            # Every event of the previous runs, the owner included
+            for entry in self._events(0):
+                self._seq = max(self._seq, entry.seq)
+                novel = get_novel(entry.novel)
+                if novel is None or entry.seq <= novel.stats_seq:
+                    continue
+                self._apply(novel, entry)
+                if self.is_owner:
+                    self._mark_dirty(novel)
+                applied += 1
+            self._save_cursor()
+            # The next events are polled
+            self._get_novel = get_novel
+        if self.is_owner:
+            self.flush()
+        return applied
+
+    def _reserve(self, seq: int):
+        """Number the next events after seq, the last event in the stats.json files"""
+        row = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+        if row is None or row[0] < seq:
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO events (seq, worker, novel, kind, key, value) VALUES (?, 0, '', '', '', 0)",
+                    (seq,),
+                )
+                self._db.execute("DELETE FROM events WHERE seq = ?", (seq,))
+
+    def _save_cursor(self):
+        if not self.is_owner:
+            self._db.execute(
+                "INSERT OR REPLACE INTO cursors (worker, seq) VALUES (?, ?)",
+                (self.worker_id, self._seq),
+            )
+
+    # endregion
+
+    # region Poll
+
+    def _sync(self):
+        """Apply the events of the other workers, called with the lock held"""
+        if self._get_novel is None:
+            # Before the replay
+            return
+        rows = self._db.execute(
+            "SELECT seq, worker, novel, kind, key, value FROM events WHERE seq > ? ORDER BY seq",
+            (self._seq,),
+        ).fetchall()
+        for seq, worker, novel_slug, kind, key, value in rows:
+            self._seq = seq
+            novel = self._get_novel(novel_slug)
+            if novel is None:
+                continue
+            if worker != self.worker_id:
+                self._apply(novel, JournalEntry(seq, novel_slug, kind, key, value))
+                self._changed = True
+                if self.on_event is not None:
+                    self.on_event(novel)
+            if self.is_owner:
+                self._mark_dirty(novel)
+        if rows:
+            self._save_cursor()
+
+    def _poll_novels(self):
+        rows = self._db.execute(
+            "SELECT seq, folder FROM novels WHERE seq > ? ORDER BY seq", (self._novels_seen,)
+        ).fetchall()
+        for seq, folder in rows:
+            self._novels_seen = seq
+            if self.on_novel is not None:
+                self.on_novel(Path(folder))
+
+    def publish_novel(self, novel_folder: Path):
+        """Owner : the other workers read the novel again"""
+        self._db.execute("INSERT INTO novels (folder) VALUES (?)", (str(novel_folder),))
+
+    # endregion
+
+    # region Flush
+
+    def _drop_journal(self, seq: int):
+        # Segments journaled when running with a single worker
+        super()._drop_journal(seq)
+        self._db.execute(
+            "DELETE FROM events WHERE seq <= MIN(?, (SELECT COALESCE(MIN(seq), ?) FROM cursors))",
+            (seq, seq),
+        )
+
+    def flush(self):
+        if self.is_owner:
+            super().flush()
+            return
+        with self._lock:
+            self._sync()
+            changed, self._changed = self._changed, False
+        # Cached responses show the events of the other workers as of the last flush
+        if changed and self.on_flush is not None:
+            self.on_flush()
+
+    def run(self):
+        """Poll the events of the other workers, flush periodically or when enough novels are dirty"""
+        last_flush = time.monotonic()
+        while not self._closed:
+            self._wake_up.wait(POLL_INTERVAL)
+            self._wake_up.clear()
+            try:
+                with self._lock:
+                    self._sync()
+                if not self.is_owner:
+                    self._poll_novels()
+                if (
+                    len(self._dirty) >= self.flush_threshold
+                    or time.monotonic() - last_flush >= self.flush_interval
+                ):
+                    last_flush = time.monotonic()
+                    self.flush()
+            except Exception as e:
+                print(f"Error while syncing novel stats: {e}")
+
+    # endregion
@@ -1,104 +1,237 @@
+"""
+Sitemap of the website, split in shards listed by sitemap_index.xml.
+
+The urls of the sources are spread over sitemap-N.xml.gz files by a hash of
+the source, so a source always lands in the same shard while the number of
+shards doesn't change. Each shard keeps a fingerprint of its sources (url,
+last_update_date, chapter count, cover) : only the shards whose sources
+changed are written again. The static and browse pages are in sitemap-pages.xml.gz.
+
+Shards are written as a stream (gzip, temp file + rename) by a background
+thread, at startup and after novels are added.
+"""
+from __future__ import annotations
+import datetime
+import gzip
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import zlib
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator, List
 from urllib.parse import quote
-def replace_xml_illegal(text):
-    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace("'", "&apos;")
 
-def generate_sitemap(sitemap_file : Path, include_chapterlist : bool = False):
-    """Generate sitemap.xml file"""
-    from . import lib
-    from . import database
-    import math
+if TYPE_CHECKING:
+    from .Novel import NovelFromSource
 
-    sitemap = []
-    import datetime
+# The protocol allows 50000 urls per file : shards are sized for half of it,
+# hashing doesn't spread the sources perfectly evenly
+URLS_PER_SHARD = 25000
+CHAPTERLIST_PAGE_SIZE = 100
+DEFAULT_LASTMOD = "2022-11-01T00:00:00"
+# Minimum time between two regenerations triggered by new novels
+REGENERATE_INTERVAL = 600  # seconds
 
-    sitemap.append(f"""
-<?xml version="1.0" encoding="UTF-8"?>
+INDEX_NAME = "sitemap_index.xml"
+PAGES_NAME = "sitemap-pages.xml.gz"
+STATE_NAME = "sitemap_state.json"
+
+URLSET_START = """<?xml version="1.0" encoding="UTF-8"?>
 <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
-    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
-    xmlns:image="http://www.google.com/schemas/sitemap-image/1.1"
-    xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9 
-                        http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd 
-                        http://www.google.com/schemas/sitemap-image/1.1 
-                        http://www.google.com/schemas/sitemap-image/1.1/sitemap-image.xsd"
->"""
-            )
+    xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+"""
+URLSET_END = "</urlset>\n"
 
 
-    sitemap.append(f"""
-    <url>
-        <loc>{lib.WEBSITE_URL}/</loc>
-        <lastmod>{datetime.datetime.now().strftime("%Y-%m-%d")}</lastmod>
-        <changefreq>daily</changefreq>
-        <priority>1.0</priority>
-    </url>
-    <url>
-        <loc>{lib.WEBSITE_URL}/browse/</loc>
-        <lastmod>{datetime.datetime.now().strftime("%Y-%m-%d")}</lastmod>
-        <changefreq>daily</changefreq>
-        <priority>0.9</priority>
-    </url>
-    <url>
-        <loc>{lib.WEBSITE_URL}/search/</loc>
-        <lastmod>{datetime.datetime.now().strftime("%Y-%m-%d")}</lastmod>
-        <changefreq>weekly</changefreq>
-        <priority>0.8</priority>
-    </url>
-    <url>
-        <loc>{lib.WEBSITE_URL}/addnovel/</loc>
-        <lastmod>{datetime.datetime.now().strftime("%Y-%m-%d")}</lastmod>
-        <changefreq>weekly</changefreq>
-        <priority>0.8</priority>
-    </url>
-    """)
-
-    for page in range(math.ceil(len(database.all_novels) / 20)):
-        sitemap.append(f"""
-    <url>
-        <loc>{lib.WEBSITE_URL}/browse/page-{page + 1}/</loc>
-        <lastmod>{datetime.datetime.now().strftime("%Y-%m-%d")}</lastmod>
-        <changefreq>daily</changefreq>
-        <priority>0.9</priority>
-    </url>
-        """)
-            
+def replace_xml_illegal(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace("'", "&apos;")
 
-    for novel in database.all_novels:
 
+def _url(loc: str, lastmod: str, changefreq: str, priority: str, image: str = "") -> str:
+    return f"""    <url>
+        <loc>{loc}</loc>
+        <lastmod>{lastmod}</lastmod>
+        <changefreq>{changefreq}</changefreq>
+        <priority>{priority}</priority>{image}
+    </url>
+"""
 
 
-        for source in novel.sources:
-            image = f"""
-        <image:image>
-            <image:loc>https://api.lncrawler.monster/image/{quote(source.cover)}</image:loc>
-            <image:caption>{replace_xml_illegal(source.title)}</image:caption>
-            <image:title>{replace_xml_illegal(source.title)}</image:title>
-        </image:image>""" if source.cover else ""
-
-            sitemap.append(f"""
-    <url>
-        <loc>{lib.WEBSITE_URL}/novel/{source.xml_url}</loc>
-        <lastmod>{source.last_update_date if source.last_update_date else "2022-11-01T00:00:00"} </lastmod>
-        <changefreq>weekly</changefreq>
-        <priority>0.5</priority>{image}
-    </url>
-            """)
+def shard_name(shard: int) -> str:
+    return f"sitemap-{shard}.xml.gz"
 
 
-            if include_chapterlist:
-                for page in range(math.ceil(source.chapter_count / 100)):
-                    sitemap.append(f"""
-    <url>
-        <loc>{lib.WEBSITE_URL}/novel/{source.xml_url}chapterlist/page-{page + 1}/</loc>
-        <lastmod>{source.last_update_date if source.last_update_date else "2022-11-01T00:00:00"} </lastmod>
-        <changefreq>monthly</changefreq>
-        <priority>0.2</priority>
-    </url>
-                """)        
-    sitemap.append("</urlset>")
-    with open(sitemap_file, "w", encoding="utf-8") as f:
-        f.write("\n".join(sitemap).strip())
+class SitemapWriter:
+    def __init__(self, folder: Path, website_url: str, api_url: str, include_chapterlist: bool = False):
+        self.folder = folder
+        self.website_url = website_url
+        self.api_url = api_url
+        self.include_chapterlist = include_chapterlist
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self.folder.mkdir(parents=True, exist_ok=True)
 
+    @property
+    def index_file(self) -> Path:
+        return self.folder / INDEX_NAME
 
+    # region Urls
 
+    def _source_urls(self, source: NovelFromSource) -> Iterator[str]:
+        lastmod = source.last_update_date or DEFAULT_LASTMOD
+        image = f"""
+        <image:image>
+            <image:loc>{self.api_url}/image/{quote(source.cover)}</image:loc>
+            <image:caption>{replace_xml_illegal(source.title)}</image:caption>
+            <image:title>{replace_xml_illegal(source.title)}</image:title>
+        </image:image>""" if source.cover else ""
 
+        yield _url(f"{self.website_url}/novel/{source.xml_url}", lastmod, "weekly", "0.5", image)
+
+        if self.include_chapterlist:
+            for page in range(math.ceil(source.chapter_count / CHAPTERLIST_PAGE_SIZE)):
+                yield _url(
+                    f"{self.website_url}/novel/{source.xml_url}chapterlist/page-{page + 1}/",
+                    lastmod,
+                    "monthly",
+                    "0.2",
+                )
+
+    def _url_count(self, source: NovelFromSource) -> int:
+        if not self.include_chapterlist:
+            return 1
+        return 1 + math.ceil(source.chapter_count / CHAPTERLIST_PAGE_SIZE)
+
+    def _page_urls(self, novel_count: int) -> Iterator[str]:
+        today = datetime.datetime.now().strftime("%Y-%m-%d")
+        yield _url(f"{self.website_url}/", today, "daily", "1.0")
+        yield _url(f"{self.website_url}/browse/", today, "daily", "0.9")
+        yield _url(f"{self.website_url}/search/", today, "weekly", "0.8")
+        yield _url(f"{self.website_url}/addnovel/", today, "weekly", "0.8")
+        for page in range(math.ceil(novel_count / 20)):
+            yield _url(f"{self.website_url}/browse/page-{page + 1}/", today, "daily", "0.9")
+
+    def _fingerprint(self, sources: List[NovelFromSource]) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.website_url}|{self.api_url}|{self.include_chapterlist}".encode())
+        for source in sources:
+            digest.update(
+                f"\n{source.xml_url}|{source.last_update_date}|{source.chapter_count}|{source.cover}|{source.title}".encode()
+            )
+        return digest.hexdigest()
+
+    # endregion
+
+    # region Write
+
+    def _write_urlset(self, file_name: str, urls: Iterable[str]):
+        path = self.folder / file_name
+        tmp_file = path.with_name(path.name + ".tmp")
+        with gzip.open(tmp_file, "wt", encoding="utf-8") as f:
+            f.write(URLSET_START)
+            for url in urls:
+                f.write(url)
+            f.write(URLSET_END)
+        os.replace(tmp_file, path)
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.folder / STATE_NAME, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self, state: dict):
+        path = self.folder / STATE_NAME
+        tmp_file = path.with_name(path.name + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, path)
+
+    def generate(self, sources: List[NovelFromSource], novel_count: int) -> int:
+        """Write the shards whose sources changed, the pages and the index. Returns the number of shards written."""
+        with self._lock:
+            url_count = sum(self._url_count(source) for source in sources)
+            # A power of two : the shards only move when the library doubles
+            shards = 1 << max(0, math.ceil(math.log2(max(1, url_count / URLS_PER_SHARD))))
+
+            groups: List[List[NovelFromSource]] = [[] for _ in range(shards)]
+            for source in sources:
+                groups[zlib.crc32(source.xml_url.encode()) % shards].append(source)
+
+            state = self._load_state()
+            old_fingerprints = state.get("fingerprints", []) if state.get("shards") == shards else []
+
+            fingerprints = []
+            written = 0
+            for shard, group in enumerate(groups):
+                group.sort(key=lambda s: s.xml_url)
+                fingerprint = self._fingerprint(group)
+                fingerprints.append(fingerprint)
+                if (
+                    shard < len(old_fingerprints)
+                    and old_fingerprints[shard] == fingerprint
+                    and (self.folder / shard_name(shard)).exists()
+                ):
+                    continue
+                self._write_urlset(
+                    shard_name(shard),
+                    (url for source in group for url in self._source_urls(source)),
+                )
+                written += 1
+
+            # Shards left from a bigger library
+            for old_shard in range(shards, state.get("shards", 0)):
+                (self.folder / shard_name(old_shard)).unlink(missing_ok=True)
+
+            self._write_urlset(PAGES_NAME, self._page_urls(novel_count))
+            self._write_index([PAGES_NAME] + [shard_name(shard) for shard in range(shards)])
+            self._save_state({"shards": shards, "fingerprints": fingerprints})
+            return written
+
+    def _write_index(self, file_names: List[str]):
+        entries = []
+        for file_name in file_names:
+            lastmod = datetime.datetime.fromtimestamp(
+                (self.folder / file_name).stat().st_mtime, datetime.timezone.utc
+            ).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+            entries.append(
+                f"    <sitemap>\n        <loc>{self.api_url}/{file_name}</loc>\n        <lastmod>{lastmod}</lastmod>\n    </sitemap>\n"
+            )
+        tmp_file = self.index_file.with_name(INDEX_NAME + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            f.write('<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+            f.writelines(entries)
+            f.write("</sitemapindex>\n")
+        os.replace(tmp_file, self.index_file)
+
+    # endregion
+
+    # region Background
+
+    def schedule(self):
+        """Regenerate soon, ex : after a novel was added"""
+        self._wake_up.set()
+
+    def run(self):
+        from . import database
+
+        while True:
+            try:
+                written = self.generate(list(database.all_sources), len(database.all_novels))
+                print(f"Sitemap : {written} shards written")
+            except Exception as e:
+                print(f"Error while generating the sitemap: {e}")
+            self._wake_up.wait()
+            self._wake_up.clear()
+            # Novels added in a row are written together
+            time.sleep(REGENERATE_INTERVAL)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    # endregion
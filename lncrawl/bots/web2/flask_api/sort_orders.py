@@ -0,0 +1,211 @@
+"""
+Sort orders of /api/novels and /api/sources, maintained incrementally.
+
+Each order is a SortedList of (key, sequence number) where the key is computed
+once when an item is added or updated. Adding, removing or updating an item
+costs O(log n) and keeps every other position valid, reverse orders are read
+backward from the same list.
+
+An order can also keep the entries of each label (the sanitized tags) in their
+own SortedList, so a page of the items having a tag is sliced directly.
+"""
+from __future__ import annotations
+import itertools
+import threading
+from typing import Callable, Dict, Generic, FrozenSet, Iterable, Iterator, List, Optional, TypeVar, Union
+
+from sortedcontainers import SortedList
+
+T = TypeVar("T")
+
+# Number of items read at once when iterating over an order
+ITER_CHUNK = 256
+
+_EMPTY = SortedList()
+_NO_LABELS: FrozenSet[str] = frozenset()
+
+
+class SortedOrder(Generic[T]):
+    """
+    Items sorted by key_function(item), ascending.
+    Items with the same key stay in insertion order, like a stable sort.
+    key_function can return None to leave an item out of the order.
+    labels_function returns the labels of an item, each one kept as a sub order.
+    """
+
+    def __init__(
+        self,
+        key_function: Callable[[T], Optional[tuple]],
+        labels_function: Optional[Callable[[T], Iterable[str]]] = None,
+    ):
+        self.key_function = key_function
+        self.labels_function = labels_function
+        self._entries: Dict[int, tuple] = {}  # id(item) : (key, seq)
+        self._items: Dict[int, T] = {}  # seq : item
+        self._labels: Dict[int, FrozenSet[str]] = {}  # id(item) : labels
+        self._sorted = SortedList()
+        self._by_label: Dict[str, SortedList] = {}  # label : entries of the items having it
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._sorted)
+
+    # region Update
+
+    def _get_labels(self, item: T) -> FrozenSet[str]:
+        if self.labels_function is None:
+            return _NO_LABELS
+        labels = self.labels_function(item)
+        # A frozenset is kept as it is : the orders of the same items share it
+        return labels if isinstance(labels, frozenset) else frozenset(labels)
+
+    def add(self, item: T):
+        """Add the item, or move it if its key or its labels changed"""
+        key = self.key_function(item)
+        labels = self._get_labels(item)
+        with self._lock:
+            entry = self._entries.get(id(item))
+            if entry is not None:
+                if key is not None and entry[0] == key and self._labels[id(item)] == labels:
+                    return
+                self._remove_entry(item, entry)
+            if key is None:
+                return
+
+            # An updated item keeps its sequence number, so ties keep their order
+            seq = entry[1] if entry is not None else next(self._seq)
+            entry = (key, seq)
+            self._entries[id(item)] = entry
+            self._items[seq] = item
+            self._labels[id(item)] = labels
+            self._sorted.add(entry)
+            for label in labels:
+                if label not in self._by_label:
+                    self._by_label[label] = SortedList()
+                self._by_label[label].add(entry)
+
+    update = add
+
+    def remove(self, item: T):
+        with self._lock:
+            entry = self._entries.get(id(item))
+            if entry is not None:
+                self._remove_entry(item, entry)
+
+    def _remove_entry(self, item: T, entry: tuple):
+        self._sorted.remove(entry)
+        del self._entries[id(item)]
+        del self._items[entry[1]]
+        for label in self._labels.pop(id(item)):
+            entries = self._by_label[label]
+            entries.remove(entry)
+            if not entries:
+                del self._by_label[label]
+
+    def rebuild(self, items: Iterable[T]):
+        with self._lock:
+            self._entries.clear()
+            self._items.clear()
+            self._labels.clear()
+            self._seq = itertools.count()
+            entries = []
+            for item in items:
+                key = self.key_function(item)
+                if key is None:
+                    continue
+                entry = (key, next(self._seq))
+                self._entries[id(item)] = entry
+                self._items[entry[1]] = item
+                self._labels[id(item)] = self._get_labels(item)
+                entries.append(entry)
+            entries.sort()
+            self._sorted = SortedList(entries)
+
+            # Filled from the sorted entries : each label list is sorted in O(n)
+            by_label: Dict[str, list] = {}
+            items_by_seq = self._items
+            for entry in entries:
+                for label in self._labels[id(items_by_seq[entry[1]])]:
+                    by_label.setdefault(label, []).append(entry)
+            self._by_label = {label: SortedList(e) for label, e in by_label.items()}
+
+    # endregion
+
+    # region Read
+
+    def _entries_of(self, label: Optional[str]) -> SortedList:
+        if label is None:
+            return self._sorted
+        return self._by_label.get(label, _EMPTY)
+
+    def count(self, label: Optional[str] = None) -> int:
+        """Number of items having the label, or of every item"""
+        with self._lock:
+            return len(self._entries_of(label))
+
+    def labels(self, item: T) -> FrozenSet[str]:
+        with self._lock:
+            return self._labels.get(id(item), _NO_LABELS)
+
+    def slice(self, start: int, stop: int, reverse: bool = False, label: Optional[str] = None) -> List[T]:
+        """order[start:stop], only counting the items having the label if one is given"""
+        with self._lock:
+            entries = self._entries_of(label)
+            size = len(entries)
+            start, stop = max(0, min(start, size)), max(0, min(stop, size))
+            if reverse:
+                start, stop = size - stop, size - start
+            return [
+                self._items[seq]
+                for _, seq in entries.islice(start, stop, reverse=reverse)
+            ]
+
+    def index(self, item: T) -> Optional[int]:
+        """Position of the item, O(log n), None if it is not in the order"""
+        with self._lock:
+            entry = self._entries.get(id(item))
+            if entry is None:
+                return None
+            return self._sorted.index(entry)
+
+    def iterate(self, reverse: bool = False, label: Optional[str] = None) -> Iterator[T]:
+        """Iterate by chunks, the order can be updated between two chunks"""
+        for start in itertools.count(0, ITER_CHUNK):
+            chunk = self.slice(start, start + ITER_CHUNK, reverse, label)
+            yield from chunk
+            if len(chunk) < ITER_CHUNK:
+                return
+
+    def view(self, reverse: bool = False) -> OrderView[T]:
+        return OrderView(self, reverse)
+
+    # endregion
+
+
+class OrderView(Generic[T]):
+    """Read only sequence over a SortedOrder, forward or backward"""
+
+    def __init__(self, order: SortedOrder[T], reverse: bool = False):
+        self.order = order
+        self.reverse = reverse
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __iter__(self) -> Iterator[T]:
+        return self.order.iterate(self.reverse)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("OrderView only supports contiguous slices")
+            return self.order.slice(start, stop, self.reverse)
+
+        if index < 0:
+            index += len(self)
+        items = self.order.slice(index, index + 1, self.reverse)
+        if not items:
+            raise IndexError("OrderView index out of range")
+        return items[0]
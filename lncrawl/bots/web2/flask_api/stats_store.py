@@ -0,0 +1,297 @@
+"""
+Write-behind persistence of the novels stats (clicks, ratings, comments, source ratings).
+
+Every change is applied in memory and appended to a journal (one line per event),
+then the novel is marked dirty. A background thread only rewrites the stats.json
+of the dirty novels, every FLUSH_INTERVAL seconds or as soon as FLUSH_THRESHOLD
+novels are dirty. Each stats.json is written atomically (temp file + rename).
+
+Events have an increasing sequence number and stats.json stores the last one it
+includes ("journal_seq"). On startup the journal is replayed : only the events
+newer than the stats.json of their novel are applied, so replaying is safe even
+if the process was killed in the middle of a flush.
+
+The journal is split in segments : a flush closes the current segment and
+deletes the closed segments once every stats.json has been written.
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+import msgspec
+
+from . import datetools
+
+if TYPE_CHECKING:
+    from .Novel import Novel, NovelFromSource
+
+FLUSH_INTERVAL = 30  # seconds
+FLUSH_THRESHOLD = 200  # dirty novels
+
+
+class JournalEntry(msgspec.Struct, array_like=True):
+    seq: int
+    novel: str  # cleaned folder name of the novel
+    kind: str  # click, rating, comment or source_rating
+    key: str = ""  # week, user or source slug
+    value: int = 0
+
+
+def write_stats_file(path: Path, stats: dict):
+    tmp_file = path.with_name(path.name + ".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=4)
+    os.replace(tmp_file, path)
+
+
+def novel_stats(novel: Novel, seq: int) -> dict:
+    return {
+        "clicks": dict(novel.clicks),
+        "ratings": novel.ratings.to_dict(),
+        "comment_count": novel.comment_count,
+        "source_ratings": {
+            source.slug: source.source_rating for source in novel.sources
+        },
+        "journal_seq": seq,
+    }
+
+
+class StatsStore:
+    def __init__(
+        self,
+        journal_file: Path,
+        flush_interval: float = FLUSH_INTERVAL,
+        flush_threshold: int = FLUSH_THRESHOLD,
+    ):
+        self.journal_file = journal_file
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._dirty: Dict[str, Novel] = {}  # cleaned folder name : novel
+        self._seq = 0
+        self._journal = None
+        self._encoder = msgspec.json.Encoder()
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._closed = False
+        self.on_flush: Optional[Callable[[], None]] = None  # called after each flush
+        self._written: Dict[Path, int] = {}  # stats.json : mtime when written by the store
+
+    def __len__(self):
+        """Number of dirty novels"""
+        return len(self._dirty)
+
+    # region Journal
+
+    def _segments(self) -> List[Path]:
+        """Closed segments, oldest first"""
+        prefix = self.journal_file.name + "."
+        segments = [
+            p
+            for p in self.journal_file.parent.glob(prefix + "*")
+            if p.name[len(prefix) :].isdigit()
+        ]
+        return sorted(segments, key=lambda p: int(p.name[len(prefix) :]))
+
+    def _append(self, novel: Novel, kind: str, key: str = "", value: int = 0):
+        """Journal one event and mark the novel dirty, called with the lock held"""
+        self._seq += 1
+        entry = JournalEntry(self._seq, novel.cleaned_folder_name, kind, key, value)
+        if self._journal is None:
+            self._journal = open(self.journal_file, "ab")
+        self._journal.write(self._encoder.encode(entry) + b"\n")
+        # Written to the OS, survives a crash of the process
+        self._journal.flush()
+        self._mark_dirty(novel)
+
+    def _mark_dirty(self, novel: Novel):
+        self._dirty[novel.cleaned_folder_name] = novel
+        if len(self._dirty) >= self.flush_threshold:
+            self._wake_up.set()
+
+    def _read_journal(self) -> Iterable[JournalEntry]:
+        decoder = msgspec.json.Decoder(JournalEntry)
+        for file in self._segments() + [self.journal_file]:
+            if not file.exists():
+                continue
+            with open(file, "rb") as f:
+                for line in f:
+                    try:
+                        yield decoder.decode(line)
+                    except msgspec.DecodeError:
+                        # Last line cut by a crash
+                        continue
+
+    def replay(self, novels: Iterable[Novel], get_novel: Callable[[str], Optional[Novel]]) -> int:
+        """
+        Apply the journal events not yet in the stats.json files.
+        Must be called once at startup, before any other event.
+        Returns the number of events applied.
+        """
+        with self._lock:
+            self._seq = max((novel.stats_seq for novel in novels), default=0)
+            applied = 0
+            unknown = set()
+            for entry in self._read_journal():
+                self._seq = max(self._seq, entry.seq)
+                novel = get_novel(entry.novel)
+                if novel is None:
+                    unknown.add(entry.novel)
+                    continue
+                if entry.seq <= novel.stats_seq:
+                    continue
+                self._apply(novel, entry)
+                self._mark_dirty(novel)
+                applied += 1
+
+            if unknown:
+                print(f"Stats journal : {len(unknown)} novels not found, their events are dropped")
+        if applied:
+            print(f"Stats journal : {applied} events replayed")
+        self.flush()
+        return applied
+
+    @staticmethod
+    def _apply(novel: Novel, entry: JournalEntry):
+        if entry.kind == "click":
+            novel.clicks[entry.key] = novel.clicks.get(entry.key, 0) + entry.value
+        elif entry.kind == "rating":
+            novel.ratings.set(entry.key, entry.value)
+        elif entry.kind == "comment":
+            novel.comment_count += entry.value
+        elif entry.kind == "source_rating":
+            for source in novel.sources:
+                if source.slug == entry.key:
+                    source.source_rating += entry.value
+
+    # endregion
+
+    # region Events
+
+    def click(self, novel: Novel):
+        week = datetools.current_week()
+        with self._lock:
+            novel.clicks[week] = novel.clicks.get(week, 0) + 1
+            self._append(novel, "click", week, 1)
+
+    def rate(self, novel: Novel, user: str, rating: int):
+        with self._lock:
+            novel.ratings.set(user, rating)
+            self._append(novel, "rating", user, rating)
+
+    def add_comment(self, novel: Novel):
+        with self._lock:
+            novel.comment_count += 1
+            self._append(novel, "comment", value=1)
+
+    def rate_source(self, source: NovelFromSource, rating: int):
+        with self._lock:
+            source.source_rating += rating
+            self._append(source.novel, "source_rating", source.slug, rating)
+
+    def mark_dirty(self, novel: Novel):
+        """Save the stats of a novel at next flush, ex : a novel replaced by a new download"""
+        with self._lock:
+            self._mark_dirty(novel)
+
+    def forget(self, novel: Novel):
+        """The novel was removed from the library, its stats are not saved"""
+        with self._lock:
+            if self._dirty.get(novel.cleaned_folder_name) is novel:
+                del self._dirty[novel.cleaned_folder_name]
+
+    # endregion
+
+    # region Flush
+
+    def flush(self):
+        """Write the stats.json of the dirty novels, then drop the journal segments they include"""
+        with self._flush_lock:
+            with self._lock:
+                self._sync()
+                if not self._dirty:
+                    return
+                dirty, self._dirty = self._dirty, {}
+                seq = self._seq
+                # Copy under the lock : the stats can change while writing
+                to_write: List[Tuple[Novel, dict]] = [
+                    (novel, novel_stats(novel, seq)) for novel in dirty.values()
+                ]
+                self._rotate_journal(seq)
+
+            failed = []
+            for novel, stats in to_write:
+                if not novel.path.is_dir():
+                    # Folder deleted meanwhile : nothing to save, its events are dropped with the journal
+                    continue
+                try:
+                    stats_file = novel.path / "stats.json"
+                    write_stats_file(stats_file, stats)
+                    self._written[stats_file] = stats_file.stat().st_mtime_ns
+                    novel.stats_seq = seq
+                except Exception as e:
+                    print(f"Error while updating novel stats for {novel.title}: {e}")
+                    failed.append(novel)
+
+            if self.on_flush is not None:
+                self.on_flush()
+
+            if failed:
+                # The segments are kept, they will be replayed if the next flush fails too
+                with self._lock:
+                    for novel in failed:
+                        self._dirty.setdefault(novel.cleaned_folder_name, novel)
+                return
+
+            self._drop_journal(seq)
+
+    def wrote(self, stats_file: Path) -> bool:
+        """True if the stats.json was last written by the store"""
+        try:
+            return self._written.get(stats_file) == stats_file.stat().st_mtime_ns
+        except OSError:
+            return False
+
+    def _sync(self):
+        """Apply the events of the other processes before a flush, called with the lock held"""
+
+    def _rotate_journal(self, seq: int):
+        """Close the current segment, called with the lock held"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self.journal_file.exists():
+            os.replace(
+                self.journal_file,
+                self.journal_file.with_name(f"{self.journal_file.name}.{seq}"),
+            )
+
+    def _drop_journal(self, seq: int):
+        """Delete the events up to seq, they are all in the stats.json files"""
+        for segment in self._segments():
+            if int(segment.name.rsplit(".", 1)[1]) <= seq:
+                segment.unlink()
+
+    def run(self):
+        """Flush periodically, or when enough novels are dirty"""
+        while not self._closed:
+            self._wake_up.wait(self.flush_interval)
+            self._wake_up.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error while flushing novel stats: {e}")
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def close(self):
+        self._closed = True
+        self._wake_up.set()
+        self.flush()
+        print("Updated novels stats")
+
+    # endregion
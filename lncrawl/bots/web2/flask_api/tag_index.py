@@ -0,0 +1,148 @@
+"""
+Tag index used to filter /api/novels and /api/sources by tags.
+
+Each indexed item (novel or source) gets a bit number, and each sanitized tag
+a bitmap (a python int) of the items having it. A query like "action,-romance"
+is then a bitmap AND / AND NOT done in C, and the number of results a popcount.
+
+The sort orders keep the items of each tag in their own sorted list (see
+sort_orders.py). A page of one tag is a slice of that list, O(log n + page size).
+With several tags, only the items of the rarest included tag are read, in
+order, until the page is full.
+"""
+from __future__ import annotations
+import threading
+from typing import Dict, Iterable, List, Tuple, TypeVar
+
+from . import sanatize
+from .sort_orders import OrderView
+
+T = TypeVar("T")
+
+
+def parse_tags(tags: str) -> List[str]:
+    """'Action,-Romance' -> ['ACTION', '-ROMANCE']"""
+    return [
+        ("-" if t.startswith("-") else "") + sanatize.sanitize(t)
+        for t in tags.split(",")
+    ]
+
+
+_HAS_BIT_COUNT = hasattr(int, "bit_count")  # python 3.10
+
+
+def _popcount(bitmap: int) -> int:
+    return bitmap.bit_count() if _HAS_BIT_COUNT else bin(bitmap).count("1")
+
+
+class TagIndex:
+    def __init__(self):
+        self.items: Dict[int, object] = {}  # id(item) : item, keeps the ids valid
+        self.ids: Dict[int, int] = {}  # id(item) : bit number
+        self.tags: Dict[int, List[str]] = {}  # id(item) : sanitized tags
+        self.bitmaps: Dict[str, int] = {}  # sanitized tag : bitmap
+        self.all_items = 0  # bitmap of every indexed item
+        self._next_bit = 0
+        self._free_bits: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, item, tags: Iterable[str]):
+        """Add an item with its raw (not sanitized) tags"""
+        sanitized = list({sanatize.sanitize(t) for t in tags})
+        with self._lock:
+            self._remove(item)
+            bit = self._free_bits.pop() if self._free_bits else self._next_bit
+            if bit == self._next_bit:
+                self._next_bit += 1
+            mask = 1 << bit
+
+            self.items[id(item)] = item
+            self.ids[id(item)] = bit
+            self.tags[id(item)] = sanitized
+            self.all_items |= mask
+            for tag in sanitized:
+                self.bitmaps[tag] = self.bitmaps.get(tag, 0) | mask
+
+    def remove(self, item):
+        with self._lock:
+            self._remove(item)
+
+    def _remove(self, item):
+        bit = self.ids.pop(id(item), None)
+        if bit is None:
+            return
+        del self.items[id(item)]
+        mask = ~(1 << bit)
+        self.all_items &= mask
+        for tag in self.tags.pop(id(item)):
+            self.bitmaps[tag] &= mask
+            if not self.bitmaps[tag]:
+                del self.bitmaps[tag]
+        self._free_bits.append(bit)
+
+    def rebuild(self, items: Iterable[Tuple[object, Iterable[str]]]):
+        with self._lock:
+            self.items.clear()
+            self.ids.clear()
+            self.tags.clear()
+            self.bitmaps.clear()
+            self.all_items = 0
+            self._next_bit = 0
+            self._free_bits.clear()
+        for item, tags in items:
+            self.add(item, tags)
+
+    def query(self, tags: List[str]) -> int:
+        """
+        Bitmap of the items having all the tags.
+        Sanitized tags, starting with - when the item must not have it.
+        """
+        include = [t for t in tags if not t.startswith("-")]
+        exclude = [t[1:] for t in tags if t.startswith("-")]
+
+        # Start with the rarest tag, the AND can stop as soon as nothing is left
+        include.sort(key=lambda t: _popcount(self.bitmaps.get(t, 0)))
+        bitmap = self.bitmaps.get(include[0], 0) if include else self.all_items
+        for tag in include[1:]:
+            if not bitmap:
+                break
+            bitmap &= self.bitmaps.get(tag, 0)
+        for tag in exclude:
+            bitmap &= ~self.bitmaps.get(tag, 0)
+        return bitmap
+
+    def page(self, tags: List[str], order: OrderView[T], start: int, stop: int) -> Tuple[List[T], int]:
+        """
+        Return the items of order[start:stop] once filtered by tags,
+        and the total number of items matching the tags.
+        The order must label its items with their sanitized tags.
+        """
+        sorted_order, reverse = order.order, order.reverse
+        include = [t for t in tags if not t.startswith("-")]
+        exclude = {t[1:] for t in tags if t.startswith("-")}
+
+        if len(include) == 1 and not exclude:
+            tag = include[0]
+            return sorted_order.slice(start, stop, reverse, label=tag), sorted_order.count(tag)
+
+        total = _popcount(self.query(tags))
+        if not total or start >= total:
+            return [], total
+
+        required = set(include)
+        rarest = min(required, key=sorted_order.count) if required else None
+        page = []
+        found = 0
+        for item in sorted_order.iterate(reverse, label=rarest):
+            labels = sorted_order.labels(item)
+            if not required <= labels or not exclude.isdisjoint(labels):
+                continue
+            if found >= start:
+                page.append(item)
+                if found + 1 >= stop:
+                    break
+            found += 1
+        return page, total
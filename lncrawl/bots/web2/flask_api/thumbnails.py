@@ -0,0 +1,186 @@
+"""
+Cover thumbnails, made in the background by a pool of processes.
+
+Each cover.jpg gets its thumbnails (cover.min.* : 200px, cover.sm.* : 500px)
+in AVIF and WebP when Pillow supports them, and in JPEG for the other browsers.
+They are made at startup for the covers missing some of them, and when a source
+is added. /api/image/ keeps the old urls (cover.min.jpg...) and picks the
+variant from the Accept header in the variant map : no image is resized while
+answering a request.
+"""
+from __future__ import annotations
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, features
+
+from .loader import get_pool_context
+
+SIZES = {"min": 200, "sm": 500}
+
+# Best format first, jpg is always made
+FORMATS = [
+    fmt
+    for fmt, available in (
+        ("avif", features.check("avif")),
+        ("webp", features.check("webp")),
+        ("jpg", True),
+    )
+    if available
+]
+MIMETYPES = {"avif": "image/avif", "webp": "image/webp", "jpg": "image/jpeg"}
+SAVE_OPTIONS = {
+    "avif": {"format": "AVIF", "quality": 60},
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpg": {"format": "JPEG", "quality": 85, "optimize": True},
+}
+
+
+def variant_path(cover: Path, size: str, fmt: str) -> Path:
+    return cover.with_name(f"{cover.stem}.{size}.{fmt}")
+
+
+def missing_variants(cover: Path) -> List[Tuple[str, str]]:
+    """(size, format) of the thumbnails missing or older than the cover"""
+    cover_mtime = cover.stat().st_mtime_ns
+    missing = []
+    for size in SIZES:
+        for fmt in FORMATS:
+            try:
+                if variant_path(cover, size, fmt).stat().st_mtime_ns >= cover_mtime:
+                    continue
+            except FileNotFoundError:
+                pass
+            missing.append((size, fmt))
+    return missing
+
+
+def make_thumbnails(cover: str) -> Tuple[str, bool]:
+    """Worker : make the missing thumbnails of a cover"""
+    cover = Path(cover)
+    try:
+        missing = missing_variants(cover)
+        if not missing:
+            return str(cover), True
+        with Image.open(cover) as img:
+            img.load()
+            for size in SIZES:
+                formats = [fmt for s, fmt in missing if s == size]
+                if not formats:
+                    continue
+                thumbnail = img.copy()
+                thumbnail.thumbnail((SIZES[size], SIZES[size]))
+                if thumbnail.mode not in ("RGB", "L"):
+                    thumbnail = thumbnail.convert("RGB")
+                for fmt in formats:
+                    path = variant_path(cover, size, fmt)
+                    tmp_file = path.with_name(path.name + ".tmp")
+                    thumbnail.save(tmp_file, **SAVE_OPTIONS[fmt])
+                    os.replace(tmp_file, path)
+        return str(cover), True
+    except Exception as e:
+        print(f"Error while making the thumbnails of {cover}: {e}")
+        return str(cover), False
+
+
+class ThumbnailPipeline:
+    def __init__(self, library_folder: Path, processes: int = 2):
+        self.library_folder = library_folder.absolute()
+        self.processes = processes
+        # requested file (ex : novel/source/cover.min.jpg) : {mimetype : file to send}
+        self.variants: Dict[str, Dict[str, str]] = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        context = get_pool_context()
+        if processes == 0:
+            # Made by another process (workers.py) : only registered once made
+            self._executor = None
+        elif context is None:
+            # No fork : made in a thread, still outside of the requests
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+        else:
+            self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=context)
+            # Forked workers are all started on the first task : start them now,
+            # before the server threads exist
+            self._executor.submit(len, ()).result()
+
+    def _register(self, cover: Path):
+        relative = cover.relative_to(self.library_folder).as_posix()
+        parent = relative.rsplit("/", 1)[0]
+        with self._lock:
+            for size in SIZES:
+                variants = {}
+                for fmt in FORMATS:
+                    variant = variant_path(cover, size, fmt)
+                    if variant.exists():
+                        variants[MIMETYPES[fmt]] = f"{parent}/{variant.name}"
+                if variants:
+                    self.variants[f"{parent}/{cover.stem}.{size}.jpg"] = variants
+
+    def _done(self, future):
+        cover, success = future.result()
+        with self._lock:
+            self._pending.discard(cover)
+        if success:
+            self._register(Path(cover))
+
+    def submit(self, cover: Path):
+        """Make the missing thumbnails of a cover in the background"""
+        cover = cover.absolute()
+        if self._executor is None:
+            try:
+                if not missing_variants(cover):
+                    self._register(cover)
+            except FileNotFoundError:
+                pass
+            return
+        with self._lock:
+            if str(cover) in self._pending:
+                return
+            self._pending.add(str(cover))
+
+        self._executor.submit(make_thumbnails, str(cover)).add_done_callback(self._done)
+
+    def submit_sources(self, source_folders: Iterable[Path]):
+        for source_folder in source_folders:
+            cover = source_folder / "cover.jpg"
+            if cover.exists():
+                self.submit(cover)
+
+    def scan(self, source_folders: Iterable[Path]):
+        """Register the thumbnails already made and make the missing ones"""
+        queued = 0
+        for source_folder in source_folders:
+            cover = source_folder.absolute() / "cover.jpg"
+            try:
+                missing = missing_variants(cover)
+            except FileNotFoundError:
+                continue
+            if missing:
+                if self._executor is None:
+                    continue
+                self.submit(cover)
+                queued += 1
+            else:
+                self._register(cover)
+        if queued:
+            print(f"Thumbnails : {queued} covers queued")
+
+    def start(self, source_folders: List[Path]):
+        threading.Thread(target=self.scan, args=(source_folders,), daemon=True).start()
+
+    def choose(self, file: str, accepted: Iterable[str]) -> Optional[Tuple[str, str]]:
+        """(file to send, mimetype) of the best variant the client accepts"""
+        variants = self.variants.get(file)
+        if not variants:
+            return None
+        accepted = set(accepted)
+        for fmt in FORMATS:
+            mimetype = MIMETYPES[fmt]
+            if mimetype in variants and (fmt == "jpg" or mimetype in accepted):
+                return variants[mimetype], mimetype
+        return None
+
@@ -12,7 +12,7 @@ def get_novel_with_slug(novel_slug) -> Optional[Novel]:
     Returns the novel with the given slug
     """
     novel = naming_rules.clean_name(urllib.parse.unquote_plus(novel_slug))
-    return next((n for n in database.all_novels if n.cleaned_folder_name == novel), None)
+    return database.novels_by_slug.get(novel)
 
 
 def get_novel_with_url(url: str) -> Optional[Novel]:
@@ -29,36 +29,15 @@ def get_source_with_slugs(novel_slug, source_slug) -> Optional[NovelFromSource]:
     """
     Returns the source with the given slugs
     """
-    novel = get_novel_with_slug(novel_slug)
-    if not novel:
-        return None
-    for source in novel.sources:
-        if source.slug == source_slug:
-            return source
-    return None
+    novel = naming_rules.clean_name(urllib.parse.unquote_plus(novel_slug))
+    return database.sources_by_slugs.get((novel, source_slug))
 
 def find_source_with_path(novel_and_source_path: Path) -> Optional[NovelFromSource]:
     """
     Find the NovelFromSource object corresponding to the path
     """
     novel_and_source_path = novel_and_source_path.parent.parent / naming_rules.clean_name(novel_and_source_path.parent.name) / novel_and_source_path.name
-    novel = None
-    for n in database.all_novels:
-        if novel_and_source_path.parent == n.path:
-            novel = n
-            break
-    if not novel:
-        return None
-
-    source = None
-    for s in novel.sources:
-        if novel_and_source_path == s.path:
-            source = s
-            break
-    if not source:
-        return None
-
-    return source
+    return database.sources_by_path.get(novel_and_source_path)
 
 
 import hashlib
@@ -69,49 +48,60 @@ def shuffle_ip(ip) -> str:
     return hashlib.sha256(str(ip[:4] + ip[5:6] + ip[7:]).encode()).hexdigest()
 
 
-def add_novel_to_database(novel: Novel):
+def add_novel_to_database(novel: Novel, invalidate_chapters: bool = True):
     """
-    To be used when lncrawn is running and we want to add a novel to the database
+    To be used when lncrawn is running and we want to add a novel to the database.
+    invalidate_chapters : False when the caller only drops the chapters that changed
     """
 
-    if novel in database.all_novels:
-        # We find the novel in the database and take its stats if they are higher to get the most recent stats
-        for dbn in database.all_novels:
-            if dbn == novel:
-                if sum(dbn.clicks.values()) > sum(novel.clicks.values()):
-                    novel.clicks = dbn.clicks
-                    novel.ratings = dbn.ratings
-                    novel.comment_count = dbn.comment_count
-
-        database.all_novels.remove(novel)
-    database.all_novels.append(novel)
+    dbn = database.novels_by_slug.get(novel.cleaned_folder_name)
+    if dbn:
+        # We take the stats of the novel in the database if they are higher to get the most recent stats
+        if sum(dbn.clicks.values()) > sum(novel.clicks.values()):
+            novel.clicks = dbn.clicks
+            novel.ratings = dbn.ratings
+            novel.comment_count = dbn.comment_count
+        _unlink_novel(dbn)
 
+    database.add_to_lists(novel)
     for new_source in novel.sources:
-        for existing_source in database.all_sources:
-            if new_source == existing_source :
-                database.all_sources.remove(existing_source)
-
-        database.all_sources.append(new_source)
-        
-    database.set_ranks()
-    database.refresh_sorted_all()
-    database.set_prefered_sources()
+        if invalidate_chapters:
+            database.chapter_cache.invalidate(new_source.path)
+        database.thumbnails.submit_sources([new_source.path])
+        if database.in_source_orders(new_source):
+            database.source_tag_index.add(new_source, novel.tags)
 
-    
+    database.index_novel(novel)
+    database.add_to_sorted(novel)
+    database.stats_store.mark_dirty(novel)
+    database.set_rank(novel)
+    database.set_prefered_source(novel)
+    database.search_index.add(novel)
+    database.novel_tag_index.add(novel, novel.tags)
+    database.response_cache.bump()
 
 
-def has_tags(novel: Novel, tags: list) -> bool:
+def remove_novel_from_database(novel: Novel):
     """
-    Returns True if the novel has all the tags
-    tag starting with - means it must not have it
-    use sanatized tags
+    To be used when the folder of a novel was deleted while lncrawl is running
     """
-    return all(
-        (tag.startswith("-") and tag[1:] not in novel.sanatized_tags)
-        or (not tag.startswith("-") and tag in novel.sanatized_tags)
-        for tag in tags
-    )
-    
+    _unlink_novel(novel)
+    database.stats_store.forget(novel)
+    for source in novel.sources:
+        database.chapter_cache.invalidate(source.path)
+    database.response_cache.bump()
+
+
+def _unlink_novel(novel: Novel):
+    """Remove the novel and its sources from the lists and indexes"""
+    database.unindex_novel(novel)
+    database.remove_from_sorted(novel)
+    database.search_index.remove(novel)
+    database.novel_tag_index.remove(novel)
+    for old_source in novel.sources:
+        database.source_tag_index.remove(old_source)
+    database.remove_from_lists(novel)
+
 
 def add_tag(tag):
     sanatized_tag = sanatize.sanitize(tag)
@@ -120,33 +110,45 @@ def add_tag(tag):
     else:
         database.all_tags[sanatized_tag] = [tag, 1]
 
-from PIL import Image
-def create_miniature(path, output_path, size=200):
-    """
-    Create a miniature of the image at path and save it to output_path
-    Biggest side will be 200px and the other will be scaled accordingly
-    """
-    
-    img = Image.open(path)
-    img.thumbnail((size, size))
-    img.save(output_path)
-    img.close()
-    return output_path
-
-
 import subprocess
 import shutil
+import os
 
 COMPRESSION_LEVEL = 5
 COMPRESSION_ALGORITHM = "LZMA2"
-def compress_folder_to_tar_7zip(source_folder:Path, json_folder:str, tarfile_path:Path):
+LOW_PRIORITY_NICENESS = 10
+def compress_folder_to_tar_7zip(source_folder:Path, json_folder:str, tarfile_path:Path, low_priority:bool=False, threads:Optional[int]=None):
+    """
+    Compress source_folder/json_folder to tarfile_path, then delete the folder.
+    The archive is written to a temp file and renamed : a compression killed
+    midway never leaves an incomplete json.7z. If tarfile_path exists, the
+    files are added to a copy of it, replacing the files with the same name.
+    low_priority runs 7z with the idle IO class and a lower CPU priority.
+    """
+    tmp_file = tarfile_path.with_name(tarfile_path.name + ".tmp")
     try :
+        # 7z would add the files to a temp file left by a killed compression
+        tmp_file.unlink(missing_ok=True)
+        if tarfile_path.exists():
+            # The solid blocks of the files not replaced are copied, not compressed again
+            shutil.copyfile(tarfile_path, tmp_file)
         # result = subprocess.run(["7z", "a", tarfile_path, json_folder], cwd=source_folder)
-        result = subprocess.run(["7z", "a", tarfile_path, json_folder, f"-mx={COMPRESSION_LEVEL}", f"-m0={COMPRESSION_ALGORITHM}", "-bso0"], cwd=source_folder)
+        command = ["7z", "a", "-t7z", tmp_file, json_folder, f"-mx={COMPRESSION_LEVEL}", f"-m0={COMPRESSION_ALGORITHM}", "-bso0"]
+        if threads:
+            command.append(f"-mmt={threads}")
+        preexec_fn = None
+        if low_priority:
+            if shutil.which("ionice"):
+                command = ["ionice", "-c3"] + command
+            if hasattr(os, "nice"):
+                preexec_fn = lambda: os.nice(LOW_PRIORITY_NICENESS)
+        result = subprocess.run(command, cwd=source_folder, preexec_fn=preexec_fn)
         if result.returncode == 0:
+            os.replace(tmp_file, tarfile_path)
             print(f"Compression successful. Deleting {source_folder}/{json_folder}")
             shutil.rmtree(f"{source_folder}/{json_folder}")
         else:
+            tmp_file.unlink(missing_ok=True)
             print("Compression failed. Folder not deleted.")
         return result.returncode == 0
     except Exception as e:
@@ -155,7 +157,8 @@ def compress_folder_to_tar_7zip(source_folder:Path, json_folder:str, tarfile_pat
 
 def extract_tar_7zip_folder(tar_file_path:Path, output_folder:Path):
     try :
-        result = subprocess.run(["7z", "x", tar_file_path, f"-o{output_folder}", "-bso0"])
+        # -aos : the files already extracted were written by an update, after json.7z
+        result = subprocess.run(["7z", "x", tar_file_path, f"-o{output_folder}", "-bso0", "-aos"])
         if result.returncode == 0:
             print(f"Extraction successful. Deleting {tar_file_path}")
             tar_file_path.unlink()
@@ -178,6 +181,7 @@ def get_file_content_from_tar_7zip(tar_file_path:Path, target_file_name:str):
 
 
 import json
+from . import chapter_archive
 
 def get_chapter(source: NovelFromSource, chapter_number: int) -> dict:
     """
@@ -187,6 +191,16 @@ def get_chapter(source: NovelFromSource, chapter_number: int) -> dict:
         with open(source.path / "json" / f"{chapter_number:05}.json", "r", encoding="utf-8") as f:
             return json.load(f)
 
+    # Random access archive, no 7z process
+    try:
+        chapter = chapter_archive.read_chapter(source.path, chapter_number)
+    except Exception as e:
+        print(f"Error while reading chapter {chapter_number} from {source.path / chapter_archive.ARCHIVE_NAME}: {e}")
+        chapter = None
+    if chapter is not None:
+        return chapter
+
+    # Sources not converted yet
     tar_file_path = source.path / "json.7z"
 
     if tar_file_path.exists():
@@ -199,15 +213,3 @@ def get_chapter(source: NovelFromSource, chapter_number: int) -> dict:
 
 # utils.extract_tar_7zip_folder(LIGHTNOVEL_FOLDER / "a transmigrator's privilege\\readlightnovel-app\json.7z", LIGHTNOVEL_FOLDER /"a transmigrator's privilege\\readlightnovel-app")
 # utils.compress_folder_to_tar_7zip(LIGHTNOVEL_FOLDER / "a transmigrator's privilege\\readlightnovel-app", "json", LIGHTNOVEL_FOLDER / "a transmigrator's privilege\\readlightnovel-app\\json.7z")
-
-import time
-def run_tasks(tasks):
-    len_tasks = len(tasks)
-    for i, (task, args) in enumerate(tasks, 1):
-        result = task(*args)
-        if result:
-            print(f"Task {i}/{len_tasks} done")
-        else:
-            print(f"Task {i}/{len_tasks} failed")
-        time.sleep(5)
-    print("All tasks done")
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+Several API worker processes on the same port (config : api_workers).
+
+The process started by the command line is the owner : it loads the library,
+starts the other workers with the same command line (LNCRAWL_WEB2_WORKER set to
+their number) and runs everything that must happen once : downloads, comments,
+stats.json files, catalog, sitemap, thumbnails and compression.
+
+Every worker loads the catalog from the snapshot written by the owner and
+answers the read requests by itself. The kernel spreads the connections over the
+workers (SO_REUSEPORT). Clicks and ratings go through the SQLite store of
+shared_stats, and the requests that need the owner (jobs, comments) are
+forwarded to it on a local port.
+"""
+from __future__ import annotations
+import atexit
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import List
+
+import requests
+from flask import Response, request
+
+WORKER_ENV = "LNCRAWL_WEB2_WORKER"
+WORKER_ID = int(os.environ.get(WORKER_ENV, "0"))
+IS_OWNER = WORKER_ID == 0
+
+# Paths (without /api) of the requests answered by the owner only
+OWNER_PATHS = ("/addnovel/", "/add_comment", "/add_reaction")
+# Not copied from the response of the owner, set again by waitress
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length"}
+OWNER_CHECK_INTERVAL = 1  # seconds
+
+
+def listen_socket(host: str, port: int, reuse_port: bool = True) -> socket.socket:
+    """A listening socket, bound by every worker when reuse_port is set"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+
+def spawn_workers(count: int) -> List[subprocess.Popen]:
+    """Start the workers 1 to count - 1, stopped with the owner"""
+    command = getattr(sys, "orig_argv", [sys.executable] + sys.argv)
+    processes = [
+        subprocess.Popen(command, env={**os.environ, WORKER_ENV: str(worker_id)})
+        for worker_id in range(1, count)
+    ]
+
+    def stop():
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    atexit.register(stop)
+    # Stopped by a signal : exit through atexit, the workers are stopped too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    return processes
+
+
+def watch_owner():
+    """Worker : exit when the owner is gone"""
+    owner_pid = os.getppid()
+
+    def watch():
+        while os.getppid() == owner_pid:
+            time.sleep(OWNER_CHECK_INTERVAL)
+        print(f"Worker {WORKER_ID} : the owner stopped, exiting")
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def _relay(response):
+    try:
+        yield from response.iter_content(chunk_size=None)
+    finally:
+        response.close()
+
+
+def is_owner_request(path: str) -> bool:
+    if path.startswith("/api"):
+        path = path[len("/api"):]
+    return path.startswith(OWNER_PATHS)
+
+
+def forward_to_owner(owner_url: str) -> Response:
+    """Send the current request to the owner and return its response"""
+    headers = {
+        key: value for key, value in request.headers.items() if key.lower() != "host"
+    }
+    # The owner sees the client address, ex : rank of the comments, ratings
+    headers.setdefault("X-Real-IP", request.remote_addr or "")
+    response = requests.request(
+        request.method,
+        owner_url + request.full_path.rstrip("?"),
+        headers=headers,
+        data=request.get_data(),
+        allow_redirects=False,
+        timeout=60,
+        stream=True,
+    )
+    if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+        # Progress stream of a job : relayed as the owner sends it
+        body = _relay(response)
+    else:
+        body = response.raw.read()
+    return Response(
+        body,
+        status=response.status_code,
+        headers=[
+            (key, value)
+            for key, value in response.raw.headers.items()
+            if key.lower() not in HOP_HEADERS
+        ],
+    )
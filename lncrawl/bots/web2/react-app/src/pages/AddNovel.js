@@ -58,8 +58,29 @@ function AddNovel() {
     const [sessionCreated, setSessionCreated] = useState(false);
     const [status, setStatus] = useState("");
 
+    function waitForJob() {
+        // Progress of the job pushed by the server until it is no longer pending
+        // If the stream can't be opened or is closed, wait 3 seconds like the polling
+        return new Promise(resolve => {
+            const events = new EventSource(`${API_URL}/addnovel/events?job_id=${jobId}`);
+            events.onmessage = event => {
+                const data = JSON.parse(event.data);
+                if (data.status === "pending") {
+                    setStatus(data.message);
+                } else {
+                    events.close();
+                    resolve();
+                }
+            };
+            events.onerror = () => {
+                events.close();
+                sleep(3000).then(resolve);
+            };
+        });
+    }
+
     async function queue(queueTarget) {
-        // polling system => if the job is not finished yet, we wait for 1 second and we poll again
+        // if the job is not finished yet, we wait for its progress stream and we poll again
         let response = false;
         let finished = false;
         while (!finished) {
@@ -69,7 +90,7 @@ function AddNovel() {
                 finished = true;
             } else if (response.status === "pending") {
                 setStatus(response.message)
-                await sleep(3000); // wait 3 seconds and try again
+                await waitForJob();
             } else if (response.status === "error") {
                 finished = true;
                 setStatus(response.message)
@@ -161,10 +161,17 @@ function NovelInfo() {
     }
 
 
-    const [userRating, setUserRating] = useState(source.novel.user_rating);
+    const [userRating, setUserRating] = useState(null);
     useEffect(() => {
-        setUserRating(source.novel.user_rating);
-    }, [source.novel.user_rating]);
+        // Not in the novel response : it is cached for every visitor
+        fetch(`${API_URL}/user_rating?novel=${novelSlug}`).then(
+            response => response.json()
+        ).then(
+            data => {
+                setUserRating(data.user_rating ?? null);
+            }
+        )
+    }, [novelSlug, updateHook]);
 
     return (
 
@@ -208,7 +215,7 @@ function NovelInfo() {
                                     <span className="note">Note: </span>
                                     <span className="text">{source.novel.note}</span>
                                 </div> */}
-                                {source.novel.user_rating ? (
+                                {userRating ? (
                                     <div className="user-rating">
                                         <span className="user-note">Your note: </span>
                                         <RatingStars rating={userRating} novel={source.novel.slug} displayAverage={false} passUserRateAfterVote={setUserRating} />
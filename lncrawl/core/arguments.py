@@ -254,6 +254,11 @@ _builder = Args(
             default=1,
             help="Discord bot shard counts (default: 1)",
         ),
+        Args(
+            "--rebuild-catalog",
+            action="store_true",
+            help="[web2 only] Rebuild the novel catalog snapshot from scratch and exit.",
+        ),
         Args(
             "--selenium-grid",
             type=str,
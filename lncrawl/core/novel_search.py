@@ -4,25 +4,30 @@ To search for novels in selected sources
 import logging
 import os
 from concurrent import futures
-from typing import Dict, List
+from functools import partial
+from typing import Dict, List, Optional
 
 from slugify import slugify
 from tqdm import tqdm
 
 from ..core.sources import crawler_list, prepare_crawler
 from ..models import CombinedSearchResult, SearchResult
+from .search_cache import SearchCache
 
 SEARCH_TIMEOUT = 60
 
 logger = logging.getLogger(__name__)
 executor = futures.ThreadPoolExecutor(20)
+# Shared by the searches of every app : bots, web2 jobs
+search_cache = SearchCache()
 
 
-def _perform_search(app, link, bar):
+def _perform_search(link: str, query: str) -> Optional[List[SearchResult]]:
+    """Results of one source, None if the search failed"""
     try:
         crawler = prepare_crawler(link)
         results = []
-        for item in crawler.search_novel(app.user_input):
+        for item in crawler.search_novel(query):
             if not item.get("url"):
                 continue
             if not isinstance(item, SearchResult):
@@ -37,7 +42,7 @@ def _perform_search(app, link, bar):
     except Exception:
         if logger.isEnabledFor(logging.DEBUG):
             logging.exception("<!> Search Failed! << %s >>", link)
-        return []
+        return None
 
 
 def _combine_results(results: List[SearchResult]) -> List[CombinedSearchResult]:
@@ -84,8 +89,10 @@ def search_novels(app):
     )
 
     # Add future tasks
+    query = app.user_input
     checked = {}
     futures_to_check = []
+    results: List[SearchResult] = []
     app.progress = 0
     for link in sources:
         crawler = crawler_list[link]
@@ -93,11 +100,18 @@ def search_novels(app):
             bar.update()
             continue
         checked[crawler] = True
-        future = executor.submit(_perform_search, app, link, bar)
+        cached, fresh = search_cache.get(link, query)
+        if not fresh:
+            future = search_cache.search(executor, link, query, partial(_perform_search, link, query))
+        if cached is not None:
+            # Stale results are used now, the search above refreshes them for the next time
+            results += cached
+            app.progress += 1
+            bar.update()
+            continue
         futures_to_check.append(future)
 
     # Resolve all futures
-    results: List[SearchResult] = []
     for i, f in enumerate(futures_to_check):
         assert isinstance(f, futures.Future)
         try:
@@ -105,7 +119,8 @@ def search_novels(app):
         except KeyboardInterrupt:
             break
         except TimeoutError:
-            f.cancel()
+            # Not cancelled : other searches may wait for it, it fills the cache when done
+            pass
         except Exception as e:
             if is_debug:
                 logger.error("Failed to complete search", e)
@@ -113,13 +128,11 @@ def search_novels(app):
             app.progress += 1
             bar.update()
 
-    # Cancel any remaining futures
+    # The unfinished searches are left running for the cache
     for f in futures_to_check:
         assert isinstance(f, futures.Future)
-        if not f.done():
-            f.cancel()
-        elif not f.cancelled():
-            results += f.result()
+        if f.done() and not f.cancelled() and f.exception() is None:
+            results += f.result() or []
 
     # Process combined search results
     app.search_results = _combine_results(results)
@@ -0,0 +1,126 @@
+"""
+Search results shared by every search, per source and normalized query
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..models import SearchResult
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_TTL = 3600  # seconds, results returned without searching again
+SEARCH_CACHE_STALE_TTL = 24 * 3600  # seconds, results returned while searching again in the background
+SEARCH_CACHE_SIZE = 10000  # source and query pairs
+
+Key = Tuple[str, str]
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+class SearchCache:
+    def __init__(
+        self,
+        ttl: float = SEARCH_CACHE_TTL,
+        stale_ttl: float = SEARCH_CACHE_STALE_TTL,
+        max_entries: int = SEARCH_CACHE_SIZE,
+    ) -> None:
+        """A cache of the search results of each source.
+
+        - Results younger than `ttl` are returned as they are.
+        - Results younger than `stale_ttl` are returned, and the source is
+          searched again in the background for the next time.
+        - Failed searches are not kept : the next query searches the source again.
+        - The same search running for several queries is shared.
+        - At most `max_entries` results, the least recently used are dropped.
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Key, Tuple[float, List[SearchResult]]]" = OrderedDict()
+        self._running: Dict[Key, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, link: str, query: str) -> Tuple[Optional[List[SearchResult]], bool]:
+        """The cached results and whether they are fresh, None if they must be searched"""
+        key = (link, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.stale_ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            fresh = now - entry[0] <= self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return list(entry[1]), fresh
+
+    def search(
+        self,
+        executor: Executor,
+        link: str,
+        query: str,
+        search: Callable[[], Optional[List[SearchResult]]],
+    ) -> Future:
+        """Run search() in the executor and keep its results, unless the same search is already running.
+
+        search() returns None when it failed.
+        """
+        key = (link, normalize_query(query))
+        with self._lock:
+            future = self._running.get(key)
+            if future is not None:
+                return future
+            future = executor.submit(search)
+            self._running[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key: Key, future: Future) -> None:
+        results = None
+        if not future.cancelled() and future.exception() is None:
+            results = future.result()
+        with self._lock:
+            if self._running.get(key) is future:
+                del self._running[key]
+            if results is None:
+                self.failures += 1
+                return
+            self._entries[key] = (time.time(), results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "running": len(self._running),
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "failures": self.failures,
+            }
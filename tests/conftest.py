@@ -0,0 +1,17 @@
+"""
+Importing lncrawl.bots.web2 starts the website (config, library loading...).
+The modules under test only need their package : web2 and flask_api are
+registered empty so their modules can be imported alone.
+"""
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT))
+
+for name in ("lncrawl.bots.web2", "lncrawl.bots.web2.flask_api"):
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [str(ROOT.joinpath(*name.split(".")))]
+        sys.modules[name] = package
@@ -0,0 +1,108 @@
+import os
+
+from lncrawl.bots.web2.flask_api import catalog as catalog_module
+from lncrawl.bots.web2.flask_api.catalog import Catalog, SourceInfo
+
+
+def make_source(library, name, content="{}"):
+    source_folder = library / "Novel" / name
+    source_folder.mkdir(parents=True, exist_ok=True)
+    (source_folder / "meta.json").write_text(content)
+    return source_folder
+
+
+def info_of(source_folder, title="Title", language="en"):
+    stat = (source_folder / "meta.json").stat()
+    return SourceInfo(
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        title=title,
+        author="Author",
+        chapter_count=12,
+        volume_count=1,
+        first="Chapter 1",
+        latest="Chapter 12",
+        summary="Summary",
+        tags=["Action", "English"],
+        language=language,
+        url="https://example.com/novel",
+        last_update_date=None,
+    )
+
+
+def test_snapshot_round_trip(tmp_path):
+    snapshot_file = tmp_path / "catalog.msgpack"
+    first = make_source(tmp_path, "source-a")
+    second = make_source(tmp_path, "source-b")
+    catalog = Catalog(snapshot_file)
+    catalog.store(first, info_of(first))
+    # Old meta.json without a language
+    catalog.store(second, info_of(second, "Other", language=None))
+    catalog.save()
+
+    catalog = Catalog(snapshot_file)
+    assert catalog.lookup(first) == info_of(first)
+    assert catalog.lookup(second) == info_of(second, "Other", language=None)
+
+
+def test_changed_meta_is_not_returned(tmp_path):
+    snapshot_file = tmp_path / "catalog.msgpack"
+    source_folder = make_source(tmp_path, "source-a")
+    catalog = Catalog(snapshot_file)
+    catalog.store(source_folder, info_of(source_folder))
+    catalog.save()
+
+    (source_folder / "meta.json").write_text('{"changed": true}')
+    assert Catalog(snapshot_file).lookup(source_folder) is None
+
+    # Same size, other mtime
+    make_source(tmp_path, "source-a")
+    stat = (source_folder / "meta.json").stat()
+    os.utime(source_folder / "meta.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    assert Catalog(snapshot_file).lookup(source_folder) is None
+
+
+def test_removed_source(tmp_path):
+    snapshot_file = tmp_path / "catalog.msgpack"
+    source_folder = make_source(tmp_path, "source-a")
+    catalog = Catalog(snapshot_file)
+    catalog.store(source_folder, info_of(source_folder))
+    (source_folder / "meta.json").unlink()
+    assert catalog.lookup(source_folder) is None
+
+
+def test_prune_unseen(tmp_path):
+    snapshot_file = tmp_path / "catalog.msgpack"
+    kept = make_source(tmp_path, "source-a")
+    removed = make_source(tmp_path, "source-b")
+    catalog = Catalog(snapshot_file)
+    catalog.store(kept, info_of(kept))
+    catalog.store(removed, info_of(removed))
+    catalog.save()
+
+    catalog = Catalog(snapshot_file)
+    assert catalog.lookup(kept) is not None
+    catalog.prune_unseen()
+    catalog.save()
+
+    assert list(Catalog(snapshot_file).sources) == [Catalog.key(kept)]
+
+
+def test_save_only_when_changed(tmp_path):
+    snapshot_file = tmp_path / "catalog.msgpack"
+    Catalog(snapshot_file).save()
+    assert not snapshot_file.exists()
+
+
+def test_outdated_or_broken_snapshot_is_ignored(tmp_path, monkeypatch):
+    snapshot_file = tmp_path / "catalog.msgpack"
+    source_folder = make_source(tmp_path, "source-a")
+    catalog = Catalog(snapshot_file)
+    catalog.store(source_folder, info_of(source_folder))
+    catalog.save()
+
+    monkeypatch.setattr(catalog_module, "CATALOG_VERSION", catalog_module.CATALOG_VERSION + 1)
+    assert Catalog(snapshot_file).sources == {}
+
+    snapshot_file.write_bytes(b"not msgpack")
+    assert Catalog(snapshot_file).sources == {}
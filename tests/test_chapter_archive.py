@@ -0,0 +1,113 @@
+import json
+
+import pytest
+
+from lncrawl.bots.web2.flask_api import chapter_archive
+from lncrawl.bots.web2.flask_api.chapter_archive import (
+    ARCHIVE_NAME,
+    CODEC_ZLIB,
+    CODEC_ZSTD,
+    ChapterArchive,
+    ChapterArchiveError,
+)
+
+
+def chapter(number: int, body: str = "text") -> bytes:
+    return json.dumps({"id": number, "title": f"Chapter {number}", "body": body}).encode("utf-8")
+
+
+def write_json_folder(folder, numbers, body="text"):
+    folder.mkdir(parents=True, exist_ok=True)
+    for number in numbers:
+        (folder / f"{number:05d}.json").write_bytes(chapter(number, body))
+
+
+def test_write_and_read(tmp_path):
+    archive_file = tmp_path / ARCHIVE_NAME
+    chapters = [(n, chapter(n, "x" * n)) for n in (3, 1, 2, 10)]
+    assert chapter_archive.write_archive(archive_file, chapters, CODEC_ZLIB) == 4
+
+    archive = ChapterArchive(archive_file)
+    try:
+        assert archive.codec == CODEC_ZLIB
+        assert len(archive) == 4
+        assert 10 in archive and 4 not in archive
+        for number, data in chapters:
+            assert archive.read(number) == data
+        assert archive.read(4) is None
+    finally:
+        archive.close()
+
+
+def test_empty_archive(tmp_path):
+    archive_file = tmp_path / ARCHIVE_NAME
+    assert chapter_archive.write_archive(archive_file, [], CODEC_ZLIB) == 0
+    archive = ChapterArchive(archive_file)
+    try:
+        assert len(archive) == 0
+        assert archive.read(1) is None
+    finally:
+        archive.close()
+
+
+@pytest.mark.skipif(chapter_archive.zstandard is None, reason="zstandard is not installed")
+def test_zstd_codec(tmp_path):
+    archive_file = tmp_path / ARCHIVE_NAME
+    chapter_archive.write_archive(archive_file, [(1, chapter(1))], CODEC_ZSTD)
+    archive = ChapterArchive(archive_file)
+    try:
+        assert archive.codec == CODEC_ZSTD
+        assert archive.read(1) == chapter(1)
+    finally:
+        archive.close()
+
+
+def test_not_an_archive(tmp_path):
+    archive_file = tmp_path / ARCHIVE_NAME
+    archive_file.write_bytes(b"7z" + bytes(30))
+    with pytest.raises(ChapterArchiveError):
+        ChapterArchive(archive_file)
+
+
+def test_convert_source_from_json_folder(tmp_path):
+    write_json_folder(tmp_path / "json", range(1, 6))
+    (tmp_path / "json" / "cover.json").write_text("{}")  # not a chapter
+
+    assert chapter_archive.convert_source(tmp_path)
+    assert json.loads(chapter(3)) == chapter_archive.read_chapter(tmp_path, 3)
+    assert chapter_archive.read_chapter(tmp_path, 6) is None
+    assert len(chapter_archive.open_archive(tmp_path / ARCHIVE_NAME)) == 5
+
+
+def test_convert_source_without_chapters(tmp_path):
+    assert not chapter_archive.convert_source(tmp_path)
+    assert chapter_archive.read_chapter(tmp_path, 1) is None
+
+
+def test_merge_replaces_and_adds(tmp_path):
+    archive_file = tmp_path / ARCHIVE_NAME
+    chapter_archive.write_archive(archive_file, [(n, chapter(n, "old")) for n in (1, 2, 3)], CODEC_ZLIB)
+    write_json_folder(tmp_path / "json", (3, 4), body="new")
+
+    assert chapter_archive.merge_json_folder(tmp_path / "json", archive_file) == 4
+
+    archive = ChapterArchive(archive_file)
+    try:
+        assert archive.codec == CODEC_ZLIB
+        assert archive.read(1) == chapter(1, "old")
+        assert archive.read(2) == chapter(2, "old")
+        assert archive.read(3) == chapter(3, "new")
+        assert archive.read(4) == chapter(4, "new")
+    finally:
+        archive.close()
+
+
+def test_open_archive_reopens_a_changed_file(tmp_path):
+    archive_file = tmp_path / ARCHIVE_NAME
+    chapter_archive.write_archive(archive_file, [(1, chapter(1))], CODEC_ZLIB)
+    assert chapter_archive.read_chapter(tmp_path, 2) is None
+
+    write_json_folder(tmp_path / "json", (2,))
+    assert chapter_archive.convert_source(tmp_path)
+    assert chapter_archive.read_chapter(tmp_path, 2) == json.loads(chapter(2))
+    assert chapter_archive.read_chapter(tmp_path, 1) == json.loads(chapter(1))
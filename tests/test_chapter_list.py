@@ -0,0 +1,77 @@
+import json
+import os
+
+from lncrawl.bots.web2.flask_api import chapter_list
+from lncrawl.bots.web2.flask_api.chapter_list import FILE_NAME
+
+
+def write_meta(source_folder, count, old_format=False):
+    chapters = [{"id": n, "title": f"Chapter {n}"} for n in range(1, count + 1)]
+    data = {"chapters": chapters} if old_format else {"novel": {"chapters": chapters}}
+    source_folder.mkdir(parents=True, exist_ok=True)
+    (source_folder / "meta.json").write_text(json.dumps(data), encoding="utf-8")
+    return chapters
+
+
+def test_pages_round_trip(tmp_path):
+    chapters = write_meta(tmp_path, 250)
+    assert chapter_list.write_chapter_list(tmp_path) == 250
+
+    for page in range(3):
+        data, count, page_size = chapter_list.read_page(tmp_path, page)
+        assert (count, page_size) == (250, chapter_list.PAGE_SIZE)
+        assert json.loads(data) == chapters[page * page_size : (page + 1) * page_size]
+
+
+def test_page_out_of_range(tmp_path):
+    write_meta(tmp_path, 10)
+    assert chapter_list.read_page(tmp_path, 1) == (b"[]", 10, chapter_list.PAGE_SIZE)
+    assert chapter_list.read_page(tmp_path, -1) == (b"[]", 10, chapter_list.PAGE_SIZE)
+
+
+def test_no_chapters(tmp_path):
+    write_meta(tmp_path, 0)
+    assert chapter_list.read_page(tmp_path, 0) == (b"[]", 0, chapter_list.PAGE_SIZE)
+
+
+def test_old_meta_format(tmp_path):
+    chapters = write_meta(tmp_path, 5, old_format=True)
+    data, count, _ = chapter_list.read_page(tmp_path, 0)
+    assert count == 5
+    assert json.loads(data) == chapters
+
+
+def test_written_on_first_read_and_rebuilt_when_stale(tmp_path):
+    write_meta(tmp_path, 5)
+    assert not chapter_list.is_up_to_date(tmp_path)
+    chapter_list.read_page(tmp_path, 0)
+    assert chapter_list.is_up_to_date(tmp_path)
+
+    chapters = write_meta(tmp_path, 7)
+    # meta.json updated after the pages were written
+    stat = (tmp_path / FILE_NAME).stat()
+    os.utime(tmp_path / "meta.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert not chapter_list.is_up_to_date(tmp_path)
+
+    data, count, _ = chapter_list.read_page(tmp_path, 0)
+    assert count == 7
+    assert json.loads(data) == chapters
+
+
+def test_other_version_is_rewritten(tmp_path):
+    chapters = write_meta(tmp_path, 3)
+    chapter_list.write_chapter_list(tmp_path)
+    with open(tmp_path / FILE_NAME, "r+b") as f:
+        f.seek(4)
+        f.write(bytes([chapter_list.VERSION + 1]))
+
+    data, count, _ = chapter_list.read_page(tmp_path, 0)
+    assert count == 3
+    assert json.loads(data) == chapters
+
+
+def test_no_temporary_file_left(tmp_path):
+    write_meta(tmp_path, 3)
+    for _ in range(3):
+        chapter_list.write_chapter_list(tmp_path)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [FILE_NAME, "meta.json"]
@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from lncrawl.bots.web2.flask_api import comment_store
+from lncrawl.bots.web2.flask_api.comment_store import CommentNotFound, CommentStore
+
+
+def comment(comment_id, reply_to=None):
+    return {"id": comment_id, "content": f"comment {comment_id}", "reply_to": reply_to}
+
+
+def post_thread(store, path):
+    store.post(path, "source-a", comment("1"))
+    store.post(path, "source-a", comment("2", reply_to="1"))
+    store.post(path, "source-b", comment("3"))
+    store.react(path, "1", "alice", "like")
+    store.react(path, "1", "bob", "like")
+    store.react(path, "2", "alice", "dislike")
+    store.react(path, "1", "bob", "none")
+
+
+def assert_thread(rendered):
+    first, = rendered["source-a"]
+    assert (first["id"], first["likes"], first["dislikes"]) == ("1", 1, 0)
+    reply, = first["replies"]
+    assert (reply["id"], reply["likes"], reply["dislikes"]) == ("2", 0, 1)
+    assert [c["id"] for c in rendered["source-b"]] == ["3"]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "Novel" / "00001.json"
+
+
+def test_log_replay(path):
+    post_thread(CommentStore(), path)
+    assert not path.exists()
+    assert len(path.with_suffix(".log").read_text().splitlines()) == 7
+
+    assert_thread(CommentStore().page(path).render())
+
+
+def test_compaction(path, monkeypatch):
+    monkeypatch.setattr(comment_store, "COMPACT_EVENTS", 4)
+    store = CommentStore()
+    post_thread(store, path)
+
+    # Compacted after 4 events, the 3 others are in the log
+    assert path.exists()
+    assert len(path.with_suffix(".log").read_text().splitlines()) == 3
+    snapshot = json.loads(path.read_text())
+    assert snapshot["source-a"][0]["likes"] == ["alice"]
+
+    assert_thread(CommentStore().page(path).render())
+
+
+def test_replay_after_a_crash_during_compaction(path):
+    """The snapshot was written but the log was not emptied : its events are applied twice"""
+    store = CommentStore()
+    post_thread(store, path)
+    log = path.with_suffix(".log").read_bytes()
+    page = store.page(path)
+    with page.lock:
+        page.compact()
+    path.with_suffix(".log").write_bytes(log)
+
+    assert_thread(CommentStore().page(path).render())
+
+
+def test_line_cut_by_a_crash_is_skipped(path):
+    post_thread(CommentStore(), path)
+    with open(path.with_suffix(".log"), "ab") as f:
+        f.write(b'{"type": "reaction", "id": "3", "us')
+
+    page = CommentStore().page(path)
+    assert_thread(page.render())
+    assert page.log_events == 7
+
+
+def test_reply_to_unknown_comment(path):
+    store = CommentStore()
+    store.post(path, "source-a", comment("1"))
+    with pytest.raises(CommentNotFound):
+        store.post(path, "source-a", comment("2", reply_to="404"))
+    with pytest.raises(CommentNotFound):
+        store.react(path, "404", "alice", "like")
+    assert len(path.with_suffix(".log").read_text().splitlines()) == 1
+
+
+def test_shared_store_reads_the_other_writes(path, monkeypatch):
+    monkeypatch.setattr(comment_store, "COMPACT_EVENTS", 5)
+    owner = CommentStore()
+    reader = CommentStore(shared=True)
+    owner.post(path, "source-a", comment("1"))
+    assert len(reader.page(path).render()["source-a"]) == 1
+
+    # New lines of the log
+    owner.post(path, "source-a", comment("2", reply_to="1"))
+    owner.post(path, "source-b", comment("3"))
+    assert [c["id"] for c in reader.page(path).render()["source-b"]] == ["3"]
+
+    # Compacted by the owner
+    owner.react(path, "1", "alice", "like")
+    owner.react(path, "2", "alice", "dislike")
+    owner.react(path, "1", "bob", "like")
+    owner.react(path, "1", "bob", "none")
+    assert_thread(reader.page(path).render())
+
+
+def test_evicted_page_is_loaded_again(tmp_path):
+    store = CommentStore(max_pages=1)
+    first, second = tmp_path / "00001.json", tmp_path / "00002.json"
+    post_thread(store, first)
+    store.post(second, "source-a", comment("1"))
+    store.react(first, "3", "carol", "like")
+
+    rendered = store.page(first).render()
+    assert_thread(rendered)
+    assert rendered["source-b"][0]["likes"] == 1
@@ -0,0 +1,110 @@
+import difflib
+import random
+
+import pytest
+
+from lncrawl.bots.web2.flask_api import sanatize
+from lncrawl.bots.web2.flask_api.Novel import Novel
+from lncrawl.bots.web2.flask_api.search_index import SearchIndex
+
+SYLLABLES = ["sla", "ime", "awa", "ken", "ing", "dra", "gon", "mage", "sword", "lord", "re", "in", "car", "na", "tion"]
+
+
+def old_search(novels, query):
+    """/api/search before the index : every query word against the words of every novel"""
+    query = sanatize.sanitize(query).split(" ")
+    ratio = []
+    for novel in novels:
+        count = 0
+        for query_search_word in query:
+            similarity_found = False
+            for downloaded_search_word in novel.search_words:
+                if difflib.SequenceMatcher(None, query_search_word, downloaded_search_word).ratio() > 0.75:
+                    similarity_found = True
+                    break
+                elif query_search_word in downloaded_search_word:
+                    similarity_found = True
+                    break
+            if similarity_found:
+                count += 1
+            else:
+                count -= 2
+        if count > 0:
+            ratio.append((novel, count))
+    ratio.sort(key=lambda x: x[1], reverse=True)
+    return ratio[:20]
+
+
+def random_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+
+def typo(rng, word):
+    i = rng.randrange(len(word))
+    return word[:i] + rng.choice("aeiouxyz") + word[i + 1 :]
+
+
+@pytest.fixture(scope="module")
+def novels(tmp_path_factory):
+    rng = random.Random(42)
+    library = tmp_path_factory.mktemp("library")
+    novels = []
+    for rank in range(1, 201):
+        title = " ".join(random_word(rng) for _ in range(rng.randint(1, 4)))
+        author = random_word(rng).capitalize()
+        novels.append(Novel(path=library / f"{title} {rank}", title=title, author=author, rank=rank))
+    # database.all_novels was sorted by rank
+    return novels
+
+
+@pytest.fixture(scope="module")
+def queries(novels):
+    rng = random.Random(7)
+    queries = ["slime", "Awakening", "awak", "re:zero", "a", "lord lord", "dragon-mage", "zzzz"]
+    for _ in range(80):
+        words = rng.choice(novels).search_words
+        query = [rng.choice(words) for _ in range(rng.randint(1, 3))]
+        if rng.random() < 0.5:
+            query = [typo(rng, word) for word in query]
+        if rng.random() < 0.3:
+            query.append(random_word(rng))
+        queries.append(" ".join(query))
+    return queries
+
+
+def as_titles(results):
+    return [(novel.title, score) for novel, score in results]
+
+
+def test_same_results_as_the_old_search(novels, queries):
+    index = SearchIndex()
+    index.rebuild(novels)
+    for query in queries:
+        assert as_titles(index.search(query)) == as_titles(old_search(novels, query)), query
+
+
+def test_added_and_removed_novels(novels, queries):
+    index = SearchIndex()
+    index.rebuild(novels[:150])
+    for query in queries[:40]:
+        index.search(query)  # fills the cache of the matching words
+
+    for novel in novels[150:]:
+        index.add(novel)
+    for novel in novels[:70]:
+        index.remove(novel)
+    assert len(index) == 130
+    for query in queries:
+        assert as_titles(index.search(query)) == as_titles(old_search(novels[70:], query)), query
+
+
+def test_renamed_novel(tmp_path):
+    novel = Novel(path=tmp_path / "novel", title="Slime Tensei", author="Fuse", rank=1)
+    index = SearchIndex()
+    index.add(novel)
+    assert as_titles(index.search("slime")) == [("Slime Tensei", 1)]
+
+    novel.title = "Mushoku Tensei"
+    index.add(novel)
+    assert index.search("slime") == []
+    assert as_titles(index.search("mushoku")) == [("Mushoku Tensei", 1)]
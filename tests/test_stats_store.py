@@ -0,0 +1,162 @@
+import json
+
+import pytest
+
+from lncrawl.bots.web2.flask_api import datetools
+from lncrawl.bots.web2.flask_api.Novel import Novel, NovelFromSource
+from lncrawl.bots.web2.flask_api.ratings import Ratings
+from lncrawl.bots.web2.flask_api.stats_store import StatsStore
+
+USER = "ab" * 32
+
+
+def load_novel(novel_folder) -> Novel:
+    """The stats part of read_novel_info.get_novel_info"""
+    stats_file = novel_folder / "stats.json"
+    stats = json.loads(stats_file.read_text()) if stats_file.exists() else {}
+    novel = Novel(
+        path=novel_folder,
+        title=novel_folder.name,
+        clicks=stats.get("clicks", {}),
+        ratings=Ratings(stats.get("ratings", {})),
+        comment_count=stats.get("comment_count", 0),
+        stats_seq=stats.get("journal_seq", 0),
+    )
+    source = NovelFromSource(path=novel_folder / "source")
+    source.source_rating = stats.get("source_ratings", {}).get(source.slug, 0)
+    source.novel = novel
+    novel.sources = [source]
+    return novel
+
+
+@pytest.fixture
+def library(tmp_path):
+    for name in ("Novel A", "Novel B"):
+        (tmp_path / name).mkdir()
+    return tmp_path
+
+
+def open_store(library):
+    """A store after a restart, with the novels read from their stats.json"""
+    novels = {name: load_novel(library / name) for name in ("Novel A", "Novel B")}
+    by_folder = {novel.cleaned_folder_name: novel for novel in novels.values()}
+    store = StatsStore(library / "stats.journal", flush_threshold=1000)
+    applied = store.replay(list(novels.values()), by_folder.get)
+    return store, novels, applied
+
+
+def play_events(store, novels):
+    a, b = novels["Novel A"], novels["Novel B"]
+    store.click(a)
+    store.click(a)
+    store.rate(a, USER, 4)
+    store.add_comment(b)
+    store.rate_source(b.sources[0], 1)
+    store.rate(a, USER, 2)
+
+
+def assert_events_applied(novels):
+    a, b = novels["Novel A"], novels["Novel B"]
+    assert a.clicks == {datetools.current_week(): 2}
+    assert a.ratings.get(USER) == 2 and len(a.ratings) == 1
+    assert b.comment_count == 1
+    assert b.sources[0].source_rating == 1
+
+
+def journal_files(library):
+    return sorted(p.name for p in library.glob("stats.journal*"))
+
+
+def test_replay_after_crash(library):
+    store, novels, _ = open_store(library)
+    play_events(store, novels)
+    # Killed before any flush : only the journal has the events
+    assert not (library / "Novel A" / "stats.json").exists()
+
+    store, novels, applied = open_store(library)
+    assert applied == 6
+    assert_events_applied(novels)
+    # The replay flushes : the journal is no longer needed
+    assert journal_files(library) == []
+    assert all(novel.stats_seq == 6 for novel in novels.values())
+
+
+def test_flush_then_restart(library):
+    store, novels, _ = open_store(library)
+    play_events(store, novels)
+    store.flush()
+    assert len(store) == 0
+    assert journal_files(library) == []
+
+    store, novels, applied = open_store(library)
+    assert applied == 0
+    assert_events_applied(novels)
+
+
+def test_events_after_flush_go_to_a_new_segment(library):
+    store, novels, _ = open_store(library)
+    store.click(novels["Novel A"])
+    store.flush()
+    store.click(novels["Novel A"])
+    assert journal_files(library) == ["stats.journal"]
+
+    store, novels, applied = open_store(library)
+    assert applied == 1
+    assert novels["Novel A"].clicks == {datetools.current_week(): 2}
+
+
+def test_failed_flush_keeps_the_segment(library):
+    store, novels, _ = open_store(library)
+    play_events(store, novels)
+    # stats.json of B cannot be written
+    (library / "Novel B" / "stats.json").mkdir()
+    store.flush()
+
+    assert journal_files(library) == ["stats.journal.6"]
+    assert novels["Novel A"].stats_seq == 6
+    assert len(store) == 1
+
+    (library / "Novel B" / "stats.json").rmdir()
+    store, novels, applied = open_store(library)
+    # Only the events of B : A already has them in its stats.json
+    assert applied == 2
+    assert_events_applied(novels)
+    assert journal_files(library) == []
+
+
+def test_segments_replayed_in_order(library):
+    store, novels, _ = open_store(library)
+    (library / "Novel B" / "stats.json").mkdir()
+    store.rate(novels["Novel B"], USER, 5)
+    store.flush()
+    store.rate(novels["Novel B"], USER, 1)
+    store.flush()
+    assert journal_files(library) == ["stats.journal.1", "stats.journal.2"]
+
+    (library / "Novel B" / "stats.json").rmdir()
+    store, novels, applied = open_store(library)
+    assert applied == 2
+    assert novels["Novel B"].ratings.get(USER) == 1
+
+
+def test_line_cut_by_a_crash_is_skipped(library):
+    store, novels, _ = open_store(library)
+    store.click(novels["Novel A"])
+    with open(library / "stats.journal", "ab") as f:
+        f.write(b'[2,"novel a","cli')
+
+    store, novels, applied = open_store(library)
+    assert applied == 1
+    assert novels["Novel A"].clicks == {datetools.current_week(): 1}
+
+
+def test_unknown_novel_is_dropped(library):
+    store, novels, _ = open_store(library)
+    store.click(novels["Novel A"])
+    store.click(novels["Novel B"])
+    with open(library / "stats.journal", "ab") as f:
+        f.write(b'[3,"removed novel","click","1",1]\n')
+
+    store, novels, applied = open_store(library)
+    assert applied == 2
+    assert journal_files(library) == []
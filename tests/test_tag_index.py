@@ -0,0 +1,134 @@
+import random
+
+import pytest
+
+from lncrawl.bots.web2.flask_api import sort_orders
+from lncrawl.bots.web2.flask_api.Novel import Novel
+from lncrawl.bots.web2.flask_api.sort_orders import SortedOrder
+from lncrawl.bots.web2.flask_api.tag_index import TagIndex, parse_tags
+
+TAGS = ["Action", "Romance", "Slice of Life", "Comedy", "Isekai", "Rare-Tag"]
+QUERIES = [
+    "Action",
+    "rare tag",
+    "Unknown",
+    "Action,Comedy",
+    "Action,-Romance",
+    "-Action",
+    "-Action,-Comedy",
+    "Isekai,Rare-Tag,-Comedy",
+    "Action,Unknown",
+]
+
+
+def make_novels(tmp_path, count, seed=0):
+    rng = random.Random(seed)
+    novels = []
+    for i in range(count):
+        tags = {tag for tag in TAGS[:-1] if rng.random() < 0.4}
+        if rng.random() < 0.03:
+            tags.add(TAGS[-1])
+        novel = Novel(path=tmp_path / f"novel {i}", title=f"Novel {i}", tags=tags)
+        novel.chapter_count = rng.randint(0, 50)  # many ties
+        novels.append(novel)
+    return novels
+
+
+def make_order():
+    return SortedOrder(lambda novel: (-novel.chapter_count,), lambda novel: novel.sanatized_tag_set)
+
+
+def expected(order, tags, reverse):
+    """Read the whole order then filter it, like before the index"""
+    include = {t for t in tags if not t.startswith("-")}
+    exclude = {t[1:] for t in tags if t.startswith("-")}
+    return [
+        novel
+        for novel in order.slice(0, len(order), reverse)
+        if include <= novel.sanatized_tag_set and not exclude & novel.sanatized_tag_set
+    ]
+
+
+@pytest.fixture
+def library(tmp_path):
+    novels = make_novels(tmp_path, 600)
+    order = make_order()
+    order.rebuild(novels)
+    index = TagIndex()
+    index.rebuild((novel, novel.tags) for novel in novels)
+    return novels, order, index
+
+
+def assert_pages(order, index):
+    for query in QUERIES:
+        tags = parse_tags(query)
+        for reverse in (False, True):
+            matching = expected(order, tags, reverse)
+            for start in (0, 7, 100, 590, 1000):
+                page, total = index.page(tags, order.view(reverse), start, start + 20)
+                assert total == len(matching), query
+                assert page == matching[start : start + 20], (query, reverse, start)
+
+
+def test_parse_tags():
+    assert parse_tags("Action,-Slice_of-Life") == ["ACTION", "-SLICE OF LIFE"]
+
+
+def test_pages_match_a_filtered_sort(library):
+    novels, order, index = library
+    # A stable sort of the library
+    assert order.slice(0, len(order)) == sorted(novels, key=order.key_function)
+    assert_pages(order, index)
+
+
+def test_pages_after_updates(library, tmp_path):
+    novels, order, index = library
+    rng = random.Random(1)
+    for novel in rng.sample(novels, 100):
+        novel.chapter_count = rng.randint(0, 50)
+        order.update(novel)
+    for novel in rng.sample(novels, 100):
+        novel.tags = {tag for tag in TAGS if rng.random() < 0.5}
+        order.update(novel)
+        index.add(novel, novel.tags)
+    for novel in novels[:50]:
+        order.remove(novel)
+        index.remove(novel)
+    added = make_novels(tmp_path / "added", 50, seed=2)
+    for novel in added:
+        order.add(novel)
+        index.add(novel, novel.tags)
+
+    assert len(order) == len(index) == 600
+    assert_pages(order, index)
+
+
+def test_label_lists_follow_the_order(library):
+    novels, order, _ = library
+    action = [novel for novel in order.iterate() if "ACTION" in order.labels(novel)]
+    assert order.count("ACTION") == len(action)
+    assert order.slice(0, len(action), label="ACTION") == action
+    assert order.slice(0, 10, reverse=True, label="ACTION") == action[::-1][:10]
+    assert order.count("UNKNOWN") == 0 and order.slice(0, 10, label="UNKNOWN") == []
+
+
+def test_iterate_by_chunks(library, monkeypatch):
+    novels, order, _ = library
+    monkeypatch.setattr(sort_orders, "ITER_CHUNK", 64)
+    assert list(order.iterate()) == order.slice(0, len(order))
+    assert list(order.iterate(reverse=True)) == order.slice(0, len(order), reverse=True)
+    assert [order.index(novel) for novel in order.iterate()] == list(range(len(order)))
+
+
+def test_ties_keep_insertion_order(tmp_path):
+    novels = make_novels(tmp_path, 100)
+    for novel in novels:
+        novel.chapter_count = 1
+    order = make_order()
+    order.rebuild(novels)
+    assert order.slice(0, 100) == novels
+
+    # An updated item keeps its place among the ties
+    novels[10].tags = {"Comedy"}
+    order.update(novels[10])
+    assert order.slice(0, 100) == novels
@@ -0,0 +1,107 @@
+"""
+Helpers shared by the benchmarks.
+
+Run the benchmarks from the root of the repository :
+    python website_scripts/benchmarks/<benchmark>.py
+"""
+import importlib
+import json
+import random
+import sys
+import time
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+WORDS = (
+    "slime reincarnated sword demon king hero academy villainess dragon mage shadow "
+    "emperor cultivation system return saint tower dungeon prince witch sect god "
+    "immortal blade abyss knight princess regression genius archmage level"
+).split()
+TAGS = ["Action", "Fantasy", "Romance", "Comedy", "Drama", "Isekai", "Harem", "Martial Arts", "Mystery", "Tragedy"]
+
+
+def import_web2(module: str):
+    """
+    Import a module of lncrawl.bots.web2.flask_api without running the package
+    __init__ : it would start the whole website (lib.py) on import.
+    """
+    web2 = ROOT / "lncrawl" / "bots" / "web2"
+    for name, path in (
+        ("lncrawl.bots.web2", web2),
+        ("lncrawl.bots.web2.flask_api", web2 / "flask_api"),
+    ):
+        if name not in sys.modules:
+            package = types.ModuleType(name)
+            package.__path__ = [str(path)]
+            sys.modules[name] = package
+    return importlib.import_module(f"lncrawl.bots.web2.flask_api.{module}")
+
+
+def random_title(rng: random.Random, i: int) -> str:
+    return " ".join(rng.sample(WORDS, 3)) + f" {i}"
+
+
+def make_library(folder: Path, novels: int, chapters: int = 200, seed: int = 0):
+    """Write a synthetic library with the same layout as the real one"""
+    rng = random.Random(seed)
+    folder.mkdir(parents=True, exist_ok=True)
+    for i in range(novels):
+        title = random_title(rng, i)
+        novel_folder = folder / title
+        for s in range(rng.randint(1, 3)):
+            source_folder = novel_folder / f"source{s}-com"
+            source_folder.mkdir(parents=True, exist_ok=True)
+            chapter_list = [
+                {
+                    "id": c,
+                    "url": f"https://source{s}.com/{i}/chapter-{c}",
+                    "title": f"Chapter {c}",
+                    "volume": 1 + c // 100,
+                    "volume_title": f"Volume {1 + c // 100}",
+                    "success": True,
+                    "images": {},
+                }
+                for c in range(1, rng.randint(chapters // 2, chapters * 2))
+            ]
+            meta = {
+                "novel": {
+                    "url": f"https://source{s}.com/{i}",
+                    "title": title,
+                    "authors": [f"Author {i % 500}"],
+                    "cover_url": "",
+                    "chapters": chapter_list,
+                    "volumes": [{"id": v} for v in range(1 + len(chapter_list) // 100)],
+                    "language": "en",
+                    "synopsis": "A synthetic novel. " * 20,
+                    "novel_tags": rng.sample(TAGS, 3),
+                },
+                "session": {"user_input": None, "output_path": str(source_folder)},
+                "last_update_date": f"2023-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}T00:00:00",
+            }
+            with open(source_folder / "meta.json", "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        with open(novel_folder / "stats.json", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "clicks": {"1234": rng.randint(0, 1000)},
+                    "ratings": {"admin": rng.randint(1, 5)},
+                    "comment_count": 0,
+                    "source_ratings": {},
+                },
+                f,
+            )
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
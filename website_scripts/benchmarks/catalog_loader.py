@@ -0,0 +1,42 @@
+"""
+Benchmark of the library loading : serial vs parallel cold rebuild, and warm start from the snapshot.
+
+    python website_scripts/benchmarks/catalog_loader.py [novels] [processes]
+"""
+import sys
+import tempfile
+from pathlib import Path
+
+from _common import import_web2, make_library, timed
+
+catalog = import_web2("catalog")
+loader = import_web2("loader")
+
+
+def main():
+    novels = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library = Path(tmp) / "Lightnovels"
+        print(f"Generating a synthetic library of {novels} novels...")
+        make_library(library, novels)
+
+        results = []
+        for name, snapshot, procs in (
+            ("cold, serial", "serial.msgpack", 1),
+            ("cold, parallel", "parallel.msgpack", processes),
+            ("warm, from snapshot", "parallel.msgpack", processes),
+        ):
+            cat = catalog.Catalog(Path(tmp) / snapshot)
+            loaded, duration = timed(loader.load_novels, library, cat, procs)
+            cat.save()
+            results.append((name, len(loaded), duration))
+
+        print()
+        for name, count, duration in results:
+            print(f"{name:<22} {count:>7} novels in {duration:7.2f}s : {count / duration:9.0f} novels/s")
+
+
+if __name__ == "__main__":
+    main()
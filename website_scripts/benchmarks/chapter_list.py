@@ -0,0 +1,71 @@
+"""
+Latency of a /api/chapterlist/ page : full meta.json load vs the precomputed pages.
+
+    python website_scripts/benchmarks/chapter_list.py [reads]
+"""
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from _common import import_web2, percentile
+
+chapter_list = import_web2("chapter_list")
+
+
+def legacy_page(source_folder: Path, page: int):
+    """Copy of the chapter list read before the pages"""
+    with open(source_folder / "meta.json", "r", encoding="utf-8") as f:
+        data = json.load(f)
+        chapters = data["novel"]["chapters"] if "novel" in data else data["chapters"]
+    return chapters[page * 100 : (page + 1) * 100], len(chapters)
+
+
+def latencies(function, pages):
+    durations = []
+    for page in pages:
+        started = time.perf_counter()
+        function(page)
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def main():
+    reads = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+
+    for size in (100, 1000, 5000, 20000):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp)
+            chapters = [
+                {
+                    "id": c,
+                    "url": f"https://source.com/novel/chapter-{c}",
+                    "title": f"Chapter {c} : the title of the chapter {c}",
+                    "volume": 1 + c // 100,
+                    "volume_title": f"Volume {1 + c // 100}",
+                    "success": True,
+                    "images": {},
+                }
+                for c in range(1, size + 1)
+            ]
+            with open(source / "meta.json", "w", encoding="utf-8") as f:
+                json.dump({"novel": {"chapters": chapters}, "session": {"user_input": None}}, f, indent=4)
+            chapter_list.write_chapter_list(source)
+
+            pages = [rng.randrange(size // 100) for _ in range(reads)]
+            for page in pages[:10]:
+                content, count, _ = chapter_list.read_page(source, page)
+                assert (json.loads(content), count) == legacy_page(source, page)
+
+            legacy = latencies(lambda p: legacy_page(source, p), pages)
+            precomputed = latencies(lambda p: chapter_list.read_page(source, p), pages)
+            print(f"{size} chapters")
+            print(f"    meta.json p50 {percentile(legacy, 50):8.3f}ms  p99 {percentile(legacy, 99):8.3f}ms")
+            print(f"    pages     p50 {percentile(precomputed, 50):8.3f}ms  p99 {percentile(precomputed, 99):8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Latency of a chapter read : 7z subprocess (old path) vs the chapter archive.
+
+    python website_scripts/benchmarks/chapter_read.py [chapters] [reads]
+
+The 7z path is skipped if 7z is not installed.
+"""
+import json
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from _common import WORDS, import_web2, percentile, timed
+
+chapter_archive = import_web2("chapter_archive")
+
+
+def make_chapters(json_folder: Path, chapters: int, rng: random.Random):
+    json_folder.mkdir(parents=True)
+    for c in range(1, chapters + 1):
+        body = "".join(
+            "<p>" + " ".join(rng.choices(WORDS, k=rng.randint(20, 60))) + ".</p>"
+            for _ in range(rng.randint(40, 120))
+        )
+        with open(json_folder / f"{c:05}.json", "w", encoding="utf-8") as f:
+            json.dump({"id": c, "title": f"Chapter {c}", "body": body, "volume": 1 + c // 100}, f)
+
+
+def read_7z(tar_file_path: Path, chapter: int):
+    result = subprocess.run(["7z", "e", tar_file_path, "-so", f"json/{chapter:05}.json"], capture_output=True)
+    return json.loads(result.stdout.decode("utf-8"))
+
+
+def latencies(function, numbers):
+    durations = []
+    for number in numbers:
+        started = time.perf_counter()
+        function(number)
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def main():
+    chapters = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    reads = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "source"
+        make_chapters(source / "json", chapters, rng)
+        json_size = sum(f.stat().st_size for f in (source / "json").iterdir())
+
+        _, duration = timed(chapter_archive.convert_source, source)
+        archive_file = source / chapter_archive.ARCHIVE_NAME
+        print(f"{chapters} chapters, json {json_size / 1e6:.1f}MB")
+        print(f"    archive {archive_file.stat().st_size / 1e6:.1f}MB written in {duration:.2f}s")
+
+        numbers = [rng.randint(1, chapters) for _ in range(reads)]
+        for number in numbers[:20]:
+            with open(source / "json" / f"{number:05}.json", "r", encoding="utf-8") as f:
+                assert chapter_archive.read_chapter(source, number) == json.load(f)
+
+        results = {"archive": latencies(lambda n: chapter_archive.read_chapter(source, n), numbers)}
+
+        if shutil.which("7z"):
+            tar_file_path = source / "json.7z"
+            subprocess.run(["7z", "a", tar_file_path, "json", "-mx=5", "-m0=LZMA2", "-bso0"], cwd=source, check=True)
+            print(f"    json.7z {tar_file_path.stat().st_size / 1e6:.1f}MB")
+            results["7z"] = latencies(lambda n: read_7z(tar_file_path, n), numbers[: max(1, reads // 10)])
+        else:
+            print("    7z not installed, 7z path skipped")
+
+        for name, durations in results.items():
+            print(f"    {name:<8} p50 {percentile(durations, 50):8.3f}ms  p99 {percentile(durations, 99):8.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
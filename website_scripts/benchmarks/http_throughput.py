@@ -0,0 +1,73 @@
+"""
+Requests per second of the read endpoints of a running website.
+
+Start the website with api_workers set to 1, 2, 4... in config.json (dev_mode
+"false"), then run :
+    python website_scripts/benchmarks/http_throughput.py [api url] [seconds] [clients]
+
+The clients are processes : run them on another machine, or leave enough cores
+to the workers, else the clients are the bottleneck.
+"""
+import multiprocessing
+import sys
+import time
+
+import requests
+
+from _common import percentile
+
+PATHS = [
+    "/api/novels?number=20&sort=views",
+    "/api/novels?number=20&page=3&sort=title",
+    "/api/sources?number=20&sort=last_updated-reverse",
+    "/api/toptags",
+    "/api/search/?query=sword+demon",
+]
+
+
+def client(api_url: str, seconds: float, results):
+    session = requests.Session()
+    durations = []
+    errors = 0
+    end = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < end:
+        started = time.perf_counter()
+        # No If-None-Match : every request gets a body
+        response = session.get(api_url + PATHS[i % len(PATHS)], headers={"Accept-Encoding": "gzip"})
+        durations.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            errors += 1
+        i += 1
+    results.put((durations, errors))
+
+
+def main():
+    api_url = sys.argv[1] if len(sys.argv) > 1 else "http://localhost:5000"
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    clients = int(sys.argv[3]) if len(sys.argv) > 3 else multiprocessing.cpu_count()
+
+    for path in PATHS:
+        requests.get(api_url + path).raise_for_status()
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=client, args=(api_url, seconds, results))
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    durations, errors = [], 0
+    for _ in processes:
+        client_durations, client_errors = results.get()
+        durations += client_durations
+        errors += client_errors
+    for process in processes:
+        process.join()
+
+    print(f"{clients} clients, {seconds}s : {len(durations) / seconds:.0f} requests/s, {errors} errors")
+    print(f"    p50 {percentile(durations, 50):.2f}ms  p99 {percentile(durations, 99):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
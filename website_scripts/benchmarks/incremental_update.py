@@ -0,0 +1,51 @@
+"""
+Cost of an update adding a few chapters to a long source : merge of the new
+chapter files into the chapter archive, vs the full rewrite of the archive from
+every chapter file (what an update did after extracting json.7z).
+
+    python website_scripts/benchmarks/incremental_update.py [chapters] [new chapters]
+"""
+import random
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+from _common import import_web2, timed
+from chapter_read import make_chapters
+
+chapter_archive = import_web2("chapter_archive")
+
+
+def main():
+    chapters = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    new = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp) / "source"
+        make_chapters(source / "json", chapters + new, rng)
+        # Downloaded source : every chapter in the archive, only the new ones in the json folder
+        new_folder = Path(tmp) / "new"
+        new_folder.mkdir()
+        for c in range(chapters + 1, chapters + new + 1):
+            shutil.move(source / "json" / f"{c:05}.json", new_folder)
+        chapter_archive.convert_json_folder(source / "json", source / chapter_archive.ARCHIVE_NAME)
+        full_folder = Path(tmp) / "full"
+        shutil.move(source / "json", full_folder)
+        for file in new_folder.iterdir():
+            shutil.copy(file, full_folder)
+        shutil.move(new_folder, source / "json")
+
+        archive_file = source / chapter_archive.ARCHIVE_NAME
+        count, merge_duration = timed(chapter_archive.merge_json_folder, source / "json", archive_file)
+        assert count == chapters + new
+        _, full_duration = timed(chapter_archive.convert_json_folder, full_folder, Path(tmp) / "full.lnca")
+
+    print(f"{chapters} chapters, {new} new")
+    print(f"    merge        {merge_duration * 1000:8.1f}ms")
+    print(f"    full rewrite {full_duration * 1000:8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Cost of the slug / path lookups used by every novel, chapter and rating request,
+old linear scans vs the lookup maps of database.py, as the catalog grows.
+
+    python website_scripts/benchmarks/lookups.py
+"""
+import random
+import time
+import urllib.parse
+from pathlib import Path
+
+from _common import import_web2, random_title
+
+Novel_module = import_web2("Novel")
+database = import_web2("database")
+utils = import_web2("utils")
+naming_rules = import_web2("naming_rules")
+
+LOOKUPS = 200
+
+
+def legacy_get_source_with_slugs(novel_slug, source_slug):
+    """Copy of the linear scan before the lookup maps"""
+    novel_name = naming_rules.clean_name(urllib.parse.unquote_plus(novel_slug))
+    novel = next((n for n in database.all_novels if n.cleaned_folder_name == novel_name), None)
+    if not novel:
+        return None
+    for source in novel.sources:
+        if source.slug == source_slug:
+            return source
+    return None
+
+
+def per_lookup_us(function, keys):
+    started = time.perf_counter()
+    for key in keys:
+        function(*key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def main():
+    rng = random.Random(0)
+    library = Path("Lightnovels").absolute()
+    print(f"{'novels':>8} {'legacy (us)':>14} {'maps (us)':>12}")
+    for size in (1_000, 10_000, 100_000):
+        novels = []
+        for i in range(size):
+            novel = Novel_module.Novel(path=library / random_title(rng, i), title=str(i))
+            novel.sources = [Novel_module.NovelFromSource(path=novel.path / "source-com")]
+            for source in novel.sources:
+                source.novel = novel
+            novels.append(novel)
+
+        database.all_novels = novels
+        database.novels_by_slug.clear()
+        database.sources_by_slugs.clear()
+        database.sources_by_path.clear()
+        for novel in novels:
+            database.index_novel(novel)
+
+        keys = [(n.slug, "source-com") for n in rng.sample(novels, LOOKUPS)]
+        legacy = per_lookup_us(legacy_get_source_with_slugs, keys[: max(5, LOOKUPS * 1000 // size)])
+        indexed = per_lookup_us(utils.get_source_with_slugs, keys)
+        print(f"{size:>8} {legacy:>14.1f} {indexed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Memory of the novels loaded from a library, and cost of the attributes read by
+the request handlers (slug, tags filter, ratings, asdict...).
+
+    python website_scripts/benchmarks/novel_model.py [novels] [ratings per novel]
+"""
+import hashlib
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from _common import import_web2, make_library
+
+read_novel_info = import_web2("read_novel_info")
+
+ATTRIBUTES = [
+    "slug",
+    "cleaned_folder_name",
+    "sanatized_tags",
+    "search_words",
+    "overall_rating",
+    "ratings_count",
+    "current_week_clicks",
+]
+
+
+def add_ratings(library: Path, per_novel: int, seed: int = 0):
+    """Ratings keyed by hashed ips, as written by the website"""
+    rng = random.Random(seed)
+    for stats_file in library.glob("*/stats.json"):
+        with open(stats_file, encoding="utf-8") as f:
+            stats = json.load(f)
+        for _ in range(rng.randint(0, per_novel * 2)):
+            user = hashlib.sha256(str(rng.random()).encode()).hexdigest()
+            stats["ratings"][user] = rng.randint(1, 5)
+        with open(stats_file, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+
+
+def per_access_ns(novels, attribute: str, rounds: int = 5) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for novel in novels:
+            getattr(novel, attribute)
+        best = min(best, time.perf_counter() - started)
+    return best / len(novels) * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ratings = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library = Path(tmp) / "Lightnovels"
+        make_library(library, count, chapters=4)
+        add_ratings(library, ratings)
+        folders = sorted(folder for folder in library.iterdir() if folder.is_dir())
+
+        tracemalloc.start()
+        novels = [read_novel_info.get_novel_info(folder) for folder in folders]
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    sources = sum(len(novel.sources) for novel in novels)
+    print(f"{count} novels, {sources} sources, ~{ratings} ratings per novel")
+    print(f"    memory : {memory / count:.0f} bytes per novel (sources and stats included)")
+    for attribute in ATTRIBUTES:
+        print(f"    {attribute:<20} {per_access_ns(novels, attribute):8.0f} ns")
+    started = time.perf_counter()
+    for novel in novels:
+        novel.asdict()
+    print(f"    {'asdict()':<20} {(time.perf_counter() - started) / count * 1e9:8.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Latency of /api/search : old difflib loop vs the search index, at 10k and 100k novels.
+
+    python website_scripts/benchmarks/search.py [queries]
+"""
+import difflib
+import random
+import sys
+import time
+from pathlib import Path
+
+from _common import WORDS, import_web2, percentile, random_title
+
+Novel = import_web2("Novel").Novel
+search_index = import_web2("search_index")
+sanatize = import_web2("sanatize")
+
+# Only a few queries for the old loop, it takes seconds per query at 100k novels
+LEGACY_QUERIES = 5
+
+
+def legacy_search(novels, query):
+    """Copy of the search loop before the index"""
+    query = sanatize.sanitize(query).split(" ")
+    ratio = []
+    for novel in novels:
+        count = 0
+        for query_search_word in query:
+            similarity_found = False
+            for downloaded_search_word in novel.search_words:
+                if difflib.SequenceMatcher(None, query_search_word, downloaded_search_word).ratio() > 0.75:
+                    similarity_found = True
+                    break
+                elif query_search_word in downloaded_search_word:
+                    similarity_found = True
+                    break
+            if similarity_found:
+                count += 1
+            else:
+                count -= 2
+        if count > 0:
+            ratio.append((novel, count))
+    ratio.sort(key=lambda x: x[1], reverse=True)
+    return ratio[:20]
+
+
+def make_query(rng: random.Random) -> str:
+    words = rng.sample(WORDS, rng.randint(1, 3))
+    # Typo in some of the words
+    words = [
+        w[: i] + w[i + 1 :] if (i := rng.randrange(len(w))) and rng.random() < 0.3 else w
+        for w in words
+    ]
+    return " ".join(words)
+
+
+def latencies(function, queries):
+    durations = []
+    for query in queries:
+        started = time.perf_counter()
+        function(query)
+        durations.append((time.perf_counter() - started) * 1000)
+    return durations
+
+
+def main():
+    number_of_queries = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rng = random.Random(0)
+
+    for size in (10_000, 100_000):
+        novels = []
+        for i in range(size):
+            title = random_title(rng, i)
+            novels.append(
+                Novel(path=Path("Lightnovels") / title, title=title, author=f"Author {i % 500}", rank=i + 1)
+            )
+
+        index = search_index.SearchIndex()
+        started = time.perf_counter()
+        index.rebuild(novels)
+        build = time.perf_counter() - started
+
+        queries = [make_query(rng) for _ in range(number_of_queries)]
+        indexed = latencies(index.search, queries)
+        legacy = latencies(lambda q: legacy_search(novels, q), queries[:LEGACY_QUERIES])
+
+        for query in queries[:LEGACY_QUERIES]:
+            assert [n.title for n, _ in legacy_search(novels, query)] == [
+                n.title for n, _ in index.search(query)
+            ], query
+
+        print(f"{size} novels (index built in {build:.2f}s)")
+        print(f"    legacy  p50 {percentile(legacy, 50):9.2f}ms  p99 {percentile(legacy, 99):9.2f}ms")
+        print(f"    indexed p50 {percentile(indexed, 50):9.2f}ms  p99 {percentile(indexed, 99):9.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
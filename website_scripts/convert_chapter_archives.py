@@ -0,0 +1,37 @@
+"""
+Write the chapter archive (chapters.lnca) of every source of the library,
+from its json folder or its json.7z. Sources already converted are skipped.
+
+    python website_scripts/convert_chapter_archives.py [path to Lightnovels]
+
+The website does it in the background at startup when compression is enabled,
+this script is for converting a whole library at once.
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "benchmarks"))
+from _common import import_web2  # noqa: E402
+
+chapter_archive = import_web2("chapter_archive")
+
+library = Path(sys.argv[1]) if len(sys.argv) > 1 else Path("../Lightnovels")
+
+done = failed = skipped = 0
+for novel in sorted(library.iterdir()):
+    if not novel.is_dir():
+        continue
+    for source in sorted(novel.iterdir()):
+        if not source.is_dir():
+            continue
+        if (source / chapter_archive.ARCHIVE_NAME).exists() and not (source / "json").exists():
+            skipped += 1
+            continue
+        if not (source / "json").exists() and not (source / "json.7z").exists():
+            continue
+        if chapter_archive.convert_source(source):
+            done += 1
+        else:
+            failed += 1
+
+print(f"{done} converted, {failed} failed, {skipped} already converted")